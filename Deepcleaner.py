@@ -1,34 +1,17 @@
 import os
-import imagehash
-from PIL import Image
 import subprocess
-import cv2
-
-# Function to generate hash of an image
-def get_image_hash(image_path):
-    try:
-        img = Image.open(image_path)
-        return imagehash.phash(img)
-    except Exception as e:
-        print(f"Error processing {image_path}: {e}")
-        return None
-
-# Function to generate a hash from the first frame of a video
-def get_video_hash(video_path):
-    try:
-        # Open the video using OpenCV
-        video = cv2.VideoCapture(video_path)
-        ret, frame = video.read()
-        if not ret:
-            print(f"Could not read frame from video: {video_path}")
-            return None
-        # Convert the frame to grayscale and then hash it
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        pil_image = Image.fromarray(gray)
-        return imagehash.phash(pil_image)
-    except Exception as e:
-        print(f"Error processing video {video_path}: {e}")
-        return None
+from hamming_index import HammingIndex
+from feature_cache import FeatureCache
+from file_walker import ParallelWalker, VIDEO_EXTENSIONS
+from video_fingerprint import VideoSignatureIndex, stats as video_stats
+from media_hashing import (HASH_DISTANCE_THRESHOLD, HASH_WORKERS, get_cached_video_signature, get_file_hash,
+                           iter_file_hashes)
+from multi_hash import MultiHashIndex
+from grouping import DuplicateGroups, KEEPER_POLICY
+
+# Match images by a weighted vote of aHash, dHash, pHash, wHash and colour hash, all computed from one
+# decode, instead of by pHash alone
+USE_MULTI_HASH = True
 
 # Function to compare two hashes (image or video)
 def compare_files(file1, file2):
@@ -38,52 +21,101 @@ def compare_files(file1, file2):
         return False
     return hash1 - hash2  # This gives a distance; lower means more similar
 
-# Function to return the hash of a file (image or video)
-def get_file_hash(file_path):
-    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-        return get_image_hash(file_path)
-    elif file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):
-        return get_video_hash(file_path)
-    else:
-        return None
-
-# Function to process files and delete duplicates
-def process_files():
-    file_paths = []
-    duplicates = []
-
-    # Start from the root directory to scan the whole system (C:\ for Windows)
-    root_dir = 'C:\\'  # Change this to '/' for Linux or macOS
-    for root, dirs, files in os.walk(root_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            # Scan for both image and video files
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.mp4', '.avi', '.mov', '.mkv', '.flv')):
-                file_paths.append(file_path)
-
-    print(f"Found {len(file_paths)} files to process.")
-
-    hashes = {}
-
-    for path in file_paths:
-        file_hash = get_file_hash(path)
-        if file_hash is None:
+# Function to yield (path, original_path, distance) for every duplicate among the files. Images are
+# matched in `hashes` (a HammingIndex of pHashes or a MultiHashIndex of hash records), videos by aligned
+# frame sequences in `videos` once all images are hashed, so each video is decoded only once; unique files
+# are added. on_edge(path, original_path, kind, distance) is called for every stored file a duplicate
+# matches, not just the closest one. Duplicates are then stored as well, so a variant that only matches
+# another duplicate is still linked to its group whatever the scan order; the reported original is always
+# the closest unique file.
+def iter_duplicates(file_paths, cache, hashes, videos, workers=HASH_WORKERS, on_edge=None):
+    kind = "multihash" if isinstance(hashes, MultiHashIndex) else "phash"
+    duplicates = set()  # Stored duplicates, only ever linked to and never reported as an original
+    video_paths = []
+
+    def image_paths():
+        for path in file_paths:
+            if path.lower().endswith(VIDEO_EXTENSIONS):
+                video_paths.append(path)
+            else:
+                yield path
+
+    # Yields (path, image hash, video signature) with one of the two set
+    def fingerprints():
+        for path, file_hash in iter_file_hashes(image_paths(), cache, workers, kind=kind):
+            yield path, file_hash, None
+        for path in video_paths:
+            yield path, None, get_cached_video_signature(path, cache)
+
+    for path, file_hash, signature in fingerprints():
+        if file_hash is None and signature is None:
             continue  # Skip files that couldn't be processed
 
-        if file_hash in hashes:
-            print(f"Duplicate found: {path} and {hashes[file_hash]}")
-            # Ask user if they want to delete
-            delete = input(f"Do you want to delete {path}? (y/n): ")
-            if delete.lower() == 'y':
+        k = None if on_edge is not None else 1
+        if signature is not None:
+            matches = videos.query(signature, k=k)
+        else:
+            matches = hashes.query(file_hash, k=k)
+
+        if on_edge is not None:
+            for original_path, distance in matches:
+                on_edge(path, original_path, "video" if signature is not None else kind, distance)
+        originals = [match for match in matches if match[0] not in duplicates]
+        if originals:
+            original_path, distance = originals[0]
+            yield path, original_path, distance
+            if on_edge is None:
+                continue
+            duplicates.add(path)
+        if signature is not None:
+            videos.add(path, signature)
+        else:
+            hashes.add(path, file_hash)
+
+# Function to process files and delete duplicates. Matches are merged into groups, and each group is
+# offered for deletion once, keeping the file chosen by keeper_policy ("resolution", "size" or "oldest").
+def process_files(roots=None, exclude=None, max_distance=HASH_DISTANCE_THRESHOLD, workers=HASH_WORKERS,
+                  keeper_policy=KEEPER_POLICY):
+    # Stream image and video files from the scan roots (the whole drive by default)
+    walker = ParallelWalker(roots, exclude)
+    print(f"Scanning {', '.join(walker.roots)} for images and videos...")
+
+    if USE_MULTI_HASH:
+        hashes = MultiHashIndex(max_distance=max_distance)
+    else:
+        hashes = HammingIndex(max_distance=max_distance)
+    videos = VideoSignatureIndex()  # Trimmed or re-encoded videos are matched by aligned frame sequences
+    cache = FeatureCache()
+    groups = DuplicateGroups()
+
+    duplicates = 0
+    for path, original_path, distance in iter_duplicates(walker, cache, hashes, videos, workers, groups.add_edge):
+        duplicates += 1
+        print(f"Duplicate found: {path} and {original_path} (distance {distance:g})")
+
+    for cluster in groups.clusters(keeper_policy):
+        keeper, rest = cluster.proposal()
+        print(f"Duplicate group of {len(cluster)} files, keeping {keeper}:")
+        for path in rest:
+            print(f"  {path}")
+        # Ask user if they want to delete the rest of the group
+        delete = input(f"Do you want to delete these {len(rest)} files? (y/n): ")
+        if delete.lower() == 'y':
+            for path in rest:
                 try:
                     os.remove(path)
                     print(f"Deleted {path}")
                 except Exception as e:
                     print(f"Failed to delete {path}: {e}")
-        else:
-            hashes[file_hash] = path
 
-    print(f"Successfully processed {len(hashes)} unique files.")
+    cache.prune_stale(walker.roots)  # Drop entries for files that were deleted or changed
+    cache.close()
+
+    print(f"Scanned {walker.files} files.")
+    if video_stats.videos:
+        print(f"Fingerprinted {video_stats}")
+    # Duplicates are stored too while grouping
+    print(f"Successfully processed {len(hashes) + len(videos) - duplicates} unique files.")
 
 # Main function to start the process
 def main():
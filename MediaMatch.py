@@ -1,20 +1,16 @@
 import os
-import imagehash
-from PIL import Image
-import subprocess
-import cv2
+import time
 import tkinter as tk
 from tkinter import messagebox, ttk
 import threading
 import logging
-from concurrent.futures import ThreadPoolExecutor
-import hashlib
 import shutil
-import numpy as np
-from tensorflow.keras.applications import VGG16
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.vgg16 import preprocess_input
-from sklearn.metrics.pairwise import cosine_similarity
+from mediamatch_core import DuplicateScan, load_model_async
+from checkpoint import ScanCheckpoint, checkpoint_path
+from file_walker import default_roots
+from review_queue import ActionWorker, ReviewQueue
+from file_actions import latest_journal, mirrored_path, undo, unused_path
+from metrics import METRICS, MetricsReporter
 
 # Setup logging
 logging.basicConfig(filename='duplicate_finder.log', level=logging.DEBUG, format='%(asctime)s - %(message)s')
@@ -23,14 +19,28 @@ logging.basicConfig(filename='duplicate_finder.log', level=logging.DEBUG, format
 popup_active = False
 abort_scan = False
 scan_event = threading.Event()  # Event to control the scanner's waiting state
-executor = ThreadPoolExecutor(max_workers=4)  # Executor for parallel processing
+current_scan = None
+active_popup = None
 progress_bar = None
 
-# Backup folder path
+# Backup folder path (backups mirror the original folder structure)
 BACKUP_DIR = r"C:\Backup"
 
-# Load pre-trained VGG16 model for feature extraction
-model = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+# How the review window gets rid of checked files: label -> file_actions action
+REVIEW_ACTIONS = {
+    "Move to quarantine (can be undone)": "quarantine",
+    "Delete": "delete",
+    "Replace identical files with hard links": "hardlink",
+}
+
+# Scan metrics (counters, latencies, queue depths) are written here every few seconds while a scan runs
+METRICS_PATH = os.path.join(os.path.expanduser("~"), ".mediamatch", "metrics.json")
+
+# Milliseconds between two progress bar updates
+PROGRESS_INTERVAL_MS = 500
+
+# Duplicate groups shown per page of the review window (Tk slows down with many thousands of widgets)
+REVIEW_PAGE_SIZE = 100
 
 
 # Function to ask the user if they want to back up the duplicate file
@@ -49,9 +59,10 @@ def backup_file(file_path):
         os.makedirs(BACKUP_DIR)
 
     try:
-        # Create a backup by copying the file to the backup directory
-        backup_path = os.path.join(BACKUP_DIR, os.path.basename(file_path))
-        shutil.copy(file_path, backup_path)
+        # Create a backup by copying the file to the same relative path below the backup directory
+        backup_path = unused_path(mirrored_path(BACKUP_DIR, file_path))
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        shutil.copy2(file_path, backup_path)
         logging.info(f"Backed up file: {file_path} to {backup_path}")
     except Exception as e:
         logging.error(f"Error while backing up {file_path}: {e}")
@@ -60,138 +71,83 @@ def backup_file(file_path):
 # Function to delete all backup files in the backup directory
 def delete_backups():
     try:
-        # Loop through and delete all files in the backup directory
-        for filename in os.listdir(BACKUP_DIR):
-            file_path = os.path.join(BACKUP_DIR, filename)
-            if os.path.isfile(file_path):
+        # Loop through and delete all files below the backup directory
+        for directory, _, filenames in os.walk(BACKUP_DIR):
+            for filename in filenames:
+                file_path = os.path.join(directory, filename)
                 os.remove(file_path)
                 logging.info(f"Deleted backup file: {file_path}")
     except Exception as e:
         logging.error(f"Error while deleting backup files: {e}")
 
 
-# Function to extract features from an image using VGG16
-def extract_image_features(image_path):
-    try:
-        img = Image.open(image_path)
-        img = img.resize((224, 224))  # Resize to VGG16 input size
-        img_array = np.array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
-        features = model.predict(img_array)
-        return features.flatten()  # Flatten the features to a 1D array
-    except Exception as e:
-        logging.error(f"Error processing {image_path}: {e}")
-        return None
+# Function to return the checkpoint of scans over the given roots (the whole drive by default)
+def get_checkpoint(roots=None):
+    return ScanCheckpoint(checkpoint_path(roots or default_roots()))
+
 
+# Function to process files and delete duplicates. With a review_queue the scan never waits for
+# the user: duplicates are collected into clusters and reviewed in bulk after the scan.
+# The scan is checkpointed, and resume=True continues the last interrupted scan of the roots.
+def process_files(progress_callback, result_callback, roots=None, exclude=None, review_queue=None, resume=False):
+    global current_scan
 
-# Function to extract features from a video by sampling frames using VGG16
-def extract_video_features(video_path):
+    # Stream image and video files from the scan roots while they are being discovered
+    scan = current_scan = DuplicateScan(roots, exclude, checkpoint=get_checkpoint(roots), resume=resume)
+    os.makedirs(os.path.dirname(METRICS_PATH), exist_ok=True)
+    reporter = MetricsReporter(METRICS_PATH).start()
     try:
-        video = cv2.VideoCapture(video_path)
-        frames_to_sample = 5  # Sample 5 frames at regular intervals
-        features = []
-        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        interval = total_frames // frames_to_sample
-        for i in range(0, total_frames, interval):
-            video.set(cv2.CAP_PROP_POS_FRAMES, i)
-            ret, frame = video.read()
-            if not ret:
-                logging.warning(f"Could not read frame at position {i}")
+        if scan.resumed:
+            progress_callback(f"Resuming scan, {len(scan.processed)} files already processed.")
+        progress_callback(f"Scanning {', '.join(scan.walker.roots)}...")
+        update_status_bar("Scanning files...")  # Update status bar for the scanning process
+
+        for path, existing_file, stage, score in scan:
+            if abort_scan:
+                break  # If aborted, stop processing
+
+            progress_callback(f"Duplicate found ({stage}): {path} and {existing_file}")
+
+            if review_queue is not None:
+                review_queue.add(path, existing_file, stage, score)  # Reviewed in bulk once the scan finishes
                 continue
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            pil_image = Image.fromarray(gray)
-            frame_features = extract_image_features(pil_image)
-            if frame_features is not None:
-                features.append(frame_features)
-        video.release()
-        return features
-    except Exception as e:
-        logging.error(f"Error processing video {video_path}: {e}")
-        return None
 
+            # Ask user if they want to back up the duplicate file before deletion
+            if ask_backup(path):
+                backup_file(path)
 
-# Function to compare two images or videos based on their features
-def compare_features(features1, features2):
-    return cosine_similarity([features1], [features2])[0][0]  # Similarity score between 0 and 1
+            # Ask if they want to delete the duplicate file
+            progress_callback(f"Do you want to delete {path}? (y/n)")
 
+            # Show custom popup window for user input to confirm deletion
+            show_deletion_popup(path, existing_file)
 
-# Function to get AI-powered features from a file (image or video)
-def get_file_features(file_path):
-    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):  # Image formats
-        return extract_image_features(file_path)
-    elif file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):  # Video formats
-        return extract_video_features(file_path)
-    else:
-        return None
+            # Wait for the user to interact with the popup before proceeding
+            scan_event.wait()  # Wait until the event is set by popup action (delete/skip) or by abort
+            if not abort_scan:
+                scan.resolve(path)  # The decision is made, a resumed scan will not ask again
 
+            # Reset event for next pop-up
+            scan_event.clear()
 
-# Function to process files and delete duplicates
-def process_files(progress_callback, result_callback):
-    global abort_scan
-    file_paths = []
-    features_dict = {}
-
-    excluded_dirs = [
-        r"Program Files", r"Windows", r"AppData", r"ProgramData", r"C:\Users\Lenovo\anaconda3",
-        r"C:\Users\Lenovo\.vscode",
-        r"Intel", r"DRIVER", r"Program Files (x86)", r"Users\Public", r"System Volume Information"
-    ]
-
-    for root, dirs, files in os.walk("C:\\"):
-        if any(excluded in root for excluded in excluded_dirs):
-            continue
-        for file in files:
-            file_path = os.path.join(root, file)
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.mp4', '.avi', '.mov', '.mkv', '.flv')):
-                file_paths.append(file_path)
-
-    progress_callback(f"Found {len(file_paths)} files to process.")
-    update_status_bar("Scanning files...")  # Update status bar for the scanning process
-
-    for path in file_paths:
-        if abort_scan:
-            break  # If aborted, stop processing
-
-        file_features = get_file_features(path)
-        if file_features is None:
-            continue
-
-        duplicate_found = False
-        for existing_file, existing_features in features_dict.items():
-            similarity = compare_features(file_features, existing_features)
-            if similarity > 0.9:  # If similarity is greater than 90%, flag as duplicate
-                progress_callback(f"Duplicate found: {path} and {existing_file}")
-
-                # Ask user if they want to back up the duplicate file before deletion
-                if ask_backup(path):
-                    backup_file(path)
-
-                # Ask if they want to delete the duplicate file
-                progress_callback(f"Do you want to delete {path}? (y/n)")
-
-                # Show custom popup window for user input to confirm deletion
-                show_deletion_popup(path, existing_file)
-
-                # Wait for the user to interact with the popup before proceeding
-                scan_event.wait()  # Wait until the event is set by popup action (delete/skip)
-
-                # Reset event for next pop-up
-                scan_event.clear()
-                duplicate_found = True
-                break
-
-        if not duplicate_found:
-            features_dict[path] = file_features  # Store the file features if no duplicate found
-
-    # Ask if the user wants to delete backups after all processing
-    if ask_delete_backups():
+        if review_queue is not None:
+            review_queue.update(scan.groups)  # Every match the scan saw, so variants of a file share one group
+
+        for line in scan.report():
+            progress_callback(line)  # Per-stage counts and timings
+    finally:
+        scan.close()
+        reporter.stop()  # Also when the scan fails, so the reporter thread stops writing
+
+    # Ask if the user wants to delete backups after all processing (in batch review this is asked
+    # once the reviewed deletions have been applied)
+    if review_queue is None and ask_delete_backups():
         delete_backups()
 
     if abort_scan:
-        result_callback("Scan aborted.")
+        result_callback("Scan aborted. Start a new scan to resume where it stopped.")
     else:
-        result_callback(f"Successfully processed {len(features_dict)} unique files.")
+        result_callback(f"Successfully processed {scan.unique_files()} unique files out of {scan.walker.files} scanned.")
         update_status_bar("Scan completed.")  # Update status bar when scan finishes
 
 
@@ -207,7 +163,8 @@ def show_deletion_popup(path, original_path):
 
 
 def create_popup(path, original_path):
-    popup = tk.Toplevel()
+    global active_popup
+    popup = active_popup = tk.Toplevel()
     popup.title("Confirm Deletion")
 
     label = tk.Label(popup, text=f"Duplicate found: {path}\nOriginal: {original_path}\nDo you want to delete it?",
@@ -246,19 +203,163 @@ def create_popup(path, original_path):
 
 # Set the flag back to False when the popup is closed
 def set_popup_inactive():
-    global popup_active
+    global popup_active, active_popup
     popup_active = False
+    active_popup = None
+
+
+# Batch review window: one group per duplicate cluster, checked files are deleted
+def show_review_window(review_queue):
+    clusters = review_queue.snapshot()
+    review = tk.Toplevel(window)
+    review.title("Review Duplicates")
+    review.geometry("800x500")
+
+    label = tk.Label(review, text=f"{len(clusters)} duplicate groups, {review_queue.duplicate_count()} duplicates. "
+                                  f"Checked files will be deleted.", font=("Helvetica", 12))
+    label.pack(pady=5)
+
+    # Scrollable list of the clusters of one page
+    canvas = tk.Canvas(review)
+    scrollbar = tk.Scrollbar(review, orient="vertical", command=canvas.yview)
+    inner = tk.Frame(canvas)
+    inner.bind("<Configure>", lambda event: canvas.configure(scrollregion=canvas.bbox("all")))
+    canvas.create_window((0, 0), window=inner, anchor="nw")
+    canvas.configure(yscrollcommand=scrollbar.set)
+
+    # The checked files of every cluster are kept here, only the shown page has widgets
+    paths = [cluster.paths() for cluster in clusters]
+    proposed = [cluster.proposal()[0] for cluster in clusters]
+    checked = []
+    page = tk.IntVar(value=0)
+    pages = max(1, -(-len(clusters) // REVIEW_PAGE_SIZE))
+
+    def keep_best():
+        checked[:] = [{path for path in cluster_paths if path != keeper}
+                      for cluster_paths, keeper in zip(paths, proposed)]
+
+    def toggle(index, path, selected):
+        if selected.get():
+            checked[index].add(path)
+        else:
+            checked[index].discard(path)
+
+    def show_page():
+        for child in inner.winfo_children():
+            child.destroy()
+        start = page.get() * REVIEW_PAGE_SIZE
+        for index in range(start, min(start + REVIEW_PAGE_SIZE, len(clusters))):
+            group = tk.LabelFrame(inner, text=f"Group {index + 1}")
+            group.pack(fill=tk.X, padx=5, pady=3)
+            for path in paths[index]:
+                selected = tk.BooleanVar(value=path in checked[index])
+                tk.Checkbutton(group, text=path, variable=selected, anchor="w",
+                               command=lambda index=index, path=path, selected=selected: toggle(index, path, selected)
+                               ).pack(fill=tk.X)
+        page_label.config(text=f"Page {page.get() + 1} of {pages}")
+        canvas.yview_moveto(0)
+
+    def turn_page(step):
+        page.set(min(max(page.get() + step, 0), pages - 1))
+        show_page()
+
+    review_action = tk.StringVar(value=next(iter(REVIEW_ACTIONS)))
+
+    def keep_best_action():
+        keep_best()
+        show_page()
+
+    def apply_action():
+        for index, cluster_paths in enumerate(paths):
+            if len(checked[index]) == len(cluster_paths):
+                messagebox.showwarning("Review Duplicates", f"Group {index + 1} would lose every copy. "
+                                                            f"Leave at least one file unchecked.")
+                return
+        chosen = [(index, path) for index, cluster_checked in enumerate(checked) for path in cluster_checked]
+        label = review_action.get()
+        action = REVIEW_ACTIONS[label]
+        if not chosen or not messagebox.askyesno("Confirm", f"{label}: {len(chosen)} files?"):
+            return
+
+        # Links point at the file each group keeps: the proposed one, or the first unchecked one
+        keepers = []
+        for index, cluster_paths in enumerate(paths):
+            keeper = proposed[index]
+            keepers.append(keeper if keeper not in checked[index] else
+                           next(path for path in cluster_paths if path not in checked[index]))
+
+        def finished(done, failed):
+            update_progress(f"{label}: {done} duplicates done, {failed} failed. "
+                            f"Use \"Undo Last Cleanup\" to reverse it (deletions cannot be undone).")
+            progress_bar.stop()
+
+        worker = ActionWorker(on_progress=lambda message: window.after(0, update_progress, message),
+                              on_finished=lambda done, failed: window.after(0, finished, done, failed))
+        for index, path in chosen:
+            worker.submit(path, action, keepers[index])
+        worker.close()
+        progress_bar.start()  # Deletions run in the background
+        review.destroy()
+
+    buttons = tk.Frame(review)
+    buttons.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+    tk.OptionMenu(buttons, review_action, *REVIEW_ACTIONS).pack(side=tk.LEFT, padx=10)
+    tk.Button(buttons, text="Keep Best, Delete Rest", command=keep_best_action, font=("Helvetica", 12)).pack(
+        side=tk.LEFT, padx=5)
+    tk.Button(buttons, text="Apply", command=apply_action, bg="#ff6347", fg="white", font=("Helvetica", 12)).pack(
+        side=tk.LEFT, padx=5)
+    tk.Button(buttons, text="Close", command=review.destroy, font=("Helvetica", 12)).pack(side=tk.RIGHT, padx=10)
+    tk.Button(buttons, text="Next >", command=lambda: turn_page(1)).pack(side=tk.RIGHT, padx=5)
+    page_label = tk.Label(buttons, text="")
+    page_label.pack(side=tk.RIGHT, padx=5)
+    tk.Button(buttons, text="< Previous", command=lambda: turn_page(-1)).pack(side=tk.RIGHT, padx=5)
+
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    keep_best()
+    show_page()
 
 
 # GUI Updates and Callbacks
 def start_processing():
+    global abort_scan
+    abort_scan = False
+    scan_event.clear()
+    resume = get_checkpoint().exists() and messagebox.askyesno(
+        "Resume Scan", "A previous scan was interrupted. Do you want to continue where it stopped?")
     update_status_bar("Scanning...")  # Update status bar as soon as scan starts
-    progress_bar.start()  # Start the progress bar
-    threading.Thread(target=run_processing, daemon=True).start()
+    progress_bar.start()  # Spins until the first files have been found
+    review_queue = ReviewQueue() if batch_review.get() else None
+    thread = threading.Thread(target=run_processing, args=(review_queue, resume), daemon=True)
+    thread.start()
+    window.after(PROGRESS_INTERVAL_MS, poll_progress, thread)
+
+
+# Function to show how many of the files found so far have been processed, until the scan thread ends
+def poll_progress(thread):
+    scan = current_scan
+    if scan is not None:
+        processed, discovered, done = scan.progress()
+        if discovered:
+            if str(progress_bar["mode"]) != "determinate":
+                progress_bar.stop()
+                progress_bar.config(mode="determinate")
+            # The total grows while files are still being discovered, so the bar can move backwards
+            progress_bar.config(maximum=discovered, value=processed)
+            # Files decided by this run, a resumed scan starts with files that were already processed
+            rate = METRICS.counters.get("files_processed", 0) / max(time.time() - METRICS.started, 1e-6)
+            progress_label.config(text=f"{processed} of {discovered}{'' if done else '+'} files, "
+                                       f"{rate:.1f} files/sec")
+    if thread.is_alive():
+        window.after(PROGRESS_INTERVAL_MS, poll_progress, thread)
+    else:
+        progress_bar.config(mode="indeterminate", value=0)  # Deletions after the review spin again
 
 
-def run_processing():
-    process_files(update_progress, show_result)
+def run_processing(review_queue=None, resume=False):
+    process_files(update_progress, show_result, review_queue=review_queue, resume=resume)
+    if review_queue is not None and len(review_queue) and not abort_scan:
+        window.after(0, show_review_window, review_queue)  # Review window must be created on the main thread
 
 
 def update_progress(message):
@@ -277,19 +378,48 @@ def show_result(message):
 def abort_scan_process():
     global abort_scan
     abort_scan = True
+    if current_scan is not None:
+        current_scan.abort()  # Stops after the file in progress and saves a checkpoint
+    if active_popup is not None:
+        active_popup.destroy()  # Do not leave the scan waiting on an unanswered popup
+        set_popup_inactive()
+    scan_event.set()
     progress_text.insert(tk.END, "Aborting scan...\n")
     progress_text.yview(tk.END)
     update_status_bar("Scan aborted")
     progress_bar.stop()  # Stop progress bar
 
 
+# Function to reverse the most recent cleanup from its journal on a background thread
+def undo_last_cleanup():
+    journal = latest_journal()
+    if journal is None:
+        messagebox.showinfo("Undo Last Cleanup", "There is no cleanup to undo.")
+        return
+    if not messagebox.askyesno("Undo Last Cleanup", "Restore the files moved or linked by the last cleanup?"):
+        return
+
+    def run_undo():
+        undone, failed = undo(journal, on_progress=lambda message: window.after(0, update_progress, message))
+        window.after(0, update_progress, f"Undid {undone} actions, {failed} could not be undone.")
+
+    threading.Thread(target=run_undo, daemon=True).start()
+
+
 def update_status_bar(message):
     status_bar.config(text=message)
 
 
 # Setup the GUI
 def setup_gui():
-    global window, progress_text, progress_bar, status_bar
+    build_gui()
+    load_model_async()  # The CNN loads in the background while the window is already usable
+    window.mainloop()
+
+
+# Function to create the main window and its widgets without entering the event loop
+def build_gui():
+    global window, progress_text, progress_bar, progress_label, status_bar, batch_review
 
     window = tk.Tk()
     window.title("AI-Powered Duplicate Finder")
@@ -301,7 +431,9 @@ def setup_gui():
 
     # Create and configure the progress bar
     progress_bar = ttk.Progressbar(window, orient="horizontal", length=400, mode="indeterminate")
-    progress_bar.pack(pady=10)
+    progress_bar.pack(pady=(10, 0))
+    progress_label = tk.Label(window, text="", font=("Helvetica", 10))
+    progress_label.pack()
 
     # Create and configure the start button
     start_button = tk.Button(window, text="Start Scan", command=start_processing, bg="#32cd32", fg="white",
@@ -311,6 +443,12 @@ def setup_gui():
     # Tooltip for Start Scan button
     start_button.tooltip = create_tooltip(start_button, "Click to start scanning for duplicates.")
 
+    # Collect duplicates and review them after the scan instead of pausing the scan for each one
+    batch_review = tk.BooleanVar(value=True)
+    batch_review_button = tk.Checkbutton(window, text="Review duplicates after the scan", variable=batch_review,
+                                         font=("Helvetica", 10))
+    batch_review_button.pack()
+
     # Create and configure the abort button
     abort_button = tk.Button(window, text="Abort Scan", command=abort_scan_process, bg="#ff6347", fg="white",
                              font=("Helvetica", 12))
@@ -319,11 +457,14 @@ def setup_gui():
     # Tooltip for Abort button
     abort_button.tooltip = create_tooltip(abort_button, "Click to abort the scan process.")
 
+    undo_button = tk.Button(window, text="Undo Last Cleanup", command=undo_last_cleanup, font=("Helvetica", 10))
+    undo_button.pack()
+    undo_button.tooltip = create_tooltip(undo_button, "Move quarantined files back and turn links into copies.")
+
     # Create a text box for progress messages
     progress_text = tk.Text(window, height=15, width=80, font=("Helvetica", 10), wrap=tk.WORD)
     progress_text.pack(pady=10)
-
-    window.mainloop()
+    return window
 
 
 def create_tooltip(widget, text):
@@ -342,4 +483,5 @@ def create_tooltip(widget, text):
 
 
 # Start the GUI
-setup_gui()
+if __name__ == "__main__":
+    setup_gui()
@@ -1,9 +1,15 @@
 import os
-import imagehash
-from PIL import Image
-import cv2
+from hamming_index import HammingIndex
+from feature_cache import FeatureCache
+from file_walker import ParallelWalker, VIDEO_EXTENSIONS
+from media_hashing import HASH_DISTANCE_THRESHOLD, get_cached_file_hash, get_cached_file_record
+from multi_hash import MultiHashIndex
+from review_queue import ActionWorker, ReviewQueue
+from mobile_scan import MobileScan, media_roots
+from embedding_backends import backend_available
 import threading
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
@@ -18,85 +24,73 @@ popup_active = False
 abort_scan = False
 scan_event = threading.Event()  # Event to control the scanner's waiting state
 progress_text = None  # To reference progress text
+current_scan = None  # The running low-memory scan
 
-# Function to generate hash of an image
-def get_image_hash(image_path):
-    try:
-        img = Image.open(image_path)
-        return imagehash.phash(img)
-    except Exception as e:
-        print(f"Error processing {image_path}: {e}")
-        return None
+# Match images by a weighted vote of aHash, dHash, pHash, wHash and colour hash, all computed from one
+# decode, instead of by pHash alone
+USE_MULTI_HASH = True
 
-# Function to generate a hash from the first frame of a video
-def get_video_hash(video_path):
-    try:
-        # Open the video using OpenCV
-        video = cv2.VideoCapture(video_path)
-        ret, frame = video.read()
-        if not ret:
-            print(f"Could not read frame from video: {video_path}")
-            return None
-        # Convert the frame to grayscale and then hash it
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        pil_image = Image.fromarray(gray)
-        return imagehash.phash(pil_image)
-    except Exception as e:
-        print(f"Error processing video {video_path}: {e}")
-        return None
-
-# Function to return the hash of a file (image or video)
-def get_file_hash(file_path):
-    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-        return get_image_hash(file_path)
-    elif file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):
-        return get_video_hash(file_path)
-    else:
-        return None
+# Collect duplicates and review them in bulk after the scan instead of pausing the scan for each one
+BATCH_REVIEW = True
 
-# Function to process files and delete duplicates
-def process_files(progress_callback, result_callback):
-    global abort_scan
-    file_paths = []
-    hashes = {}
+# Scan the media directories one file at a time on a worker thread with bounded memory, slowing down or
+# pausing on low battery or a hot phone (see mobile_scan.py), instead of the threaded desktop-style scan
+LOW_MEMORY_MODE = True
 
-    excluded_dirs = [
-        r"Program Files", r"Windows", r"AppData", r"ProgramData", r"C:\Users\Lenovo\anaconda3", r"C:\Users\Lenovo\.vscode",
-        r"Intel", r"DRIVER", r"Program Files (x86)", r"Users\Public", r"System Volume Information"
-    ]
+# CNN that decides borderline pHash matches in the low-memory scan (a TFLite model from embedding_backends.py,
+# only used if tflite_runtime is installed and the model file is on the phone), and the threads it may use
+ON_DEVICE_BACKEND = "mobilenet_v3_small"
+ON_DEVICE_THREADS = 2
 
-    for root, dirs, files in os.walk("C:\\"):
-        if any(excluded in root for excluded in excluded_dirs):
-            continue
-        for file in files:
-            file_path = os.path.join(root, file)
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.mp4', '.avi', '.mov', '.mkv', '.flv')):
-                file_paths.append(file_path)
+# Function to process files and delete duplicates
+def process_files(progress_callback, result_callback, roots=None, exclude=None, max_distance=HASH_DISTANCE_THRESHOLD,
+                  review_queue=None):
+    global abort_scan
+    if USE_MULTI_HASH:
+        hashes = MultiHashIndex(max_distance=max_distance)
+        videos = HammingIndex(max_distance=max_distance)  # Videos only have a frame pHash, matched by it alone
+    else:
+        hashes = videos = HammingIndex(max_distance=max_distance)
+    cache = FeatureCache()
 
-    progress_callback(f"Found {len(file_paths)} files to process.")
+    # Stream image and video files from the media directories while they are being discovered
+    walker = ParallelWalker(roots or media_roots(), exclude)
+    progress_callback(f"Scanning {', '.join(walker.roots)}...")
 
-    for path in file_paths:
+    for path in walker:
         if abort_scan:
             break  # If aborted, stop processing
 
-        file_hash = get_file_hash(path)
+        index = videos if path.lower().endswith(VIDEO_EXTENSIONS) else hashes
+        if index is hashes and USE_MULTI_HASH:
+            file_hash = get_cached_file_record(path, cache)
+        else:
+            file_hash = get_cached_file_hash(path, cache)
         if file_hash is None:
             continue
 
-        if file_hash in hashes:
-            progress_callback(f"Duplicate found: {path} and {hashes[file_hash]}")
-            progress_callback(f"Do you want to delete {path}? (y/n)")
+        matches = index.query(file_hash)
+        if matches:
+            original_path, distance = matches[0]
+            progress_callback(f"Duplicate found: {path} and {original_path} (distance {distance})")
+
+            if review_queue is not None:
+                # Reviewed in bulk once the scan finishes; every match links the file into the same group
+                for original_path, distance in matches:
+                    review_queue.add(path, original_path, "phash", distance)
+            else:
+                progress_callback(f"Do you want to delete {path}? (y/n)")
 
-            # Show custom popup window for user input to confirm deletion
-            show_deletion_popup(path, hashes[file_hash])
+                # Show custom popup window for user input to confirm deletion
+                show_deletion_popup(path, original_path)
 
-            # Wait for the user to interact with the popup before proceeding
-            scan_event.wait()  # Wait until the event is set by popup action (delete/skip)
+                # Wait for the user to interact with the popup before proceeding
+                scan_event.wait()  # Wait until the event is set by popup action (delete/skip)
 
-            # Reset event for next pop-up
-            scan_event.clear()
+                # Reset event for next pop-up
+                scan_event.clear()
         else:
-            hashes[file_hash] = path
+            index.add(path, file_hash)
 
         # Check abort scan flag frequently during processing
         if abort_scan:
@@ -104,7 +98,13 @@ def process_files(progress_callback, result_callback):
             break  # Exit the loop early if abort flag is set
 
     if not abort_scan:
-        result_callback(f"Successfully processed {len(hashes)} unique files.")
+        cache.prune_stale(walker.roots)  # Drop entries for files that were deleted or changed
+    cache.close()
+
+    if not abort_scan:
+        progress_callback(f"Scanned {walker.files} files.")
+        unique = len(hashes) + (len(videos) if videos is not hashes else 0)
+        result_callback(f"Successfully processed {unique} unique files.")
 
 # Custom Popup Window for Deletion
 def show_deletion_popup(path, original_path):
@@ -114,7 +114,7 @@ def show_deletion_popup(path, original_path):
 
     # Set the flag to indicate a popup is active
     popup_active = True
-    window.after(0, create_popup, path, original_path)  # Ensure popup runs in the main thread
+    Clock.schedule_once(lambda dt: create_popup(path, original_path))  # Ensure popup runs in the Kivy thread
 
 def create_popup(path, original_path):
     # Create Kivy popup window for deletion confirmation
@@ -122,19 +122,20 @@ def create_popup(path, original_path):
     label = Label(text=f"Duplicate found: {path}\nOriginal: {original_path}\nDo you want to delete it?")
     layout.add_widget(label)
 
+    popup = Popup(title="Confirm Deletion", content=layout, size_hint=(0.7, 0.5), auto_dismiss=False)
+
     # Buttons for delete and skip actions
     button_layout = BoxLayout(size_hint_y=None, height=50)
     delete_button = Button(text="Delete", background_color=(1, 0, 0, 1))
-    delete_button.bind(on_press=lambda x: delete_action(path))
+    delete_button.bind(on_press=lambda x: (popup.dismiss(), delete_action(path)))
     skip_button = Button(text="Skip", background_color=(0, 1, 0, 1))
-    skip_button.bind(on_press=skip_action)
+    skip_button.bind(on_press=lambda x: (popup.dismiss(), skip_action()))
 
     button_layout.add_widget(delete_button)
     button_layout.add_widget(skip_button)
     layout.add_widget(button_layout)
 
     # Show the popup
-    popup = Popup(title="Confirm Deletion", content=layout, size_hint=(0.7, 0.5))
     popup.open()
 
 def delete_action(path):
@@ -154,6 +155,94 @@ def skip_action():
 def set_popup_inactive():
     global popup_active
     popup_active = False
+    if current_scan is not None:
+        current_scan.resume()  # The low-memory scan pauses while the popup is open
+
+# Batch review popup: lists every duplicate cluster and deletes all but the best file of each
+def show_review_popup(review_queue):
+    clusters = review_queue.snapshot()
+    proposals = [cluster.proposal() for cluster in clusters]
+
+    layout = BoxLayout(orientation='vertical')
+    layout.add_widget(Label(text=f"{len(clusters)} duplicate groups, {review_queue.duplicate_count()} duplicates",
+                            size_hint_y=None, height=40))
+
+    cluster_list = GridLayout(cols=1, size_hint_y=None, spacing=5)
+    cluster_list.bind(minimum_height=cluster_list.setter('height'))
+    for keeper, rest in proposals:
+        text = f"Keep: {keeper}\n" + "\n".join(f"Delete: {path}" for path in rest)
+        cluster_list.add_widget(Label(text=text, size_hint_y=None, height=30 * (len(rest) + 1)))
+    scroll_view = ScrollView()
+    scroll_view.add_widget(cluster_list)
+    layout.add_widget(scroll_view)
+
+    popup = Popup(title="Review Duplicates", content=layout, size_hint=(0.9, 0.9))
+
+    def apply_action(instance):
+        popup.dismiss()
+        worker = ActionWorker(on_progress=lambda message: Clock.schedule_once(lambda dt: update_progress(message)),
+                              on_finished=lambda done, failed: Clock.schedule_once(
+                                  lambda dt: update_progress(f"Deleted {done} duplicates, {failed} failed.")))
+        for keeper, rest in proposals:
+            for path in rest:
+                worker.submit(path, "delete", keeper)
+        worker.close()
+
+    button_layout = BoxLayout(size_hint_y=None, height=50)
+    delete_button = Button(text="Keep Best, Delete Rest", background_color=(1, 0, 0, 1))
+    delete_button.bind(on_press=apply_action)
+    cancel_button = Button(text="Cancel", background_color=(0, 1, 0, 1))
+    cancel_button.bind(on_press=lambda instance: popup.dismiss())
+    button_layout.add_widget(delete_button)
+    button_layout.add_widget(cancel_button)
+    layout.add_widget(button_layout)
+    popup.open()
+
+# Function to run the scan and open the review popup on the Kivy thread when it finishes
+def run_processing(review_queue=None):
+    # Widgets may only be touched from the Kivy thread
+    process_files(lambda message: Clock.schedule_once(lambda dt: update_progress(message)),
+                  lambda message: Clock.schedule_once(lambda dt: show_result(message)), review_queue=review_queue)
+    if review_queue is not None and len(review_queue) and not abort_scan:
+        Clock.schedule_once(lambda dt: show_review_popup(review_queue))
+
+# Function to start the low-memory scan on its worker thread; duplicates go to the review queue or,
+# without one, pause the scan until the user has answered the popup
+def start_mobile_scan(review_queue=None):
+    global current_scan
+    cache = FeatureCache()
+
+    def on_duplicate(path, matches, stage):
+        original_path, score = matches[0]
+        score_name = "similarity" if stage == "cnn" else "distance"
+        update_progress(f"Duplicate found: {path} and {original_path} ({score_name} {score:.4g})")
+        if review_queue is not None:
+            for original_path, score in matches:
+                review_queue.add(path, original_path, stage, score)
+        else:
+            current_scan.pause()
+            create_popup(path, original_path)
+
+    def on_finished(scan):
+        if scan.aborted:
+            update_progress("Scan aborted.")
+            return
+        update_progress(f"Scanned {scan.scanned} files.")
+        show_result(f"Successfully processed {scan.unique_files()} unique files.")
+        if review_queue is not None and len(review_queue):
+            show_review_popup(review_queue)
+
+    feature_fn = None
+    if ON_DEVICE_BACKEND and backend_available(ON_DEVICE_BACKEND):
+        import mediamatch_core  # The model itself is loaded on the first borderline match
+        mediamatch_core.EMBEDDING_BACKEND = ON_DEVICE_BACKEND
+        mediamatch_core.EMBEDDING_THREADS = ON_DEVICE_THREADS
+        feature_fn = lambda path: mediamatch_core.get_cached_features(path, cache)
+
+    current_scan = MobileScan(cache=cache, on_duplicate=on_duplicate, on_status=update_progress,
+                              on_finished=on_finished, feature_fn=feature_fn, multi_hash=USE_MULTI_HASH)
+    update_progress(f"Scanning {', '.join(current_scan.roots)}...")
+    current_scan.start()
 
 # GUI Updates and Callbacks
 def update_progress(message):
@@ -167,13 +256,21 @@ def abort_scan_process(instance):
     global abort_scan
     abort_scan = True
     progress_text.text += "Aborting scan...\n"
+    if current_scan is not None:
+        current_scan.abort()
 
 
 # Define the start_processing function
 def start_processing(instance):
+    global abort_scan
+    abort_scan = False
     progress_text.text = "Starting scan...\n"
-    # Run the file scanning process in a separate thread to keep the GUI responsive
-    threading.Thread(target=process_files, args=(update_progress, show_result)).start()
+    review_queue = ReviewQueue() if BATCH_REVIEW else None
+    if LOW_MEMORY_MODE:
+        start_mobile_scan(review_queue)  # Hashes on a worker thread, results are posted to the Kivy clock
+    else:
+        # Run the file scanning process in a separate thread to keep the GUI responsive
+        threading.Thread(target=run_processing, args=(review_queue,)).start()
 
 # Kivy Layout and UI elements
 class DuplicateFileFinderApp(App):
@@ -0,0 +1,115 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from image_decode import load_resized
+from metrics import METRICS, timed_call
+from prefetch import Prefetcher, buffer_source
+
+# Batched CNN feature extraction. Images are read ahead by a Prefetcher, decoded
+# and resized from memory on a thread or process pool while the model runs,
+# collected into batches of `batch_size` and sent to the model in a single call,
+# which removes most of the per-call overhead of predicting one 224x224 image at a time.
+
+
+# Function to decode an image (path or PIL image) into a model-sized RGB array
+def load_model_input(image, target_size=(224, 224)):
+    return np.asarray(load_resized(image, target_size), dtype=np.float32)
+
+
+# Function to decode an image (from data, its contents, if already read) into a uint8 model input,
+# returning None on failure. Module-level so it can run on a process pool; uint8 keeps the transfer back small.
+def decode_model_input(image_path, target_size=(224, 224), data=None):
+    try:
+        return np.asarray(load_resized(buffer_source(image_path, data), target_size), dtype=np.uint8)
+    except Exception as e:
+        logging.error(f"Error processing {image_path}: {e}")
+        return None
+
+
+class BatchFeatureExtractor:
+    def __init__(self, model, preprocess=None, batch_size=32, executor=None, decode_workers=4,
+                 target_size=(224, 224), prefetcher=None):
+        self.model = model
+        self.preprocess = preprocess
+        self.batch_size = batch_size
+        self.executor = executor
+        self.decode_workers = decode_workers
+        self.target_size = target_size
+        self.prefetcher = prefetcher or Prefetcher()
+        self.images = 0
+        self.seconds = 0.0
+
+    # Images per second over everything extracted so far
+    def throughput(self):
+        if self.seconds == 0:
+            return 0.0
+        return self.images / self.seconds
+
+    def _predict(self, paths, arrays):
+        batch = np.stack(arrays).astype(np.float32)
+        if self.preprocess is not None:
+            batch = self.preprocess(batch)
+        with METRICS.timed("inference"):
+            features = np.asarray(self.model.predict_on_batch(batch))
+        METRICS.count("inference_images", len(arrays))
+        return [(path, row.flatten()) for path, row in zip(paths, features)]
+
+    # Yields (path, features) for every path; features is None if decoding failed.
+    # lookup(path) may return precomputed features, which are passed through without decoding.
+    def extract(self, image_paths, lookup=None):
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.decode_workers)
+        pending = deque()
+        paths, arrays = [], []
+        cached = {}
+        start = time.perf_counter()
+
+        def need(path):
+            features = lookup(path) if lookup is not None else None
+            if features is not None:
+                cached[path] = features
+            return features is None
+
+        files = self.prefetcher.iterate(image_paths, need)
+        try:
+            exhausted = False
+            while True:
+                # Keep two batches of decodes in flight so the model never waits on I/O
+                while not exhausted and len(pending) < 2 * self.batch_size:
+                    item = next(files, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    path = item.path
+                    if path in cached:
+                        pending.append((path, cached.pop(path)))
+                    else:
+                        pending.append((path, executor.submit(timed_call, decode_model_input, path,
+                                                              self.target_size, item.data)))
+                METRICS.set_gauge("decode_in_flight", len(pending))
+                if not pending:
+                    break
+                path, future = pending.popleft()
+                if not isinstance(future, Future):
+                    yield path, future
+                    continue
+                array, seconds = future.result()
+                METRICS.observe("decode", seconds)
+                if array is None:
+                    yield path, None
+                    continue
+                paths.append(path)
+                arrays.append(array)
+                if len(arrays) == self.batch_size:
+                    yield from self._predict(paths, arrays)
+                    self.images += len(arrays)
+                    paths, arrays = [], []
+            if arrays:
+                yield from self._predict(paths, arrays)
+                self.images += len(arrays)
+        finally:
+            self.seconds += time.perf_counter() - start
+            files.close()
+            if self.executor is None:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,81 @@
+import numpy as np
+from hamming_index import popcount
+from worker_pool import default_workers, parallel_map
+
+# All-pairs near-duplicate search for offline batch runs. Instead of querying
+# an index once per file, the stored vectors (or 64-bit pHashes) of every file
+# are compared with each other tile by tile: a tile holds tile_rows x tile_rows
+# pairs and is scored with one matrix product (cosine similarities of
+# L2-normalized rows) or one broadcast XOR plus popcount (Hamming distances).
+# Only the upper triangle of the pair matrix is visited, and only the pairs
+# above the threshold are kept, so memory is bounded by the tile size however
+# many files there are. Tiles run in parallel on a thread pool (NumPy releases
+# the GIL for both kinds of tile) with a bounded number in flight.
+
+# Rows per side of a tile. A 2048 x 2048 tile of embeddings needs 16 MB of float32 similarities per
+# worker; hash tiles are smaller (2 MB of XORed hashes), as XOR and popcount are bound by memory
+# bandwidth and run fastest while a tile stays in cache.
+TILE_ROWS = 2048
+HASH_TILE_ROWS = 512
+
+# Threads scoring tiles (one per core by default)
+TILE_WORKERS = None
+
+
+# Function to yield the (row start, column start) of every tile on or above the diagonal
+def upper_tiles(count, tile_rows=TILE_ROWS):
+    for rows in range(0, count, tile_rows):
+        for columns in range(rows, count, tile_rows):
+            yield rows, columns
+
+
+# Function to return the (row, column) positions of the kept pairs of a tile, in global positions.
+# Tiles on the diagonal only keep pairs above it, so every pair is reported once and never a row with itself.
+def tile_pairs(keep, rows, columns):
+    positions, others = np.nonzero(keep)
+    if rows == columns:
+        upper = positions < others
+        positions, others = positions[upper], others[upper]
+    return positions, others
+
+
+# Function to run score_tile over all tiles and yield (positions, others, scores) arrays of kept pairs,
+# tile by tile in a fixed order
+def iter_tiles(count, score_tile, tile_rows=TILE_ROWS, workers=TILE_WORKERS, stage=None):
+    workers = workers or default_workers()
+    for _, result in parallel_map(score_tile, upper_tiles(count, tile_rows), workers, use_processes=False,
+                                  chunksize=1, stage=stage):
+        if result is not None and len(result[0]):  # None if the tile failed (already logged)
+            yield result
+
+
+# Function to yield (positions, others, distances) arrays for every pair of 64-bit hashes within
+# max_distance bits. positions < others index into codes.
+def hamming_pairs(codes, max_distance, tile_rows=HASH_TILE_ROWS, workers=TILE_WORKERS):
+    codes = np.ascontiguousarray(codes, dtype=np.uint64)
+
+    def score_tile(tile):
+        rows, columns = tile
+        distances = popcount(codes[rows:rows + tile_rows, None] ^ codes[None, columns:columns + tile_rows])
+        positions, others = tile_pairs(distances <= max_distance, rows, columns)
+        return positions + rows, others + columns, distances[positions, others].astype(np.int64)
+
+    return iter_tiles(len(codes), score_tile, tile_rows, workers, stage="tile_phash")
+
+
+# Function to yield (positions, others, similarities) arrays for every pair of rows with a cosine
+# similarity of at least threshold. Rows must be L2-normalized; they may be stored as float16, or as
+# int8 with one scale per row (see compact_embedding.quantize_int8), and are upcast a tile at a time.
+def cosine_pairs(vectors, threshold, scales=None, tile_rows=TILE_ROWS, workers=TILE_WORKERS):
+    def score_tile(tile):
+        rows, columns = tile
+        left = vectors[rows:rows + tile_rows].astype(np.float32)
+        right = vectors[columns:columns + tile_rows].astype(np.float32)
+        similarities = left @ right.T
+        if scales is not None:
+            similarities *= scales[rows:rows + tile_rows, None]
+            similarities *= scales[None, columns:columns + tile_rows]
+        positions, others = tile_pairs(similarities >= threshold, rows, columns)
+        return positions + rows, others + columns, similarities[positions, others]
+
+    return iter_tiles(len(vectors), score_tile, tile_rows, workers, stage="tile_cnn")
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_inference import BatchFeatureExtractor
+
+# Reports VGG16 feature-extraction throughput (images/sec) on CPU for several
+# batch sizes, using a folder of images or randomly generated JPEGs.
+
+
+# Function to write `count` random JPEGs into a directory and return their paths
+def make_images(directory, count, size, seed):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+        path = os.path.join(directory, f"image_{i:05d}.jpg")
+        Image.fromarray(pixels).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched VGG16 feature extraction")
+    parser.add_argument("--images", help="Folder of images to use instead of generated ones")
+    parser.add_argument("--count", type=int, default=256)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32,64")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")  # CPU only
+    from tensorflow.keras.applications import VGG16
+    from tensorflow.keras.applications.vgg16 import preprocess_input
+
+    model = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.images:
+            paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images))[:args.count]
+        else:
+            paths = make_images(directory, args.count, args.size, seed=0)
+
+        # Warm up the model so graph construction is not counted
+        model.predict_on_batch(np.zeros((1, 224, 224, 3), dtype=np.float32))
+
+        for batch_size in [int(value) for value in args.batch_sizes.split(",")]:
+            extractor = BatchFeatureExtractor(model, preprocess_input, batch_size=batch_size,
+                                              decode_workers=args.decode_workers)
+            start = time.perf_counter()
+            extracted = sum(1 for _, features in extractor.extract(paths) if features is not None)
+            elapsed = time.perf_counter() - start
+            print(f"batch_size={batch_size:3d}: {extracted / elapsed:7.1f} images/sec ({extracted} images)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_similarity import HASH_TILE_ROWS, TILE_ROWS, cosine_pairs, hamming_pairs
+from compact_embedding import l2_normalize_rows, quantize_int8
+from hamming_index import HammingIndex
+from similarity_index import ExactIndex
+
+# Compares finding all near-duplicate pairs with one index query per file
+# (what a streaming scan does) against the tiled all-pairs search of
+# batch_similarity.py, on random pHashes and int8 embeddings with planted
+# near-duplicates. Both must find the same pHash pairs.
+
+
+# Function to return random rows plus noisy copies of some of them
+def make_codes(count, copies, max_distance, rng):
+    codes = rng.integers(0, np.iinfo(np.int64).max, size=count, dtype=np.int64).astype(np.uint64)
+    for position in rng.choice(count, size=copies, replace=False):
+        code = int(codes[rng.integers(count)])
+        for bit in rng.choice(64, size=rng.integers(0, max_distance + 1), replace=False):
+            code ^= 1 << int(bit)
+        codes[position] = code
+    return codes
+
+
+def make_vectors(count, dim, copies, noise, rng):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    picked = rng.choice(count, size=copies, replace=False)
+    vectors[picked] = vectors[rng.integers(count, size=copies)] + noise * rng.standard_normal((copies, dim))
+    return l2_normalize_rows(vectors)
+
+
+def collect(pairs):
+    found = set()
+    for positions, others, _ in pairs:
+        found.update(zip(positions.tolist(), others.tolist()))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-file index queries against tiled all-pairs search")
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--copies", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--tile-rows", type=int, default=TILE_ROWS)
+    parser.add_argument("--hash-tile-rows", type=int, default=HASH_TILE_ROWS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    codes = make_codes(args.count, args.copies, args.max_distance, rng)
+    start = time.perf_counter()
+    index = HammingIndex(max_distance=args.max_distance)
+    queried = set()
+    for position, code in enumerate(codes):
+        queried.update((other, position) for other, _ in index.query(int(code)))
+        index.add(position, int(code))
+    query_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tiled = collect(hamming_pairs(codes, args.max_distance, args.hash_tile_rows, args.workers))
+    tile_time = time.perf_counter() - start
+    print(f"phash: {len(queried)} pairs by index queries in {query_time:.2f}s, {len(tiled)} pairs in tiles "
+          f"in {tile_time:.2f}s ({query_time / tile_time:.1f}x), same pairs: {queried == tiled}")
+
+    vectors = make_vectors(args.count, args.dim, args.copies, args.noise, rng)
+    quantized, scales = quantize_int8(vectors)
+    start = time.perf_counter()
+    index = ExactIndex(dim=args.dim, dtype=np.int8)
+    queried = set()
+    for position, vector in enumerate(vectors):
+        queried.update((other, position) for other, _ in index.query(vector, threshold=args.threshold))
+        index.add(position, vector)
+    query_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tiled = collect(cosine_pairs(quantized, args.threshold, scales, args.tile_rows, args.workers))
+    tile_time = time.perf_counter() - start
+    # Queries are float32 against int8 rows, tiles are int8 on both sides, so pairs right at the
+    # threshold may differ
+    print(f"cnn: {len(queried)} pairs by index queries in {query_time:.2f}s, {len(tiled)} pairs in tiles "
+          f"in {tile_time:.2f}s ({query_time / tile_time:.1f}x), {len(queried & tiled)} in common")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_batch_inference import make_images
+
+# Reports cold-start time (fresh interpreter, median of several runs) for the
+# ways MediaMatch is started: importing the headless library, bringing up the
+# GUI window, a headless pHash scan of a small folder, and loading VGG16.
+# Modes whose dependencies are missing (no display, no TensorFlow) are skipped.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "library import": "import mediamatch_core",
+    "gui window": "import MediaMatch; MediaMatch.build_gui().update()",
+    "headless scan": (
+        "import sys, mediamatch_core\n"
+        "from feature_cache import FeatureCache\n"
+        "scan = mediamatch_core.DuplicateScan([sys.argv[1]], cache=FeatureCache(sys.argv[2]))\n"
+        "list(scan)\n"
+        "scan.close()\n"
+    ),
+    "model load": "import mediamatch_core; mediamatch_core.get_model()",
+}
+
+
+# Function to time one run of a snippet in a fresh interpreter, returning seconds or the error output
+def time_snippet(code, args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code, *args], cwd=REPO, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+    return elapsed, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure MediaMatch cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--images", type=int, default=20, help="Images in the headless scan folder")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, "images")
+        os.makedirs(folder)
+        make_images(folder, args.images, 256, seed=0)
+        baseline, _ = time_snippet("pass", [])
+        print(f"{'interpreter':<16} {baseline:6.2f}s")
+        for name in args.modes.split(","):
+            times = []
+            for run in range(args.runs):
+                cache_path = os.path.join(directory, f"cache_{name.replace(' ', '_')}_{run}.sqlite")
+                elapsed, error = time_snippet(MODES[name], [folder, cache_path])
+                if elapsed is None:
+                    print(f"{name:<16} skipped: {error}")
+                    break
+                times.append(elapsed)
+            if times:
+                print(f"{name:<16} {statistics.median(times):6.2f}s median, {min(times):6.2f}s best "
+                      f"({len(times)} runs)")
+
+
+if __name__ == "__main__":
+    main()
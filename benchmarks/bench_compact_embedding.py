@@ -0,0 +1,140 @@
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_embedding import (CompactEmbedder, PCAProjection, global_average_pool, l2_normalize_rows,
+                               quantize_int8, quantized_similarities)
+
+# Reports how much duplicate-detection accuracy the compact embeddings lose
+# against the full 25,088-value VGG16 feature maps, on a labeled set of pairs.
+# The pairs CSV has rows "path1,path2,label" (label 1 = duplicate, 0 = not).
+# Features are computed with VGG16, or loaded from an npz with "paths" and
+# "features" arrays (as written by --save-features) so the comparison can be
+# rerun without TensorFlow. --save-pca fits a PCA of the given size and writes
+# it to the path mediamatch_core loads it from, which turns on the PCA mode of
+# the compact embeddings for later scans.
+
+
+# Function to read (path1, path2, label) rows from a CSV file, skipping a header row if present
+def read_pairs(path):
+    pairs = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[2].strip() not in ("0", "1"):
+                continue
+            pairs.append((row[0], row[1], int(row[2])))
+    return pairs
+
+
+# Function to compute full flattened VGG16 feature maps for a list of paths
+def compute_features(paths, batch_size):
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")  # CPU only
+    from tensorflow.keras.applications import VGG16
+    from tensorflow.keras.applications.vgg16 import preprocess_input
+    from batch_inference import BatchFeatureExtractor
+
+    model = VGG16(weights="imagenet", include_top=False, input_shape=(224, 224, 3))
+    extractor = BatchFeatureExtractor(model, preprocess_input, batch_size=batch_size)
+    features = dict(extractor.extract(paths))
+    missing = [path for path in paths if features.get(path) is None]
+    if missing:
+        raise SystemExit(f"Could not extract features for {len(missing)} files, e.g. {missing[0]}")
+    return np.stack([features[path] for path in paths])
+
+
+# Function to return the similarity of each labeled pair for a matrix of per-path vectors
+def pair_similarities(vectors, pairs, index, scales=None):
+    similarities = np.empty(len(pairs), dtype=np.float32)
+    for i, (path1, path2, _) in enumerate(pairs):
+        row1, row2 = index[path1], index[path2]
+        query = vectors[row1].astype(np.float32) * (scales[row1] if scales is not None else 1)
+        row_scales = scales[row2:row2 + 1] if scales is not None else None
+        similarities[i] = quantized_similarities(vectors[row2:row2 + 1], query, row_scales)[0]
+    return similarities
+
+
+# Function to return (precision, recall, f1) of "similarity >= threshold" against the labels
+def score(similarities, labels, threshold):
+    predicted = similarities >= threshold
+    true_positives = int((predicted & labels).sum())
+    precision = true_positives / max(1, int(predicted.sum()))
+    recall = true_positives / max(1, int(labels.sum()))
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare compact embeddings against full VGG16 features")
+    parser.add_argument("pairs", help="CSV of path1,path2,label rows")
+    parser.add_argument("--features", help="npz with precomputed full features (paths, features)")
+    parser.add_argument("--save-features", help="Write the computed full features to this npz")
+    parser.add_argument("--pca", default="256,128,64", help="Comma-separated PCA sizes to evaluate")
+    parser.add_argument("--pca-fit", help="npz of features to fit PCA on (default: the evaluated features)")
+    parser.add_argument("--save-pca", type=int, metavar="SIZE", help="Write a PCA of this size for scans to use")
+    parser.add_argument("--pca-path", help="Where --save-pca writes the PCA (default: mediamatch_core.PCA_PATH)")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    pairs = read_pairs(args.pairs)
+    if not pairs:
+        raise SystemExit(f"No labeled pairs in {args.pairs}")
+    paths = sorted({path for path1, path2, _ in pairs for path in (path1, path2)})
+    if args.features:
+        data = np.load(args.features)
+        stored = {str(path): row for row, path in enumerate(data["paths"])}
+        full = data["features"][[stored[path] for path in paths]]
+    else:
+        full = compute_features(paths, args.batch_size)
+        if args.save_features:
+            np.savez(args.save_features, paths=np.array(paths), features=full)
+    index = {path: row for row, path in enumerate(paths)}
+    labels = np.array([label for _, _, label in pairs], dtype=bool)
+    print(f"{len(pairs)} pairs ({labels.sum()} duplicates) over {len(paths)} files")
+
+    pooled = global_average_pool(full)
+    fit_source = global_average_pool(np.load(args.pca_fit)["features"]) if args.pca_fit else pooled
+    variants = [("full float32", l2_normalize_rows(full), None)]
+    variants.append(("gap512 float32", CompactEmbedder(dtype=np.float32)(pooled), None))
+    variants.append(("gap512 float16", CompactEmbedder(dtype=np.float16)(pooled), None))
+    variants.append(("gap512 int8", *quantize_int8(CompactEmbedder(dtype=np.float32)(pooled))))
+    for size in [int(size) for size in args.pca.split(",") if size]:
+        if size > min(fit_source.shape):
+            print(f"Skipping PCA {size}: needs at least {size} fitting vectors")
+            continue
+        embedder = CompactEmbedder(PCAProjection.fit(fit_source, size), dtype=np.float32)
+        variants.append((f"{embedder.name} float16", embedder(pooled).astype(np.float16), None))
+        variants.append((f"{embedder.name} int8", *quantize_int8(embedder(pooled))))
+
+    if args.save_pca:
+        if args.save_pca > min(fit_source.shape):
+            raise SystemExit(f"Cannot save PCA {args.save_pca}: needs at least {args.save_pca} fitting vectors")
+        from mediamatch_core import PCA_PATH
+        pca_path = args.pca_path or PCA_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(pca_path)), exist_ok=True)
+        pca = PCAProjection.fit(fit_source, args.save_pca)
+        pca.save(pca_path)
+        print(f"Saved PCA {args.save_pca} to {pca_path}, scans now store {CompactEmbedder(pca).name} embeddings")
+
+    thresholds = np.round(np.arange(0.5, 1.0, 0.01), 2)
+    reference = None
+    print(f"{'variant':<22} {'bytes':>7} {'P@t':>6} {'R@t':>6} {'F1@t':>6} {'best F1':>8} {'at':>5} "
+          f"{'dF1@t':>7} {'mean |dsim|':>11}")
+    for name, vectors, scales in variants:
+        similarities = pair_similarities(vectors, pairs, index, scales)
+        precision, recall, f1 = score(similarities, labels, args.threshold)
+        best_f1, best_threshold = max((score(similarities, labels, t)[2], t) for t in thresholds)
+        if reference is None:
+            reference = (f1, similarities)
+        size = vectors.shape[1] * vectors.itemsize + (4 if scales is not None else 0)
+        print(f"{name:<22} {size:>7} {precision:>6.3f} {recall:>6.3f} {f1:>6.3f} {best_f1:>8.3f} "
+              f"{best_threshold:>5.2f} {f1 - reference[0]:>+7.3f} "
+              f"{float(np.abs(similarities - reference[1]).mean()):>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+import tempfile
+import subprocess
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_corpus import SHARD_GROUPS, build_corpus, shard_roots
+from bench_image_decode import peak_rss_mb
+
+# End-to-end detector benchmark on the synthetic corpus. Each detector scans
+# the corpus in a fresh process; the first run of a detector starts with an
+# empty cache and gives files/sec and peak RSS (of the scanning process, not its
+# worker processes), the runs at the other thresholds reuse that cache and only
+# add precision and recall. Accuracy is scored against the corpus manifest: a
+# reported duplicate is correct when both files come from the same group, and
+# recall counts the copies that end up in the same cluster as their base file.
+# --sizes adds a scaling curve: the same detector on growing prefixes of the corpus.
+#
+# Detectors:
+#   exact        byte-identical files only (DuplicateScan, method exact)
+#   phash        exact + pHash funnel (DuplicateScan, method phash), threshold = match distance
+#   deepcleaner  Deepcleaner's pHash and video signature matching, threshold = max distance
+#   multihash    Deepcleaner with aHash/dHash/pHash/wHash/colour hash voting, threshold = vote fraction
+#   funnel       exact + pHash + VGG16 funnel, threshold = cosine similarity (needs TensorFlow)
+#   cnn          VGG16 on every file, threshold = cosine similarity (needs TensorFlow)
+
+DEFAULT_THRESHOLDS = {
+    "exact": [None],
+    "phash": [2, 4, 6, 8, 10],
+    "deepcleaner": [2, 4, 6, 8, 10],
+    "multihash": [0.4, 0.5, 0.6, 0.7, 0.8],
+    "funnel": [0.8, 0.85, 0.9, 0.95],
+    "cnn": [0.8, 0.85, 0.9, 0.95],
+}
+
+
+# Function to scan the roots with one detector inside this process and write the results as JSON
+def run_detector(detector, threshold, roots, cache_path, output_path, workers):
+    import mediamatch_core
+    from Deepcleaner import iter_duplicates
+    from feature_cache import FeatureCache
+    from file_walker import ParallelWalker
+    from hamming_index import HammingIndex
+    from multi_hash import MultiHashIndex
+    from video_fingerprint import VideoSignatureIndex
+
+    if detector in ("funnel", "cnn") and importlib.util.find_spec("tensorflow") is None:
+        sys.exit("TensorFlow is not installed")
+    mediamatch_core.WORKERS = workers
+    cache = FeatureCache(cache_path)
+    start = time.perf_counter()
+    if detector in ("deepcleaner", "multihash"):
+        walker = ParallelWalker(roots)
+        if detector == "multihash":
+            hashes = MultiHashIndex(vote_threshold=threshold)
+        else:
+            hashes = HammingIndex(max_distance=int(threshold))
+        pairs = [(path, original) for path, original, _ in
+                 iter_duplicates(walker, cache, hashes, VideoSignatureIndex(), workers)]
+        files = walker.files
+        cache.close()
+    else:
+        options = {
+            "exact": {"method": "exact"},
+            "phash": {"method": "phash", "match_distance": threshold},
+            "funnel": {"method": "cnn", "similarity_threshold": threshold},
+            "cnn": {"method": "cnn", "use_funnel": False, "similarity_threshold": threshold},
+        }[detector]
+        scan = mediamatch_core.DuplicateScan(roots, cache=cache, **options)
+        pairs = [(path, original) for path, original, _, _ in scan]
+        files = scan.walker.files
+        scan.close()
+    seconds = time.perf_counter() - start
+    with open(output_path, "w") as f:
+        json.dump({"pairs": pairs, "files": files, "seconds": seconds, "peak_rss": peak_rss_mb()}, f)
+
+
+# Function to parse a threshold: None, a Hamming distance or a similarity
+def parse_threshold(value):
+    if value == "None":
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+# Function to run a detector in a fresh process and return its results
+def measure(detector, threshold, roots, cache_path, workers):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output_path = f.name
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--run-detector", detector, str(threshold),
+                   cache_path, output_path, str(workers), *roots]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else f"{detector} failed")
+        with open(output_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(output_path)
+
+
+# Function to score reported (path, original) pairs against the manifest groups.
+# Returns (precision, recall, recall per transform).
+def score(pairs, rows, directory):
+    group_of = {os.path.join(directory, path): group for path, group, _ in rows}
+    parent = {}
+
+    def find(path):
+        root = path
+        while parent.get(root, root) != root:
+            root = parent[root]
+        parent[path] = root
+        return root
+
+    correct = 0
+    for path, original in pairs:
+        if path in group_of and group_of.get(original) == group_of[path]:
+            correct += 1
+            parent[find(path)] = find(original)
+    bases = {group: os.path.join(directory, path) for path, group, transform in rows if transform == "base"}
+    expected, found = Counter(), Counter()
+    for path, group, transform in rows:
+        if transform == "base":
+            continue
+        expected[transform] += 1
+        if find(os.path.join(directory, path)) == find(bases[group]):
+            found[transform] += 1
+    precision = correct / len(pairs) if pairs else 1.0
+    recall = sum(found.values()) / sum(expected.values()) if expected else 1.0
+    return precision, recall, {transform: found[transform] / expected[transform] for transform in sorted(expected)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark duplicate detectors on a synthetic corpus")
+    parser.add_argument("--corpus", help="Corpus directory (created or extended as needed; default: temporary)")
+    parser.add_argument("--groups", type=int, default=1000, help="Groups in the accuracy corpus")
+    parser.add_argument("--video-every", type=int, default=0, help="Make every Nth group a video")
+    parser.add_argument("--detectors", default="exact,phash,deepcleaner,multihash")
+    parser.add_argument("--thresholds", action="append", default=[], metavar="DETECTOR=T1,T2",
+                        help="Override the thresholds of one detector")
+    parser.add_argument("--sizes", default="",
+                        help=f"Comma-separated group counts for the scaling curve, rounded up to whole shards of "
+                             f"{SHARD_GROUPS} groups (e.g. 1000,10000,100000,1000000)")
+    parser.add_argument("--scaling-detector", default="phash")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--run-detector", nargs=5, help=argparse.SUPPRESS)
+    parser.add_argument("roots", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_detector:
+        detector, threshold, cache_path, output_path, workers = args.run_detector
+        run_detector(detector, parse_threshold(threshold), args.roots, cache_path, output_path, int(workers))
+        return
+
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for override in args.thresholds:
+        detector, values = override.split("=", 1)
+        thresholds[detector] = [parse_threshold(value) for value in values.split(",")]
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.corpus or os.path.join(scratch, "corpus")
+        start = time.perf_counter()
+        rows = build_corpus(directory, max([args.groups] + sizes), video_every=args.video_every)
+        roots = shard_roots(directory, args.groups)
+        # Whole shards are scanned, so score every group in them
+        accuracy_rows = [row for row in rows if row[1] < len(roots) * SHARD_GROUPS]
+        print(f"Corpus: {len(rows)} files ({time.perf_counter() - start:.1f}s to prepare), "
+              f"accuracy set {len(accuracy_rows)} files in {len({row[1] for row in accuracy_rows})} groups")
+
+        print(f"\n{'detector':<12} {'threshold':>9} {'files/s':>9} {'peak MB':>8} {'precision':>9} {'recall':>7}  "
+              f"recall by transform")
+        for detector in args.detectors.split(","):
+            cache_path = os.path.join(scratch, f"cache_{detector}.sqlite")
+            for run, threshold in enumerate(thresholds[detector]):
+                try:
+                    result = measure(detector, threshold, roots, cache_path, args.workers)
+                except RuntimeError as e:
+                    print(f"{detector:<12} skipped: {e}")
+                    break
+                precision, recall, by_transform = score(result["pairs"], accuracy_rows, directory)
+                speed = f"{result['files'] / result['seconds']:9.1f}" if run == 0 else f"{'(warm)':>9}"
+                memory = f"{result['peak_rss']:8.0f}" if run == 0 and result["peak_rss"] else f"{'':>8}"
+                transforms = " ".join(f"{name}={value:.2f}" for name, value in by_transform.items())
+                print(f"{detector:<12} {str(threshold):>9} {speed} {memory} {precision:9.3f} {recall:7.3f}  "
+                      f"{transforms}")
+
+        if sizes:
+            detector = args.scaling_detector
+            threshold = thresholds[detector][len(thresholds[detector]) // 2]
+            print(f"\nScaling ({detector}, threshold {threshold}, cold cache)")
+            print(f"{'groups':>8} {'files':>9} {'seconds':>9} {'files/s':>9} {'peak MB':>8}")
+            for size in sizes:
+                cache_path = os.path.join(scratch, f"scaling_{size}.sqlite")
+                result = measure(detector, threshold, shard_roots(directory, size), cache_path, args.workers)
+                os.remove(cache_path)
+                peak = f"{result['peak_rss']:8.0f}" if result["peak_rss"] else f"{'n/a':>8}"
+                print(f"{size:>8} {result['files']:>9} {result['seconds']:9.1f} "
+                      f"{result['files'] / result['seconds']:9.1f} {peak}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_inference import BatchFeatureExtractor
+from compact_embedding import CompactEmbedder
+from embedding_backends import BACKENDS, backend_available, make_backend, model_path
+from bench_compact_embedding import read_pairs, score
+
+# Compares the embedding backends against VGG16 on a labeled set of pairs (as
+# written by synthetic_corpus.py --pairs): model load time, inference latency
+# per image and images/sec on CPU, and the precision, recall and F1 of
+# "cosine similarity >= threshold" on the pooled, L2-normalized embeddings.
+# Backends whose runtime or model file is missing are skipped.
+
+
+# Function to return the cosine similarity of each labeled pair
+def pair_similarities(embeddings, pairs):
+    return np.array([float(np.dot(embeddings[path1], embeddings[path2])) for path1, path2, _ in pairs],
+                    dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CNN embedding backends against VGG16")
+    parser.add_argument("pairs", help="CSV of path1,path2,label rows")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument("--threads", type=int, help="CPU threads per backend (default: the runtime's)")
+    parser.add_argument("--int8", action="store_true", help="Also run the int8 model of each backend")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    args = parser.parse_args()
+    os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")  # CPU only
+
+    pairs = read_pairs(args.pairs)
+    if not pairs:
+        raise SystemExit(f"No labeled pairs in {args.pairs}")
+    paths = sorted({path for path1, path2, _ in pairs for path in (path1, path2)})
+    labels = np.array([label for _, _, label in pairs], dtype=bool)
+    print(f"{len(pairs)} pairs ({labels.sum()} duplicates) over {len(paths)} files")
+
+    variants = [(name, quantized) for name in args.backends.split(",") if name
+                for quantized in ((False, True) if args.int8 and BACKENDS[name]["runtime"] != "keras" else (False,))]
+    thresholds = np.round(np.arange(0.5, 1.0, 0.01), 2)
+    print(f"{'backend':<24} {'MB':>6} {'load s':>7} {'ms/img':>7} {'img/s':>7} {'P@t':>6} {'R@t':>6} "
+          f"{'F1@t':>6} {'best F1':>8} {'at':>5}")
+    for name, quantized in variants:
+        if not backend_available(name, quantized):
+            print(f"{name + (' int8' if quantized else ''):<24} skipped: runtime or model file missing")
+            continue
+        start = time.perf_counter()
+        backend = make_backend(name, args.threads, quantized)
+        load_seconds = time.perf_counter() - start
+        path = model_path(name, backend.quantized)
+        size = f"{os.path.getsize(path) / 1024 ** 2:.1f}" if path and os.path.exists(path) else "-"
+
+        # One image at a time for latency, then batches for throughput (after a warm-up call)
+        batch = np.zeros((1,) + backend.input_size + (3,), dtype=np.float32)
+        backend.predict_on_batch(backend.preprocess(batch))
+        start = time.perf_counter()
+        for _ in range(10):
+            backend.predict_on_batch(backend.preprocess(batch))
+        latency = (time.perf_counter() - start) / 10
+        extractor = BatchFeatureExtractor(backend, backend.preprocess, batch_size=args.batch_size,
+                                          target_size=backend.input_size)
+        embed = CompactEmbedder(dtype=np.float32, feature_shape=backend.feature_shape)
+        embeddings = {path: embed(features) for path, features in extractor.extract(paths)}
+        missing = [path for path in paths if embeddings.get(path) is None]
+        if missing:
+            raise SystemExit(f"Could not embed {len(missing)} files, e.g. {missing[0]}")
+
+        similarities = pair_similarities(embeddings, pairs)
+        precision, recall, f1 = score(similarities, labels, args.threshold)
+        best_f1, best_threshold = max((score(similarities, labels, t)[2], t) for t in thresholds)
+        label = name + (" int8" if backend.quantized else "")
+        print(f"{label:<24} {size:>6} {load_seconds:>7.1f} {latency * 1000:>7.1f} "
+              f"{extractor.throughput():>7.1f} {precision:>6.3f} {recall:>6.3f} {f1:>6.3f} {best_f1:>8.3f} "
+              f"{best_threshold:>5.2f}")
+
+
+if __name__ == "__main__":
+    main()
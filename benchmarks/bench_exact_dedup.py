@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exact_dedup
+from exact_dedup import HASH_ALGORITHM, ExactDuplicateFinder
+from file_walker import walk_media_files
+
+# Compares the exact-duplicate stage checking one file at a time with
+# iter_check() on a thread pool, on a directory tree (e.g. a NAS mount) or on
+# generated files with copies. Reports files/sec and the number of partial
+# and full hashes read. Run it on a cold cache (or a network volume) to see the
+# effect of concurrent reads; a warm page cache mostly measures hashing.
+# --latency-ms adds a sleep before every partial and full hash read to
+# simulate the request latency of a NAS on a local disk.
+
+
+# Function to write files of a few shared sizes, a fraction of them copies of earlier ones
+def generate_files(directory, count, size_mb, copies, seed):
+    rng = random.Random(seed)
+    sizes = [max(1, int(size_mb * 1024 * 1024 * factor)) for factor in (0.5, 1, 2)]
+    paths = []
+    for number in range(count):
+        path = os.path.join(directory, f"file_{number:05d}.jpg")
+        if paths and rng.random() < copies:
+            shutil.copyfile(rng.choice(paths), path)
+        else:
+            with open(path, "wb") as f:
+                f.write(rng.randbytes(rng.choice(sizes)))
+        paths.append(path)
+    return paths
+
+
+# Function to make every hash read wait as if it went to a remote volume
+def add_latency(seconds):
+    def delayed(read):
+        def wrapper(*args):
+            time.sleep(seconds)
+            return read(*args)
+        return wrapper
+
+    exact_dedup.partial_hash = delayed(exact_dedup.partial_hash)
+    exact_dedup.full_hash = delayed(exact_dedup.full_hash)
+
+
+def run(paths, workers, max_in_flight):
+    finder = ExactDuplicateFinder()
+    start = time.perf_counter()
+    if workers == 0:
+        duplicates = sum(1 for path in paths if finder.check(path) is not None)
+    else:
+        duplicates = sum(1 for _, original in finder.iter_check(paths, workers, max_in_flight)
+                         if original is not None)
+    return time.perf_counter() - start, duplicates, finder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential and concurrent exact-duplicate checks")
+    parser.add_argument("directory", nargs="?", help="Tree to check (default: generated files)")
+    parser.add_argument("--count", type=int, default=400, help="Generated files")
+    parser.add_argument("--size-mb", type=float, default=4, help="Typical generated file size")
+    parser.add_argument("--copies", type=float, default=0.3, help="Fraction of generated files that are copies")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 4, 8, 16],
+                        help="Reader threads to compare, 0 for one file at a time")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated latency of every hash read")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = None
+    try:
+        if args.directory:
+            paths = list(walk_media_files([args.directory]))
+        else:
+            directory = tempfile.mkdtemp(prefix="bench_exact_")
+            paths = generate_files(directory, args.count, args.size_mb, args.copies, args.seed)
+        if args.latency_ms:
+            add_latency(args.latency_ms / 1000)
+        total = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} files, {total / 1024 ** 3:.2f} GB, {HASH_ALGORITHM} full hashes")
+        for workers in args.workers:
+            seconds, duplicates, finder = run(paths, workers, args.max_in_flight)
+            mode = "sequential" if workers == 0 else f"{workers} workers"
+            print(f"{mode}: {seconds:.2f}s ({len(paths) / seconds:.0f} files/sec), {duplicates} duplicates, "
+                  f"{finder.partial_hashes} partial and {finder.full_hashes} full hashes")
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hamming_index import HammingIndex, popcount
+
+# Compares HammingIndex lookups with a linear XOR-popcount scan on random
+# 64-bit hashes and reports insert rate, query latency and memory use.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pHash Hamming index")
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--chunks", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    codes = rng.integers(0, np.iinfo(np.int64).max, size=args.count, dtype=np.int64).astype(np.uint64)
+    queries = []
+    for position in rng.choice(args.count, size=args.queries, replace=False):
+        code = int(codes[position])
+        for bit in rng.choice(64, size=rng.integers(0, args.max_distance + 1), replace=False):
+            code ^= 1 << int(bit)
+        queries.append(code)
+
+    index = HammingIndex(max_distance=args.max_distance, chunks=args.chunks)
+    start = time.perf_counter()
+    for position, code in enumerate(codes):
+        index.add(position, int(code))
+    insert_time = time.perf_counter() - start
+    print(f"inserted {args.count} hashes in {insert_time:.2f}s, "
+          f"{index.memory_bytes() / args.count:.1f} bytes/hash")
+
+    start = time.perf_counter()
+    found = sum(1 for query in queries if index.query(query))
+    index_time = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    for query in queries:
+        np.nonzero(popcount(codes ^ np.uint64(query)) <= args.max_distance)
+    scan_time = (time.perf_counter() - start) / len(queries)
+
+    print(f"index: {index_time * 1000:.3f} ms/query ({found}/{len(queries)} matched)")
+    print(f"linear scan: {scan_time * 1000:.3f} ms/query ({scan_time / index_time:.1f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Reports per-image decode time and peak RSS for full-resolution decoding
+# (Image.open + convert + resize, the previous behaviour) against reduced
+# DCT-scale decoding with PIL draft mode and with OpenCV IMREAD_REDUCED_*, for
+# both the VGG16 input (224x224 RGB) and the pHash input (grayscale). Each
+# mode runs in a fresh process so its peak RSS is not inflated by the others.
+# Uses a folder of JPEGs or generates large camera-sized ones.
+
+MODES = ("full", "pil-draft", "cv2-reduced")
+
+
+# Function to write `count` camera-sized JPEGs with smooth content and sensor-like noise
+def make_photos(directory, count, width, height, seed):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 256, size=(height // 100, width // 100, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((width, height), Image.BICUBIC)
+        noise = rng.standard_normal(size=(height, width, 3), dtype=np.float32) * 6
+        pixels = np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"photo_{i:03d}.jpg")
+        Image.fromarray(pixels).save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+# Function to return the peak resident set size of this process in MB, or None if unavailable
+def peak_rss_mb():
+    try:
+        # VmHWM is reset by exec, unlike ru_maxrss which Linux carries over from the parent
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB on Linux
+
+
+# Function to decode every path with one mode inside this process and print the timings as JSON
+def run_mode(mode, target, paths):
+    import image_decode
+    size = (224, 224)
+    image_mode = "RGB" if target == "vgg16" else "L"
+    baseline = peak_rss_mb()
+    times = []
+    for path in paths:
+        start = time.perf_counter()
+        if mode == "full":
+            image = Image.open(path).convert(image_mode).resize(size)
+        else:
+            image_decode.DECODE_BACKEND = "cv2" if mode == "cv2-reduced" else "pil"
+            image = image_decode.load_resized(path, size if target == "vgg16" else (256, 256), image_mode)
+        np.asarray(image)
+        times.append(time.perf_counter() - start)
+    print(json.dumps({"times": times, "baseline_rss": baseline, "peak_rss": peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full vs reduced-resolution image decoding")
+    parser.add_argument("--images", help="Folder of JPEGs to use instead of generated ones")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--width", type=int, default=7952)  # About 40 megapixels
+    parser.add_argument("--height", type=int, default=5304)
+    parser.add_argument("--run-mode", nargs=2, metavar=("MODE", "TARGET"), help=argparse.SUPPRESS)
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode[0], args.run_mode[1], args.paths)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.images:
+            paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images)
+                           if name.lower().endswith((".jpg", ".jpeg")))
+        else:
+            print(f"Generating {args.count} {args.width}x{args.height} JPEGs...")
+            paths = make_photos(directory, args.count, args.width, args.height, seed=0)
+        print(f"{'target':<7} {'mode':<12} {'ms/image':>9} {'peak RSS MB':>12} {'decode RSS MB':>14}")
+        for target in ("vgg16", "phash"):
+            for mode in MODES:
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-mode", mode, target,
+                                         *paths], capture_output=True, text=True, check=True)
+                timing = json.loads(result.stdout.strip().splitlines()[-1])
+                times = timing["times"][1:] or timing["times"]  # First decode also loads the codecs
+                peak, baseline = timing["peak_rss"], timing["baseline_rss"]
+                rss = f"{peak:12.1f} {peak - baseline:14.1f}" if peak is not None else f"{'n/a':>12} {'n/a':>14}"
+                print(f"{target:<7} {mode:<12} {np.mean(times) * 1000:9.1f} {rss}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import builtins
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_hashing import iter_file_hashes
+from feature_cache import FeatureCache
+from file_walker import walk_media_files
+from prefetch import Prefetcher
+from worker_pool import default_workers
+from bench_batch_inference import make_images
+
+# Compares hashing with decode workers that open their own files against
+# reading the files ahead on Prefetcher's I/O threads and hashing them from
+# memory, on a directory of media or on generated JPEGs. Reports files/sec.
+# --latency-ms adds a sleep to every open() of a file under the directory,
+# in the decode workers as well as in this process, to simulate the request
+# latency of a NAS or network share on a local disk.
+
+
+# Function to make every open() of a file under directory wait as if it went to a remote volume
+def add_latency(directory, seconds):
+    original_open = builtins.open
+
+    def delayed_open(file, *args, **kwargs):
+        if isinstance(file, str) and file.startswith(directory):
+            time.sleep(seconds)
+        return original_open(file, *args, **kwargs)
+
+    builtins.open = delayed_open
+
+
+def run(paths, workers, threads, kind, latency):
+    directory = tempfile.mkdtemp(prefix="bench_prefetch_cache_")
+    cache = FeatureCache(os.path.join(directory, "cache.sqlite"))
+    root = os.path.commonpath(paths)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=add_latency, initargs=(root, latency))
+    try:
+        executor.submit(len, "").result()  # Start the workers before timing
+        start = time.perf_counter()
+        hashed = sum(1 for _, file_hash in iter_file_hashes(paths, cache, workers, executor=executor, kind=kind,
+                                                            prefetcher=Prefetcher(threads))
+                     if file_hash is not None)
+        return time.perf_counter() - start, hashed
+    finally:
+        executor.shutdown()
+        cache.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hashing with and without read-ahead")
+    parser.add_argument("directory", nargs="?", help="Tree to hash (default: generated JPEGs)")
+    parser.add_argument("--count", type=int, default=300, help="Generated images")
+    parser.add_argument("--size", type=int, default=1024, help="Side of the generated images")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Decode worker processes")
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 4, 16],
+                        help="Read-ahead I/O threads to compare, 0 for workers opening their own files")
+    parser.add_argument("--kind", choices=["phash", "multihash"], default="phash")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated latency of every file open")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = None
+    try:
+        if args.directory:
+            paths = list(walk_media_files([args.directory]))
+        else:
+            directory = tempfile.mkdtemp(prefix="bench_prefetch_")
+            paths = make_images(directory, args.count, args.size, args.seed)
+        latency = args.latency_ms / 1000
+        if latency:
+            add_latency(os.path.commonpath(paths), latency)
+        total = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} files, {total / 1024 ** 2:.0f} MB, {args.workers} decode workers, "
+              f"{args.latency_ms:g} ms per open")
+        for threads in args.threads:
+            seconds, hashed = run(paths, args.workers, threads, args.kind, latency)
+            mode = "no read-ahead" if threads == 0 else f"{threads} I/O threads"
+            print(f"{mode}: {seconds:.2f}s ({len(paths) / seconds:.0f} files/sec), {hashed} hashed")
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
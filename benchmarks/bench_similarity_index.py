@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity_index import ExactIndex, LSHIndex, measure_recall
+
+# Compares the approximate LSH index against the exact index on synthetic
+# clustered vectors: recall of the exact matches and query time per setting.
+
+
+# Function to generate base vectors plus noisy near-duplicate queries
+def make_dataset(count, dim, queries, noise, seed):
+    rng = np.random.default_rng(seed)
+    base = rng.standard_normal((count, dim)).astype(np.float32)
+    picked = rng.choice(count, size=queries, replace=False)
+    query_vectors = base[picked] + noise * rng.standard_normal((queries, dim)).astype(np.float32)
+    return base, query_vectors
+
+
+def time_queries(index, queries, k, threshold):
+    start = time.perf_counter()
+    for query in queries:
+        index.query(query, k=k, threshold=threshold)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark approximate vs exact similarity index")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base, queries = make_dataset(args.count, args.dim, args.queries, args.noise, args.seed)
+
+    exact = ExactIndex(dim=args.dim)
+    for i, vector in enumerate(base):
+        exact.add(i, vector)
+    exact_time = time_queries(exact, queries, args.k, args.threshold)
+    print(f"exact: {exact_time * 1000:.3f} ms/query")
+
+    for n_tables, n_bits, probes in [(4, 16, 0), (8, 16, 0), (8, 16, 4), (16, 16, 4), (16, 12, 8)]:
+        lsh = LSHIndex(dim=args.dim, n_tables=n_tables, n_bits=n_bits, probes=probes, seed=args.seed)
+        for i, vector in enumerate(base):
+            lsh.add(i, vector)
+        recall = measure_recall(exact, lsh, queries, k=args.k, threshold=args.threshold)
+        lsh_time = time_queries(lsh, queries, args.k, args.threshold)
+        print(f"lsh tables={n_tables} bits={n_bits} probes={probes}: "
+              f"recall={recall:.3f} {lsh_time * 1000:.3f} ms/query ({exact_time / lsh_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
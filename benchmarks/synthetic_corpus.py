@@ -0,0 +1,209 @@
+import os
+import io
+import csv
+import argparse
+import numpy as np
+import cv2
+from PIL import Image, ImageDraw
+
+# Reproducible synthetic duplicate corpus. Every group has one base image (or
+# video) drawn from a seeded generator, and some groups also get transformed
+# copies: exact copy, resize, JPEG recompression, crop, watermark, and a 90
+# degree rotation stored with an EXIF orientation tag so it displays like the
+# original. Videos get trimmed and re-encoded copies. manifest.csv records the
+# group of every file, which is the ground truth for precision and recall.
+#
+# Group g is always generated from seed + g, so a corpus of N groups is a prefix
+# of any larger corpus with the same seed. Groups are stored in shard
+# directories of SHARD_GROUPS groups, so scaling runs can scan the first shards.
+
+IMAGE_TRANSFORMS = ("copy", "resize", "recompress", "crop", "watermark", "rotate")
+VIDEO_TRANSFORMS = ("trim", "recompress")
+
+SHARD_GROUPS = 1000
+MANIFEST_NAME = "manifest.csv"
+
+
+# Function to draw a base image: a colour gradient with random shapes and mild sensor noise
+def base_image(rng, size):
+    width, height = size
+    top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    ramp = np.linspace(0, 1, height)[:, None, None]
+    pixels = np.broadcast_to(top * (1 - ramp) + bottom * ramp, (height, width, 3)).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.integers(4, 12)):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        x1, y1 = x0 + rng.integers(width // 10, width // 2), y0 + rng.integers(height // 10, height // 2)
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=colour)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=colour)
+    noise = rng.normal(0, 3, size=(height, width, 3))
+    return Image.fromarray(np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+
+
+# Function to encode an image as JPEG bytes
+def jpeg_bytes(image, quality=90, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, **options)
+    return buffer.getvalue()
+
+
+# Function to return the JPEG bytes of a transformed copy of an image
+def transform_image(image, data, transform, rng):
+    width, height = image.size
+    if transform == "copy":
+        return data
+    if transform == "resize":
+        scale = rng.uniform(0.4, 0.8)
+        return jpeg_bytes(image.resize((int(width * scale), int(height * scale)), Image.BILINEAR))
+    if transform == "recompress":
+        return jpeg_bytes(image, quality=int(rng.integers(25, 50)))
+    if transform == "crop":
+        margin_x, margin_y = int(width * rng.uniform(0.02, 0.08)), int(height * rng.uniform(0.02, 0.08))
+        return jpeg_bytes(image.crop((margin_x, margin_y, width - margin_x, height - margin_y)))
+    if transform == "watermark":
+        marked = image.copy()
+        draw = ImageDraw.Draw(marked)
+        box = (width * 0.65, height * 0.85, width * 0.97, height * 0.95)
+        draw.rectangle(box, fill=(255, 255, 255))
+        draw.text((box[0] + 4, box[1] + 2), "(c) MediaMatch", fill=(0, 0, 0))
+        return jpeg_bytes(marked)
+    if transform == "rotate":
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Viewers rotate the stored pixels 90 degrees clockwise
+        return jpeg_bytes(image.transpose(Image.ROTATE_90), exif=exif)
+    raise ValueError(f"Unknown image transform: {transform}")
+
+
+# Function to write a video of moving shapes (seconds at fps) and return its path
+def write_video(path, rng, size, seconds, fps=10, start_frame=0, scale=1.0):
+    width, height = int(size[0] * scale) // 2 * 2, int(size[1] * scale) // 2 * 2
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    shapes = [(rng.uniform(0, 1, 2), rng.uniform(-0.02, 0.02, 2), rng.integers(0, 256, 3).tolist(),
+               rng.uniform(0.05, 0.2)) for _ in range(6)]
+    background = rng.integers(0, 256, 3).tolist()
+    for frame_index in range(start_frame, int(seconds * fps)):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = background
+        # Every few seconds the scene changes, so different parts of the video hash differently
+        scene = frame_index // (fps * 3)
+        for i, (position, velocity, colour, radius) in enumerate(shapes):
+            x, y = (position + velocity * frame_index + 0.13 * scene * (i + 1)) % 1.0
+            cv2.circle(frame, (int(x * width), int(y * height)), int(radius * height), colour, -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+# Function to generate groups [first_group, groups) of the corpus under directory and return
+# the manifest rows (relative path, group, transform)
+def write_groups(directory, groups, first_group=0, image_size=(320, 240), duplicate_fraction=0.5, max_copies=3,
+                 video_every=0, seed=0):
+    rows = []
+    for group in range(first_group, groups):
+        rng = np.random.default_rng(seed + group)
+        shard = os.path.join(directory, f"shard_{group // SHARD_GROUPS:04d}")
+        os.makedirs(shard, exist_ok=True)
+        name = f"g{group:07d}"
+        has_copies = rng.random() < duplicate_fraction
+
+        if video_every and group % video_every == 0:
+            seconds = float(rng.integers(12, 30))
+            video_rng = np.random.default_rng(seed + group)  # Copies redraw the same scene
+            write_video(os.path.join(shard, f"{name}_base.mp4"), video_rng, image_size, seconds)
+            rows.append((os.path.join(os.path.basename(shard), f"{name}_base.mp4"), group, "base"))
+            if has_copies:
+                for transform in VIDEO_TRANSFORMS:
+                    video_rng = np.random.default_rng(seed + group)
+                    path = os.path.join(shard, f"{name}_{transform}.mp4")
+                    if transform == "trim":
+                        write_video(path, video_rng, image_size, seconds, start_frame=30)
+                    else:
+                        write_video(path, video_rng, image_size, seconds, scale=0.5)
+                    rows.append((os.path.join(os.path.basename(shard), os.path.basename(path)), group, transform))
+            continue
+
+        image = base_image(rng, image_size)
+        data = jpeg_bytes(image)
+        files = [("base", data)]
+        if has_copies:
+            count = int(rng.integers(1, max_copies + 1))
+            for transform in rng.choice(IMAGE_TRANSFORMS, size=count, replace=False):
+                files.append((str(transform), transform_image(image, data, transform, rng)))
+        for transform, payload in files:
+            relative = os.path.join(os.path.basename(shard), f"{name}_{transform}.jpg")
+            with open(os.path.join(directory, relative), "wb") as f:
+                f.write(payload)
+            rows.append((relative, group, transform))
+    return rows
+
+
+# Function to make sure directory holds at least `groups` groups, generating only the missing
+# ones, and return the manifest rows of all groups
+def build_corpus(directory, groups, seed=0, **options):
+    rows = read_manifest(directory) if os.path.exists(os.path.join(directory, MANIFEST_NAME)) else []
+    existing = max((group for _, group, _ in rows), default=-1) + 1
+    if existing < groups:
+        rows += write_groups(directory, groups, existing, seed=seed, **options)
+        with open(os.path.join(directory, MANIFEST_NAME), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("path", "group", "transform"))
+            writer.writerows(rows)
+    return [row for row in rows if row[1] < groups]
+
+
+# Function to read the manifest rows (relative path, group, transform) of a corpus
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(path, int(group), transform) for path, group, transform in reader]
+
+
+# Function to return the shard directories that hold the first `groups` groups
+def shard_roots(directory, groups):
+    return [os.path.join(directory, f"shard_{shard:04d}") for shard in range((groups + SHARD_GROUPS - 1) // SHARD_GROUPS)]
+
+
+# Function to write labeled pairs (path1, path2, label): every base/copy pair plus as many
+# pairs of bases from different groups
+def write_pairs(directory, rows, path, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = {group: relative for relative, group, transform in rows if transform == "base"}
+    pairs = [(bases[group], relative, 1) for relative, group, transform in rows
+             if transform != "base" and group in bases]
+    groups = sorted(bases)
+    for _ in range(len(pairs)):
+        first, second = rng.choice(groups, size=2, replace=False)
+        pairs.append((bases[first], bases[second], 0))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("path1", "path2", "label"))
+        writer.writerows((os.path.join(directory, a), os.path.join(directory, b), label) for a, b, label in pairs)
+    return len(pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic duplicate image/video corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.5)
+    parser.add_argument("--video-every", type=int, default=0, help="Make every Nth group a video (0 = no videos)")
+    parser.add_argument("--pairs", help="Also write a labeled pairs CSV (for bench_compact_embedding.py)")
+    args = parser.parse_args()
+
+    rows = build_corpus(args.directory, args.groups, seed=args.seed, image_size=(args.width, args.height),
+                        duplicate_fraction=args.duplicate_fraction, video_every=args.video_every)
+    print(f"{len(rows)} files in {args.groups} groups under {args.directory}")
+    if args.pairs:
+        print(f"{write_pairs(args.directory, rows, args.pairs, args.seed)} labeled pairs in {args.pairs}")
+
+
+if __name__ == "__main__":
+    main()
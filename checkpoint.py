@@ -0,0 +1,80 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+from exact_dedup import HASH_ALGORITHM
+
+# Scan checkpoints. A long scan periodically pickles its state (the files it
+# has finished, the duplicate indexes and the duplicates still waiting for a
+# decision) so that after a crash or an abort the next run can resume where it
+# stopped instead of starting over. Each set of scan roots gets its own file,
+# and a checkpoint is only resumed by a scan with the same settings.
+
+CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), ".mediamatch", "checkpoints")
+
+# Minimum time between periodic checkpoints
+CHECKPOINT_INTERVAL_SECONDS = 60
+
+# Bumped whenever the pickled state changes shape or meaning (such as the byte hashes)
+CHECKPOINT_VERSION = 4
+
+
+# Function to return the checkpoint file used for a set of scan roots
+def checkpoint_path(roots, directory=CHECKPOINT_DIR):
+    key = "\n".join(sorted(os.path.abspath(root) for root in roots))
+    return os.path.join(directory, hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest() + ".pickle")
+
+
+class ScanCheckpoint:
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.last_saved = time.monotonic()
+        self.saves = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Whether the periodic interval has passed since the last save
+    def due(self):
+        return time.monotonic() - self.last_saved >= self.interval
+
+    # Writes the state atomically, so a crash while saving leaves the previous checkpoint intact
+    def save(self, settings, state):
+        start = time.perf_counter()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump({"version": CHECKPOINT_VERSION, "byte_hash": HASH_ALGORITHM, "settings": settings,
+                         "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.last_saved = time.monotonic()
+        self.saves += 1
+        logging.info(f"Saved scan checkpoint to {self.path} in {time.perf_counter() - start:.2f}s")
+
+    # Returns the saved state, or None if there is no usable checkpoint for these settings
+    def load(self, settings):
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if (saved.get("version") != CHECKPOINT_VERSION or saved.get("byte_hash") != HASH_ALGORITHM
+                or saved.get("settings") != settings):
+            logging.warning(f"Ignoring checkpoint {self.path}: it was written by a scan with different settings")
+            return None
+        return saved["state"]
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
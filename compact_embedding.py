@@ -0,0 +1,116 @@
+import os
+import numpy as np
+
+# Compact CNN embeddings. The include_top=False VGG16 output is a 7x7x512
+# feature map (25,088 float32 values, ~100 KB per image). Global average
+# pooling reduces it to 512 values, an optional PCA projection reduces it
+# further, and the result is L2-normalized so cosine similarity is a dot
+# product. Vectors are then stored as float16 or as int8 with a per-vector
+# scale factor (2 KB -> 1 KB -> ~0.5 KB per image).
+
+VGG16_FEATURE_SHAPE = (7, 7, 512)
+
+# Rows scored at a time when computing similarities on a quantized matrix
+SIMILARITY_BLOCK_ROWS = 65536
+
+
+# Function to L2-normalize each row of a matrix (zero rows stay zero)
+def l2_normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+# Function to global-average-pool flattened feature maps (one vector or a batch) to channel means
+def global_average_pool(features, feature_shape=VGG16_FEATURE_SHAPE):
+    features = np.asarray(features, dtype=np.float32)
+    channels = feature_shape[-1]
+    if features.shape[-1] == channels:
+        return features  # Already pooled
+    spatial = features.reshape(features.shape[:-1] + (-1, channels))
+    return spatial.mean(axis=-2)
+
+
+class PCAProjection:
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)  # (n_components, dim)
+
+    @property
+    def n_components(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, n_components):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        mean = vectors.mean(axis=0)
+        _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, components[:n_components])
+
+    def transform(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["mean"], data["components"])
+
+
+class CompactEmbedder:
+    def __init__(self, pca=None, dtype=np.float16, feature_shape=VGG16_FEATURE_SHAPE):
+        if isinstance(pca, str):
+            pca = PCAProjection.load(pca) if os.path.exists(pca) else None
+        self.pca = pca
+        self.dtype = dtype
+        self.feature_shape = feature_shape
+
+    # Name used to key cached embeddings, so changing the mode never mixes vector types
+    @property
+    def name(self):
+        name = f"gap{self.feature_shape[-1]}"
+        if self.pca is not None:
+            name += f"_pca{self.pca.n_components}"
+        return name
+
+    # Turns a flattened feature map (or a batch of them) into a normalized compact embedding
+    def __call__(self, features):
+        if features is None:
+            return None
+        vectors = global_average_pool(features, self.feature_shape)
+        if self.pca is not None:
+            vectors = self.pca.transform(vectors)
+        return l2_normalize_rows(vectors).astype(self.dtype)
+
+
+# Function to quantize rows to int8 with one float32 scale per row (value = int8 * scale)
+def quantize_int8(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=-1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales)
+    quantized = np.round(matrix / scales[..., None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+# Function to undo quantize_int8
+def dequantize_int8(quantized, scales):
+    return quantized.astype(np.float32) * scales[..., None]
+
+
+# Function to compute dot products between the rows of a float16/int8 matrix and a float32 query.
+# Rows are upcast a block at a time, so memory stays at the compact size plus one block.
+def quantized_similarities(matrix, query, scales=None, block_rows=SIMILARITY_BLOCK_ROWS):
+    query = np.asarray(query, dtype=np.float32)
+    if matrix.dtype == np.float32:
+        similarities = matrix @ query
+    else:
+        similarities = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], block_rows):
+            block = matrix[start:start + block_rows].astype(np.float32)
+            similarities[start:start + block_rows] = block @ query
+    if scales is not None:
+        similarities *= scales
+    return similarities
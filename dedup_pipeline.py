@@ -0,0 +1,315 @@
+import time
+from collections import deque
+import logging
+import numpy as np
+from exact_dedup import ExactDuplicateFinder
+from hamming_index import HammingIndex
+from similarity_index import normalize_vector
+from metrics import METRICS
+
+# Multi-stage duplicate funnel. Each file goes through the cheapest stage that
+# can decide it:
+#   1. exact  - byte-identical copies (size, partial hash, full hash), read
+#               concurrently ahead of the later stages
+#   2. phash  - perceptual hash within match_distance bits of a stored file
+#   3. cnn    - only files whose nearest pHash neighbours fall between
+#               match_distance and candidate_distance bits are compared by CNN
+#               features against those neighbours
+# Files that no stage flags are stored as unique. Every stored file a duplicate
+# matches, not just the closest one, is reported to on_edge, so duplicates can
+# be grouped (see grouping.py). With on_edge set, hashed duplicates are stored
+# too, so a variant that only matches another duplicate is still linked to its
+# group whatever the scan order; the reported original is always a unique file.
+# The exact stage stores every file it sees before the later stages decide on
+# it, so a byte copy of a hashed duplicate is reported against that duplicate's
+# original, with its stage and score.
+
+STAGES = ("exact", "phash", "cnn")
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        rate = self.files / self.seconds if self.seconds else 0.0
+        return (f"{self.name}: {self.files} files in, {self.duplicates} duplicates, "
+                f"{self.seconds:.2f}s ({rate:.1f} files/sec)")
+
+
+class DedupPipeline:
+    def __init__(self, hash_fn, feature_fn=None, match_distance=4, candidate_distance=10,
+                 similarity_threshold=0.9, max_cached_features=10000):
+        self.hash_fn = hash_fn
+        self.feature_fn = feature_fn
+        self.match_distance = match_distance
+        self.candidate_distance = candidate_distance
+        self.similarity_threshold = similarity_threshold
+        self.exact = ExactDuplicateFinder()
+        self.hashes = HammingIndex(max_distance=candidate_distance)
+        self.linked = set()  # Duplicates stored in hashes for grouping, never reported as an original
+        self.resolved = {}  # Hashed duplicate -> (original, stage, score) it was reported with
+        self.features = {}
+        self.max_cached_features = max_cached_features
+        self.feature_extractions = 0
+        self.stats = {name: StageStats(name) for name in STAGES}
+        self.unique = 0
+        self.on_decided = None  # Called with (path, duplicate or None) once run() has decided a file
+        self.on_edge = None  # Called with (path, stored file, stage, score) for every match of a duplicate
+
+    # Index contents and counters, picklable so a scan can be checkpointed and resumed
+    def state(self):
+        return {"exact": self.exact, "hashes": self.hashes, "linked": self.linked, "resolved": self.resolved,
+                "stats": self.stats, "unique": self.unique}
+
+    def restore(self, state):
+        self.exact = state["exact"]
+        self.hashes = state["hashes"]
+        self.linked = state.get("linked", set())
+        self.resolved = state.get("resolved", {})
+        self.stats = state["stats"]
+        self.unique = state["unique"]
+
+    # Whether a file is stored by any stage
+    def __contains__(self, path):
+        return path in self.exact or path in self.hashes
+
+    # Forgets a stored file (deleted or rewritten) so it is neither matched nor reported any more.
+    # Returns False if it was not stored.
+    def remove(self, path):
+        self.features.pop(path, None)
+        self.resolved.pop(path, None)
+        hashed = self.hashes.remove(path)
+        stored = self.exact.remove(path)
+        if path in self.linked:
+            self.linked.discard(path)
+        elif hashed or (stored and self.hash_fn is None):  # Without hashes, every exact-unique file counts
+            self.unique -= 1
+        return hashed or stored
+
+    def _decided(self, path, duplicate=None):
+        if self.on_decided is not None:
+            self.on_decided(path, duplicate)
+
+    def _edge(self, path, other, stage, score):
+        if self.on_edge is not None:
+            self.on_edge(path, other, stage, score)
+
+    def _features(self, path):
+        if path not in self.features:
+            if len(self.features) >= self.max_cached_features:
+                del self.features[next(iter(self.features))]  # Forget the oldest features
+            with METRICS.timed("cnn_features"):
+                features = self.feature_fn(path)
+            self.feature_extractions += 1
+            self.features[path] = None if features is None else normalize_vector(features)
+        return self.features[path]
+
+    def _exact_match(self, path, original):
+        if original is not None and original != path:  # A resumed scan may see a file it already indexed
+            self.stats["exact"].duplicates += 1
+            self._edge(path, original, "exact", 1.0)
+            return original, "exact", 1.0
+        return None
+
+    # A copy of a hashed duplicate is reported with that duplicate's match, unless its original is gone
+    def _resolve(self, match):
+        resolved = self.resolved.get(match[0])
+        if resolved is None or resolved[0] not in self.hashes:
+            return match
+        return resolved
+
+    def _exact_stage(self, path):
+        stats = self.stats["exact"]
+        start = time.perf_counter()
+        stats.files += 1
+        original = self.exact.check(path)
+        stats.seconds += time.perf_counter() - start
+        return self._exact_match(path, original)
+
+    # Yields (path, exact match or None) for every path, reading files concurrently. Time spent
+    # waiting on file_paths itself is not charged to the exact stage.
+    def _exact_stream(self, file_paths):
+        stats = self.stats["exact"]
+        waited = 0.0
+
+        def timed_paths():
+            nonlocal waited
+            paths = iter(file_paths)
+            while True:
+                start = time.perf_counter()
+                path = next(paths, None)
+                waited += time.perf_counter() - start
+                if path is None:
+                    return
+                yield path
+
+        results = self.exact.iter_check(timed_paths())
+        try:
+            while True:
+                start = time.perf_counter()
+                waited_before = waited
+                item = next(results, None)
+                stats.seconds += time.perf_counter() - start - (waited - waited_before)
+                if item is None:
+                    return
+                stats.files += 1
+                path, original = item
+                yield path, self._exact_match(path, original)
+        finally:
+            results.close()
+
+    # Returns the most similar unique neighbour above the threshold, or None
+    def _cnn_stage(self, path, neighbours):
+        stats = self.stats["cnn"]
+        start = time.perf_counter()
+        stats.files += 1
+        try:
+            features = self._features(path)
+            if features is None:
+                return None
+            best = None
+            for neighbour in neighbours:
+                neighbour_features = self._features(neighbour)
+                if neighbour_features is None:
+                    continue
+                similarity = float(np.dot(features, neighbour_features))
+                if similarity < self.similarity_threshold:
+                    continue
+                self._edge(path, neighbour, "cnn", similarity)
+                if neighbour in self.linked:
+                    continue
+                if best is None or similarity > best[1]:
+                    best = (neighbour, similarity)
+            if best is not None:
+                stats.duplicates += 1
+            return best
+        finally:
+            stats.seconds += time.perf_counter() - start
+
+    def _hash_stages(self, path, file_hash):
+        stats = self.stats["phash"]
+        start = time.perf_counter()
+        matches = [] if file_hash is None else self.hashes.query(file_hash)
+        lookup_seconds = time.perf_counter() - start
+        stats.seconds += lookup_seconds
+        METRICS.observe("index_lookup", lookup_seconds)
+        if file_hash is None:
+            return None
+
+        for neighbour, distance in matches:
+            if distance > self.match_distance:
+                break  # Matches are sorted by distance
+            self._edge(path, neighbour, "phash", distance)
+        originals = [(neighbour, distance) for neighbour, distance in matches if neighbour not in self.linked]
+        match = None
+        if originals and originals[0][1] <= self.match_distance:
+            stats.duplicates += 1
+            match = originals[0] + ("phash",)
+        elif matches and self.feature_fn is not None:
+            match = self._cnn_stage(path, [neighbour for neighbour, _ in matches])
+            if match is not None:
+                match += ("cnn",)
+
+        if match is None:
+            self.hashes.add(path, file_hash)
+            self.unique += 1
+            return None
+        if self.on_edge is not None:
+            self.hashes.add(path, file_hash)
+            self.linked.add(path)
+        original, score, stage = match
+        self.resolved[path] = (original, stage, score)
+        return self.resolved[path]
+
+    def _hash(self, path):
+        stats = self.stats["phash"]
+        start = time.perf_counter()
+        file_hash = self.hash_fn(path)
+        stats.seconds += time.perf_counter() - start
+        return file_hash
+
+    # Returns (original, stage, score) if the file duplicates an earlier one, else None
+    def check(self, path):
+        match = self._exact_stage(path)
+        if match is not None:
+            return self._resolve(match)
+        if self.hash_fn is None:  # Only the exact stage runs
+            self.unique += 1
+            return None
+        self.stats["phash"].files += 1
+        return self._hash_stages(path, self._hash(path))
+
+    # Yields (path, original, stage, score) for every duplicate among the paths. hash_stream, if
+    # given, turns the paths that survive the exact stage into (path, hash) pairs, e.g. on a worker pool.
+    # Without a hash_fn or hash_stream only the exact stage runs.
+    def run(self, file_paths, hash_stream=None):
+        if self.hash_fn is None and hash_stream is None:
+            for path, match in self._exact_stream(file_paths):
+                if match is None:
+                    self.unique += 1
+                    self._decided(path)
+                else:
+                    duplicate = (path,) + match
+                    self._decided(path, duplicate)
+                    yield duplicate
+            return
+
+        exact_duplicates = deque()
+        undecided = set()  # Survivors handed to the hash stream whose hash stages have not run yet
+
+        def survivors():
+            for path, match in self._exact_stream(file_paths):
+                if match is None:
+                    self.stats["phash"].files += 1
+                    undecided.add(path)
+                    yield path
+                else:
+                    exact_duplicates.append((path,) + match)
+
+        # Exact copies wait until the file they copy is decided, so they can be resolved to its original
+        def decided_copies(flush=False):
+            while exact_duplicates and (flush or exact_duplicates[0][1] not in undecided):
+                path, original, stage, score = exact_duplicates.popleft()
+                duplicate = (path,) + self._resolve((original, stage, score))
+                self._decided(path, duplicate)
+                yield duplicate
+
+        if hash_stream is None:
+            hashed = ((path, self._hash(path)) for path in survivors())
+        else:
+            hashed = self._timed_stream(hash_stream(survivors()))
+        for path, file_hash in hashed:
+            yield from decided_copies()
+            match = self._hash_stages(path, file_hash)
+            undecided.discard(path)
+            duplicate = None if match is None else (path,) + match
+            self._decided(path, duplicate)
+            if duplicate is not None:
+                yield duplicate
+        yield from decided_copies(flush=True)
+
+    # Charges time spent waiting on an external hash stream to the phash stage
+    def _timed_stream(self, stream):
+        stream = iter(stream)
+        while True:
+            start = time.perf_counter()
+            exact_seconds = self.stats["exact"].seconds
+            item = next(stream, None)
+            waited = time.perf_counter() - start - (self.stats["exact"].seconds - exact_seconds)
+            self.stats["phash"].seconds += waited
+            if item is None:
+                return
+            yield item
+
+    # Per-stage counts and timings, one line per stage
+    def report(self):
+        lines = [str(self.stats[name]) for name in STAGES]
+        lines.append(f"unique: {self.unique} files, {self.exact.partial_hashes} partial and "
+                     f"{self.exact.full_hashes} full byte hashes, {self.feature_extractions} CNN feature extractions")
+        for line in lines:
+            logging.info(line)
+        return lines
@@ -0,0 +1,200 @@
+import os
+import time
+import logging
+import argparse
+import importlib.util
+import numpy as np
+
+# Pluggable CNN embedding backends. A backend turns a batch of decoded RGB
+# images (float32, N x height x width x 3, values 0-255) into one feature
+# vector or feature map per image. It offers the same preprocess() and
+# predict_on_batch() calls as a Keras model, so BatchFeatureExtractor and the
+# feature extraction in mediamatch_core work with any of them.
+#
+# VGG16 runs on TensorFlow/Keras as before. Smaller CPU-friendly models run on
+# TFLite, which needs neither TensorFlow nor a GPU and also runs on phones,
+# such as MobileNetV3-Small (about 0.06 GFLOPs and 4 MB instead of 15 GFLOPs
+# and 528 MB). Their model files are looked up in MODEL_DIR; each can have an
+# int8 variant (weights quantized to int8) next to it, named
+# <model>.int8.tflite. `python embedding_backends.py mobilenet_v3_small
+# [--int8]` writes MobileNetV3-Small from the Keras weights. Only models that
+# export_tflite() can write are registered.
+
+MODEL_DIR = os.path.join(os.path.expanduser("~"), ".mediamatch", "models")
+
+# Name -> runtime, model file, output shape (a feature map is average-pooled by CompactEmbedder),
+# input size and input preprocessing
+BACKENDS = {
+    "vgg16": {"runtime": "keras", "application": "VGG16", "feature_shape": (7, 7, 512),
+              "input_size": (224, 224), "preprocess": "caffe"},
+    "mobilenet_v3_small": {"runtime": "tflite", "file": "mobilenet_v3_small.tflite", "feature_shape": (7, 7, 576),
+                           "input_size": (224, 224), "preprocess": "none"},
+}
+
+# Keras applications that export_tflite() can convert, with their constructor options
+KERAS_EXPORTS = {
+    "mobilenet_v3_small": ("MobileNetV3Small", {"include_top": False, "minimalistic": False}),
+}
+
+IMAGENET_BGR_MEANS = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+# Function to apply the Caffe-style preprocessing of VGG16 (BGR, ImageNet means subtracted)
+def preprocess_caffe(batch):
+    return batch[..., ::-1] - IMAGENET_BGR_MEANS
+
+
+PREPROCESSING = {
+    "caffe": preprocess_caffe,
+    "none": lambda batch: batch,  # The model preprocesses its input itself
+}
+
+
+# Function to return the registry entry of a backend
+def backend_spec(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name} (choose from {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[name]
+
+
+# Function to return the model file of a backend, or of its int8 variant
+def model_path(name, quantized=False, model_dir=None):
+    spec = backend_spec(name)
+    if "file" not in spec:
+        return None
+    path = os.path.join(model_dir or MODEL_DIR, spec["file"])
+    if quantized:
+        stem, extension = os.path.splitext(path)
+        path = f"{stem}.int8{extension}"
+    return path
+
+
+# Function to check whether a backend can be loaded here: its runtime imports and its model file exists
+def backend_available(name, quantized=False, model_dir=None):
+    spec = backend_spec(name)
+    modules = {"keras": ("tensorflow",), "tflite": ("tflite_runtime", "tensorflow")}
+    if not any(importlib.util.find_spec(module) is not None for module in modules[spec["runtime"]]):
+        return False
+    path = model_path(name, model_dir=model_dir)
+    if path is None:
+        return True
+    if quantized and spec["runtime"] == "tflite":
+        path = model_path(name, quantized=True, model_dir=model_dir)
+    return os.path.exists(path)
+
+
+class EmbeddingBackend:
+    def __init__(self, name, threads=None, quantized=False):
+        spec = backend_spec(name)
+        self.name = name
+        self.threads = threads
+        self.quantized = quantized
+        self.feature_shape = spec["feature_shape"]
+        self.input_size = spec["input_size"]
+        self._preprocess = PREPROCESSING[spec["preprocess"]]
+
+    def preprocess(self, batch):
+        return np.asarray(self._preprocess(np.asarray(batch, dtype=np.float32)), dtype=np.float32)
+
+    def predict(self, batch):
+        return self.predict_on_batch(batch)
+
+
+class KerasBackend(EmbeddingBackend):
+    def __init__(self, name, threads=None, quantized=False, model_dir=None):
+        super().__init__(name, threads, False)
+        if quantized:
+            logging.warning(f"No int8 variant of {name} on TensorFlow, using float32 weights")
+        import tensorflow as tf  # TensorFlow takes seconds to import
+        if threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError as e:  # Only possible before TensorFlow has run anything
+                logging.warning(f"Cannot set TensorFlow threads: {e}")
+        application = getattr(tf.keras.applications, backend_spec(name)["application"])
+        self.model = application(weights="imagenet", include_top=False, input_shape=self.input_size + (3,))
+
+    def predict_on_batch(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend(EmbeddingBackend):
+    def __init__(self, name, threads=None, quantized=False, model_dir=None):
+        super().__init__(name, threads, quantized)
+        try:
+            from tflite_runtime.interpreter import Interpreter  # Small runtime, also built for Android
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        path = model_path(name, quantized=quantized, model_dir=model_dir)
+        self.interpreter = Interpreter(model_path=path, num_threads=threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def predict_on_batch(self, batch):
+        if len(batch) != self.batch_size:  # Resizing reallocates every tensor, so only when the size changes
+            self.interpreter.resize_tensor_input(self.input["index"], (len(batch),) + tuple(batch.shape[1:]))
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(batch)
+        dtype = self.input["dtype"]
+        if dtype != np.float32:  # Fully integer model: quantize the input with its scale and zero point
+            scale, zero_point = self.input["quantization"]
+            info = np.iinfo(dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(self.input["index"], np.ascontiguousarray(batch, dtype=dtype))
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output["index"])
+        if output.dtype != np.float32:
+            scale, zero_point = self.output["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+RUNTIMES = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+}
+
+
+# Function to load an embedding backend. threads caps the CPU threads its runtime uses (None lets
+# the runtime decide), quantized selects the int8 model.
+def make_backend(name, threads=None, quantized=False, model_dir=None):
+    start = time.perf_counter()
+    backend = RUNTIMES[backend_spec(name)["runtime"]](name, threads, quantized, model_dir)
+    logging.info(f"Loaded the {name}{' int8' if backend.quantized else ''} embedding backend in "
+                 f"{time.perf_counter() - start:.1f}s")
+    return backend
+
+
+# Function to convert a Keras application to a TFLite model file for the backend of the same name.
+# With quantize, weights are stored as int8 (dynamic-range quantization, no calibration images needed).
+def export_tflite(name, quantize=False, model_dir=None):
+    import tensorflow as tf
+    application, options = KERAS_EXPORTS[name]
+    input_size = backend_spec(name)["input_size"]
+    model = getattr(tf.keras.applications, application)(weights="imagenet", input_shape=input_size + (3,),
+                                                        **options)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    path = model_path(name, quantized=quantize, model_dir=model_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    logging.info(f"Wrote {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the TFLite model file of an embedding backend")
+    parser.add_argument("backend", choices=sorted(KERAS_EXPORTS))
+    parser.add_argument("--int8", action="store_true", help="Store the weights as int8")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    export_tflite(args.backend, args.int8, args.model_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import os
+import mmap
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from metrics import METRICS
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Byte-level duplicate detection.
+# Files are grouped by size first; only files that share a size with an earlier
+# file are read at all. Those are compared by a cheap partial hash of a block at
+# the head, the middle and the tail, and only partial-hash collisions are
+# confirmed with a hash of the full contents, read through mmap for large files
+# and in large buffered chunks otherwise. The full hash is xxh3_128 when the
+# xxhash package is installed and 128-bit BLAKE2b otherwise. iter_check() runs
+# the reads on a thread pool with a cap on outstanding checks, so slow or
+# networked volumes are read at disk bandwidth rather than one request at a time.
+# Empty files are skipped: they all share a size and a hash, but an empty or
+# truncated media file is not a copy of another one.
+
+PARTIAL_BLOCK_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Files at least this large are read through mmap
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+# Reader threads, and files checked or queued ahead of the caller at most
+IO_WORKERS = 8
+MAX_IN_FLIGHT = 64
+
+HASH_ALGORITHM = "xxh3_128" if xxhash is not None else "blake2b"
+
+
+# Function to create an empty content digest
+def new_digest():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+# Function to hash a block at the head, the middle and the tail of a file (all of a small file)
+def partial_hash(file_path, size, block_size=PARTIAL_BLOCK_SIZE):
+    digest = new_digest()
+    with open(file_path, "rb", buffering=0) as f:
+        if size <= 3 * block_size:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - block_size) // 2, size - block_size):
+                f.seek(offset)
+                digest.update(f.read(block_size))
+    return digest.digest()
+
+
+# Function to hash the full contents of a file
+def full_hash(file_path):
+    digest = new_digest()
+    with open(file_path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, "madvise"):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)  # Aggressive read-ahead, pages dropped behind
+                    with memoryview(mapped) as view:
+                        for offset in range(0, len(view), READ_CHUNK_SIZE):
+                            digest.update(view[offset:offset + READ_CHUNK_SIZE])
+                return digest.digest()
+            except (OSError, ValueError, OverflowError) as e:  # e.g. no address space on 32-bit phones
+                logging.debug(f"Cannot map {file_path}, reading it instead: {e}")
+                digest = new_digest()
+                f.seek(0)
+        buffer = bytearray(READ_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.digest()
+
+
+# Function to list the paths stored under one size of ExactDuplicateFinder.by_size
+def stored_paths(stored):
+    if isinstance(stored, str):
+        return [stored]
+    return [path for by_full in stored.values() for path in stored_paths(by_full)]
+
+
+class ExactDuplicateFinder:
+    def __init__(self):
+        # size -> first path (nothing read yet), or partial hash -> (first path, or full hash -> path)
+        self.by_size = {}
+        self.sizes = {}  # path -> size of every stored file, so remove() looks in one size only
+        self.partial_hashes = 0
+        self.full_hashes = 0
+        self.lock = threading.Lock()
+
+    # The lock is not picklable; the finder is saved with scan checkpoints
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        if "sizes" not in state:  # Saved before sizes were kept
+            self.sizes = {path: size for size, stored in self.by_size.items() for path in stored_paths(stored)}
+
+    def __contains__(self, file_path):
+        return file_path in self.sizes
+
+    def _partial(self, file_path, size):
+        with self.lock:
+            self.partial_hashes += 1
+        with METRICS.timed("read_partial"):
+            return partial_hash(file_path, size)
+
+    def _full(self, file_path):
+        with self.lock:
+            self.full_hashes += 1
+        with METRICS.timed("read_full"):
+            return full_hash(file_path)
+
+    # Returns the earlier file with identical contents, or None (the file is then remembered, unless it is
+    # empty). The partial and full hashes of the file may be passed in if they were already read.
+    def check(self, file_path, size=None, partial=None, digest=None):
+        try:
+            if size is None:
+                size = os.path.getsize(file_path)
+            if size == 0:
+                return None
+            by_partial = self.by_size.get(size)
+            if by_partial is None:
+                self.by_size[size] = file_path  # Unique size so far, nothing needs to be read
+                self.sizes[file_path] = size
+                return None
+            if isinstance(by_partial, str):
+                by_partial = {self._partial(by_partial, size): by_partial}
+                self.by_size[size] = by_partial
+
+            if partial is None:
+                partial = self._partial(file_path, size)
+            by_full = by_partial.get(partial)
+            if by_full is None:
+                by_partial[partial] = file_path
+                self.sizes[file_path] = size
+                return None
+            if isinstance(by_full, str):
+                by_full = {self._full(by_full): by_full}
+                by_partial[partial] = by_full
+
+            if digest is None:
+                digest = self._full(file_path)
+            if digest in by_full:
+                return by_full[digest]
+            by_full[digest] = file_path
+            self.sizes[file_path] = size
+        except OSError as e:
+            logging.error(f"Error reading {file_path}: {e}")
+        return None
+
+    # Reads the hashes the file will probably need while earlier files of its size are still being
+    # checked, then checks it once they are done, so the same copy is always the original
+    def _check_after(self, previous, file_path, size):
+        try:
+            partial = self._partial(file_path, size)
+            digest = None
+            by_partial = self.by_size.get(size)
+            if isinstance(by_partial, dict) and partial in by_partial:  # Seen already, a likely copy
+                digest = self._full(file_path)
+        except OSError as e:
+            logging.error(f"Error reading {file_path}: {e}")
+            return None
+        if previous is not None:
+            wait([previous])
+        return self.check(file_path, size, partial, digest)
+
+    # Yields (path, earlier file with identical contents or None) for every path, in order. Files of
+    # different sizes are read concurrently on a thread pool, with at most max_in_flight files checked
+    # or queued ahead of the caller; files with a size not seen so far need no read and are decided
+    # right away.
+    def iter_check(self, file_paths, workers=IO_WORKERS, max_in_flight=MAX_IN_FLIGHT):
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+        queued = {}  # size -> the newest check of that size still in flight
+        try:
+            file_paths = iter(file_paths)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_in_flight:
+                    path = next(file_paths, None)
+                    if path is None:
+                        exhausted = True
+                        break
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError as e:
+                        logging.error(f"Error reading {path}: {e}")
+                        pending.append((path, None, None))
+                        continue
+                    if size == 0:
+                        pending.append((path, size, None))
+                        continue
+                    if size not in queued and size not in self.by_size:
+                        pending.append((path, size, self.check(path, size)))
+                        continue
+                    future = executor.submit(self._check_after, queued.get(size), path, size)
+                    queued[size] = future
+                    pending.append((path, size, future))
+                METRICS.set_gauge("exact_in_flight", len(pending))
+                if not pending:
+                    break
+                path, size, original = pending.popleft()
+                if isinstance(original, Future):
+                    if queued.get(size) is original:
+                        del queued[size]
+                    original = original.result()
+                yield path, original
+        finally:
+            # Let running reads finish, so the index is not changed behind a checkpoint
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    # Forgets a stored file, e.g. one that was deleted or rewritten, looking only among the files of the
+    # size it was stored with. Returns False if the file is not stored.
+    def remove(self, file_path):
+        size = self.sizes.pop(file_path, None)
+        if size is None:
+            return False
+        by_partial = self.by_size.get(size)
+        if by_partial == file_path:
+            del self.by_size[size]
+            return True
+        for partial, by_full in by_partial.items():
+            if by_full == file_path:
+                del by_partial[partial]
+            elif isinstance(by_full, dict) and file_path in by_full.values():
+                del by_full[next(digest for digest, path in by_full.items() if path == file_path)]
+                if by_full:
+                    return True
+                del by_partial[partial]
+            else:
+                continue
+            if not by_partial:
+                del self.by_size[size]
+            return True
+        return False
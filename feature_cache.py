@@ -0,0 +1,229 @@
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from metrics import METRICS
+
+# Persistent cache of per-file hashes and feature vectors.
+# Entries are stored in SQLite keyed by (path, kind) and are only reused while
+# the file's size, mtime and inode still match what was recorded. With
+# use_digest=True a file whose size matches but whose mtime/inode changed (for
+# example a copy or a touched file) is revalidated by content digest instead of
+# being recomputed.
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".mediamatch", "cache.sqlite")
+
+# Number of writes buffered before the cache commits to disk
+COMMIT_INTERVAL = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT,
+    value,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (path, kind)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+# Function to compute a content digest of a file
+def file_digest(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to convert a value to something SQLite can store
+def encode_value(value):
+    if isinstance(value, (int, np.integer)):
+        value = int(value)
+        # SQLite integers are signed 64-bit, 64-bit hashes are stored two's complement
+        return value - (1 << 64) if value >= 1 << 63 else value
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(value), allow_pickle=False)
+    return buffer.getvalue()
+
+
+# Function to convert a stored value back to an int or NumPy array
+def decode_value(value):
+    if isinstance(value, int):
+        return value & 0xFFFFFFFFFFFFFFFF
+    return np.load(io.BytesIO(value), allow_pickle=False)
+
+
+class FeatureCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=None, use_digest=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.use_digest = use_digest
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.touched = {}
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _maybe_commit(self):
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_INTERVAL:
+            self._commit()
+
+    def _commit(self):
+        start = time.perf_counter()
+        if self.touched:
+            self.connection.executemany(
+                "UPDATE entries SET last_used = ? WHERE path = ? AND kind = ?",
+                [(used, path, kind) for (path, kind), used in self.touched.items()])
+            self.touched = {}
+        self.connection.commit()
+        self.pending_writes = 0
+        METRICS.observe("cache_commit", time.perf_counter() - start)
+
+    # Returns the cached value for a file, or None if missing or out of date
+    def get(self, file_path, kind, stat=None):
+        with METRICS.timed("cache_read"):
+            return self._get(file_path, kind, stat)
+
+    def _get(self, file_path, kind, stat):
+        try:
+            stat = stat or os.stat(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, inode, digest, value FROM entries WHERE path = ? AND kind = ?",
+                (file_path, kind)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            size, mtime_ns, inode, digest, value = row
+            if (size, mtime_ns, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                if not (self.use_digest and digest and size == stat.st_size and file_digest(file_path) == digest):
+                    self.misses += 1
+                    return None
+                # Same content under a new mtime/inode: refresh the key instead of recomputing
+                self.connection.execute(
+                    "UPDATE entries SET mtime_ns = ?, inode = ? WHERE path = ? AND kind = ?",
+                    (stat.st_mtime_ns, stat.st_ino, file_path, kind))
+                self._maybe_commit()
+            self.hits += 1
+            self.touched[(file_path, kind)] = time.time()
+            return decode_value(value)
+
+    def put(self, file_path, kind, value, stat=None):
+        try:
+            stat = stat or os.stat(file_path)
+            digest = file_digest(file_path) if self.use_digest else None
+        except OSError as e:
+            logging.warning(f"Not caching {file_path}: {e}")
+            return
+        encoded = encode_value(value)
+        nbytes = len(encoded) if isinstance(encoded, bytes) else 8
+        with self.lock, METRICS.timed("cache_write"):
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path, kind, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest, encoded, nbytes,
+                 time.time()))
+            self._maybe_commit()
+
+    # Returns the cached value or computes, stores and returns it (None results are not cached)
+    def get_or_compute(self, file_path, kind, compute):
+        value = self.get(file_path, kind)
+        if value is None:
+            value = compute(file_path)
+            if value is not None:
+                self.put(file_path, kind, value)
+        return value
+
+    # Removes entries under the scanned roots whose file was deleted or changed since it was cached.
+    # Entries elsewhere (other roots, an unmounted drive) are kept, and so is everything under a root
+    # that is not there right now.
+    def prune_stale(self, roots):
+        prefixes = set()
+        for root in roots:
+            if not os.path.isdir(root):
+                logging.info(f"Not pruning cache entries under {root}, which is not available")
+                continue
+            prefixes.add(root if root.endswith(os.sep) else root + os.sep)
+        with self.lock:
+            self._commit()
+            stale = set()
+            for prefix in prefixes:
+                # Paths under the prefix sort between it and the same string with the separator incremented
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                for path, kind, size, mtime_ns in self.connection.execute(
+                        "SELECT path, kind, size, mtime_ns FROM entries WHERE path >= ? AND path < ?",
+                        (prefix, upper)).fetchall():
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        stale.add((path, kind))
+                        continue
+                    if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns) and not self.use_digest:
+                        stale.add((path, kind))
+            self.connection.executemany("DELETE FROM entries WHERE path = ? AND kind = ?", stale)
+            self.connection.commit()
+        if stale:
+            logging.info(f"Removed {len(stale)} stale cache entries")
+        return len(stale)
+
+    def total_bytes(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+
+    # Evicts least recently used entries until the cache fits in max_bytes
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+        with self.lock:
+            self._commit()
+            total = self.connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+            evicted = []
+            if total > max_bytes:
+                for path, kind, nbytes in self.connection.execute(
+                        "SELECT path, kind, nbytes FROM entries ORDER BY last_used"):
+                    evicted.append((path, kind))
+                    total -= nbytes
+                    if total <= max_bytes:
+                        break
+                self.connection.executemany("DELETE FROM entries WHERE path = ? AND kind = ?", evicted)
+                self.connection.commit()
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} cache entries to stay under {max_bytes} bytes")
+        return len(evicted)
+
+    # Commits buffered writes, e.g. before a checkpoint that assumes they are on disk
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.connection.close()
@@ -0,0 +1,450 @@
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from exact_dedup import full_hash
+from metrics import METRICS
+
+# Applies a reviewed cleanup plan to duplicate files. Every planned action is one of
+#   delete      - remove the duplicate
+#   quarantine  - move it into a quarantine folder that mirrors its original path,
+#                 renaming within the same filesystem so nothing is copied
+#   hardlink    - replace it with a hard link to the file that is kept
+#   reflink     - replace it with a copy-on-write clone of the kept file
+# Links are only made for byte-identical files, since afterwards both paths
+# show the kept file's contents. Actions run on a thread pool (they are
+# dominated by file system latency), and every completed action is appended
+# to a JSON Lines journal, so a session can be undone (quarantined files are
+# moved back, links are turned back into independent copies) or its quarantine
+# purged once the result has been checked. Deletions cannot be undone. A plan
+# in which a file is both removed and kept for another file is refused before
+# anything is applied, and every kept copy is checked to still exist right
+# before its duplicate is removed.
+
+ACTIONS = ("delete", "quarantine", "hardlink", "reflink")
+
+MEDIAMATCH_DIR = os.path.join(os.path.expanduser("~"), ".mediamatch")
+QUARANTINE_DIR = os.path.join(MEDIAMATCH_DIR, "quarantine")
+JOURNAL_DIR = os.path.join(MEDIAMATCH_DIR, "journals")
+
+# Folder created at the root of a filesystem to quarantine its files when QUARANTINE_DIR is on another one
+VOLUME_QUARANTINE_NAME = ".mediamatch-quarantine"
+
+# Number of threads applying actions
+ACTION_WORKERS = 16
+
+# Number of journal records between two fsyncs
+JOURNAL_SYNC_INTERVAL = 1000
+
+# Linux ioctl that clones a file's extents (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+
+class PlannedAction:
+    def __init__(self, action, path, keeper=None):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if action in ("hardlink", "reflink") and keeper is None:
+            raise ValueError(f"{action} needs the path of the file that is kept")
+        self.action = action
+        self.path = path
+        self.keeper = keeper
+
+    def __repr__(self):
+        return f"PlannedAction({self.action!r}, {self.path!r}, {self.keeper!r})"
+
+
+class ActionPlan:
+    def __init__(self, actions=None):
+        self.actions = list(actions or [])
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def add(self, action, path, keeper=None):
+        self.actions.append(PlannedAction(action, path, keeper))
+
+    # Returns the problems that make the plan unsafe to apply: a file planned twice, a file that is its
+    # own keeper, or a file that is removed or replaced while another action keeps it. Two duplicates
+    # naming each other as keeper would otherwise both be deleted.
+    def conflicts(self):
+        problems = []
+        planned = set()
+        keepers = {os.path.abspath(action.keeper) for action in self.actions if action.keeper is not None}
+        for action in self.actions:
+            path = os.path.abspath(action.path)
+            if path in planned:
+                problems.append(f"{action.path} is planned more than once")
+            elif action.keeper is not None and path == os.path.abspath(action.keeper):
+                problems.append(f"{action.path} is its own kept file")
+            elif path in keepers:
+                problems.append(f"{action.path} is kept for other duplicates, it cannot be removed or replaced")
+            planned.add(path)
+        return problems
+
+    # Plan `action` for every file of the clusters except the one each cluster keeps
+    @classmethod
+    def from_clusters(cls, clusters, action="quarantine"):
+        plan = cls()
+        for cluster in clusters:
+            keeper, rest = cluster.proposal()
+            for path in rest:
+                plan.add(action, path, keeper)
+        return plan
+
+    # Reads a plan from JSON Lines records with "path" and "cluster" (the kept file) and an optional
+    # "action", such as the reports written by mediamatch_cli.py
+    @classmethod
+    def load(cls, path, default_action="quarantine"):
+        plan = cls()
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    plan.add(record.get("action", default_action), record["path"], record.get("cluster"))
+        return plan
+
+
+# Function to return the path below a quarantine root that mirrors a file's absolute path
+def mirrored_path(root, path):
+    drive, rest = os.path.splitdrive(os.path.abspath(path))
+    drive = drive.strip("\\/:").replace("\\", "_").replace("/", "_").replace(":", "")  # C: -> C, UNC -> server_share
+    return os.path.join(root, drive, rest.lstrip("\\/"))
+
+
+# Function to return the mount point of the filesystem holding path
+def mount_point(path):
+    path = os.path.abspath(path)
+    device = os.stat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != device:
+            return path
+        path = parent
+
+
+# Function to return a path that does not exist yet, adding " (1)", " (2)", ... before the extension
+def unused_path(path):
+    if not os.path.lexists(path):
+        return path
+    stem, extension = os.path.splitext(path)
+    number = 1
+    while os.path.lexists(f"{stem} ({number}){extension}"):
+        number += 1
+    return f"{stem} ({number}){extension}"
+
+
+# Function to move a file, renaming when both paths are on the same filesystem and copying otherwise
+def move_file(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.rename(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, target)
+
+
+# Function to clone source to target without copying data (copy-on-write), raising OSError if unsupported
+def reflink(source, target):
+    if sys.platform.startswith("linux"):
+        import fcntl
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError:
+                dst.close()
+                os.remove(target)
+                raise
+        return
+    if sys.platform == "darwin":
+        import subprocess
+        result = subprocess.run(["cp", "-c", source, target], capture_output=True, text=True)
+        if result.returncode == 0:
+            return
+        raise OSError(errno.EOPNOTSUPP, result.stderr.strip() or "clonefile failed", target)
+    raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform", target)
+
+
+# Function to check that two files have the same bytes
+def same_contents(path, other):
+    if os.path.getsize(path) != os.path.getsize(other):
+        return False
+    return full_hash(path) == full_hash(other)
+
+
+# Appends completed actions to a JSON Lines file, one record per line
+class ActionJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a")
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()  # A crash loses at most the action in progress
+            self.unsynced += 1
+            if self.unsynced >= JOURNAL_SYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+# Function to read the records of a journal
+def read_journal(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Function to return the journal of the most recent session, or None
+def latest_journal(directory=JOURNAL_DIR):
+    try:
+        journals = [name for name in os.listdir(directory) if name.endswith(".jsonl")]
+    except FileNotFoundError:
+        return None
+    return os.path.join(directory, max(journals)) if journals else None
+
+
+# Applies the actions of a plan on a thread pool and journals each one. on_progress(message) is
+# called after every action; cancel() stops the session after the actions in progress.
+class ActionExecutor:
+    def __init__(self, journal_path=None, quarantine_dir=QUARANTINE_DIR, workers=ACTION_WORKERS, on_progress=None):
+        self.session = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.journal_path = journal_path or os.path.join(JOURNAL_DIR, f"{self.session}.jsonl")
+        self.quarantine_dir = quarantine_dir
+        self.workers = workers
+        self.on_progress = on_progress
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.quarantine_roots = {}  # st_dev -> quarantine folder of this session on that filesystem
+        self.done = 0
+        self.failed = 0
+        self.freed_bytes = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    # Quarantine folder of this session on the filesystem holding path, so moving there is a rename
+    def _quarantine_root(self, path):
+        device = os.stat(path).st_dev
+        with self.lock:
+            root = self.quarantine_roots.get(device)
+            if root is None:
+                root = os.path.join(self.quarantine_dir, self.session)
+                os.makedirs(root, exist_ok=True)
+                if os.stat(root).st_dev != device:
+                    volume_root = os.path.join(mount_point(path), VOLUME_QUARANTINE_NAME, self.session)
+                    try:
+                        os.makedirs(volume_root, exist_ok=True)
+                        root = volume_root
+                    except OSError as e:
+                        logging.warning(f"Cannot create {volume_root}, quarantined files will be copied: {e}")
+                self.quarantine_roots[device] = root
+        return root
+
+    def _replace_with_link(self, action, record):
+        path, keeper = action.path, action.keeper
+        if os.path.samefile(path, keeper):
+            record["skipped"] = "already linked"
+            return
+        if not same_contents(path, keeper):
+            raise ValueError(f"{path} is not byte-identical to {keeper}, refusing to link")
+        temporary = unused_path(f"{path}.mediamatch-link")
+        if action.action == "hardlink":
+            os.link(keeper, temporary)
+        else:
+            reflink(keeper, temporary)
+            shutil.copystat(path, temporary)  # A clone has its own metadata, keep the duplicate's
+        os.replace(temporary, path)  # Atomic: the path always holds either the old file or the link
+
+    # Applies one action and returns its journal record
+    def apply(self, action):
+        stat = os.stat(action.path)
+        if action.keeper is not None:
+            # Checked right before the file goes, the kept copy may have been removed since the plan was made
+            if not os.path.exists(action.keeper):
+                raise FileNotFoundError(errno.ENOENT, "The kept copy is missing, refusing to touch its duplicate",
+                                        action.keeper)
+            if action.action in ("delete", "quarantine") and os.path.samefile(action.path, action.keeper):
+                raise ValueError(f"{action.path} is the kept file itself")
+        record = {"action": action.action, "path": os.path.abspath(action.path), "keeper": action.keeper,
+                  "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": stat.st_mode, "time": time.time()}
+        with METRICS.timed(f"action_{action.action}"):
+            if action.action == "delete":
+                os.remove(action.path)
+                record["freed"] = stat.st_size
+            elif action.action == "quarantine":
+                target = unused_path(mirrored_path(self._quarantine_root(action.path), action.path))
+                move_file(action.path, target)
+                record["target"] = target
+            else:
+                self._replace_with_link(action, record)
+                if "skipped" not in record and stat.st_nlink == 1:  # Other links would keep the data alive
+                    record["freed"] = stat.st_size
+        return record
+
+    def _run_one(self, action, journal):
+        if self.cancelled.is_set():
+            return
+        try:
+            record = self.apply(action)
+            journal.write(record)
+            with self.lock:
+                self.done += 1
+                self.freed_bytes += record.get("freed", 0)
+            METRICS.count("actions_done")
+            message = f"{action.action.capitalize()}: {action.path}"
+            logging.info(message)
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            METRICS.count("actions_failed")
+            message = f"Failed to {action.action} {action.path}: {e}"
+            logging.error(message)
+        if self.on_progress is not None:
+            self.on_progress(message)
+
+    # Applies every action of the plan and returns (done, failed). Raises ValueError without applying
+    # anything if the plan has conflicts (see ActionPlan.conflicts).
+    def run(self, plan):
+        problems = plan.conflicts()
+        if problems:
+            raise ValueError(f"Unsafe plan, nothing was applied: {'; '.join(problems[:10])}"
+                             + (f" and {len(problems) - 10} more" if len(problems) > 10 else ""))
+        journal = ActionJournal(self.journal_path)
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for _ in pool.map(lambda action: self._run_one(action, journal), plan):
+                    pass
+        finally:
+            journal.close()
+        logging.info(f"Applied {self.done} actions ({self.failed} failed) in {time.perf_counter() - start:.1f}s, "
+                     f"freed {self.freed_bytes / 1024 ** 2:.1f} MB, journal {self.journal_path}")
+        return self.done, self.failed
+
+
+# Function to reverse one journal record: quarantined files are moved back and linked files become
+# independent copies again with their old modification time and permissions
+def undo_record(record):
+    path = record["path"]
+    if record["action"] == "delete":
+        raise OSError(errno.ENOENT, "Deleted files cannot be restored", path)
+    if record["action"] == "quarantine":
+        if os.path.lexists(path):
+            raise FileExistsError(errno.EEXIST, "A file has been created at the original path", path)
+        move_file(record["target"], path)
+        return
+    if record.get("skipped"):
+        return
+    temporary = unused_path(f"{path}.mediamatch-undo")
+    shutil.copyfile(path, temporary)
+    os.chmod(temporary, record["mode"] & 0o7777)
+    os.utime(temporary, ns=(record["mtime_ns"], record["mtime_ns"]))
+    os.replace(temporary, path)
+
+
+# Function to undo a session from its journal, newest action first; returns (undone, failed).
+# Records of different paths are undone in parallel, those of one path one after the other.
+def undo(journal_path, workers=ACTION_WORKERS, on_progress=None):
+    by_path = {}
+    for record in reversed(read_journal(journal_path)):
+        by_path.setdefault(record["path"], []).append(record)
+    counts = {"undone": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def undo_path(records):
+        for record in records:
+            try:
+                undo_record(record)
+                outcome, message = "undone", f"Restored {record['path']}"
+            except Exception as e:
+                outcome, message = "failed", f"Cannot undo {record['action']} of {record['path']}: {e}"
+                logging.error(message)
+            with lock:
+                counts[outcome] += 1
+            if on_progress is not None:
+                on_progress(message)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(undo_path, by_path.values()):
+            pass
+    if not counts["failed"]:
+        os.replace(journal_path, journal_path + ".undone")  # Keeps the record but stops a second undo
+    return counts["undone"], counts["failed"]
+
+
+# Function to permanently delete the files a session quarantined; returns the number of bytes freed
+def purge(journal_path):
+    freed = 0
+    failed = False
+    for record in read_journal(journal_path):
+        if record["action"] == "quarantine":
+            try:
+                os.remove(record["target"])
+                freed += record["size"]
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failed = True
+                logging.error(f"Cannot delete {record['target']}: {e}")
+    if not failed:
+        os.replace(journal_path, journal_path + ".purged")  # The session can no longer be undone
+    return freed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply, undo or purge a duplicate cleanup plan")
+    commands = parser.add_subparsers(dest="command", required=True)
+    apply_parser = commands.add_parser("apply", help="Apply a JSON Lines plan (e.g. a mediamatch_cli.py report)")
+    apply_parser.add_argument("plan")
+    apply_parser.add_argument("--action", choices=ACTIONS, default="quarantine",
+                              help="Action for records without an \"action\" field (default: quarantine)")
+    apply_parser.add_argument("--quarantine", default=QUARANTINE_DIR, help="Quarantine folder")
+    apply_parser.add_argument("--workers", type=int, default=ACTION_WORKERS)
+    undo_parser = commands.add_parser("undo", help="Undo a session (default: the latest)")
+    undo_parser.add_argument("journal", nargs="?")
+    purge_parser = commands.add_parser("purge", help="Delete the files a session quarantined (default: the latest)")
+    purge_parser.add_argument("journal", nargs="?")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING, format='%(asctime)s - %(message)s')
+
+    if args.command == "apply":
+        executor = ActionExecutor(quarantine_dir=args.quarantine, workers=args.workers)
+        try:
+            done, failed = executor.run(ActionPlan.load(args.plan, args.action))
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{done} files processed, {failed} failed, {executor.freed_bytes / 1024 ** 2:.1f} MB freed. "
+              f"Journal: {executor.journal_path}")
+        return 1 if failed else 0
+    journal = args.journal or latest_journal()
+    if journal is None:
+        parser.error("no journal found")
+    if args.command == "undo":
+        undone, failed = undo(journal)
+        print(f"{undone} actions undone, {failed} could not be undone.")
+        return 1 if failed else 0
+    print(f"Purged quarantine of {journal}, {purge(journal) / 1024 ** 2:.1f} MB freed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import queue
+import fnmatch
+import logging
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import METRICS
+
+# Parallel media file discovery.
+# Directories are listed with os.scandir on a thread pool; excluded directories
+# are pruned before they are descended into, and matching files are streamed to
+# the caller through a bounded queue as soon as they are found, so hashing can
+# start while the rest of the tree is still being listed.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv')
+MEDIA_EXTENSIONS = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+
+# Glob patterns for directories that are never scanned. Patterns without a
+# slash match the directory name, patterns with a slash match its full path.
+DEFAULT_EXCLUDES = [
+    "Program Files", "Program Files (x86)", "Windows", "AppData", "ProgramData", "Intel", "DRIVER",
+    "System Volume Information", "anaconda3", ".vscode", "*/Users/Public", "$Recycle.Bin",
+]
+
+_DONE = object()
+
+
+# Function to return the default scan roots (the root of the current drive)
+def default_roots():
+    return [os.path.abspath(os.sep)]
+
+
+# Function to check a directory against the exclude globs
+def is_excluded(path, name, exclude):
+    normalized = path.replace(os.sep, "/")
+    for pattern in exclude:
+        if "/" in pattern:
+            if fnmatch.fnmatch(normalized, pattern):
+                return True
+        elif fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+class ParallelWalker:
+    def __init__(self, roots=None, exclude=None, extensions=MEDIA_EXTENSIONS, workers=8, max_queue=1000):
+        self.roots = list(roots or default_roots())
+        self.exclude = [pattern.replace("\\", "/") for pattern in (DEFAULT_EXCLUDES if exclude is None else exclude)]
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.workers = workers
+        self.results = queue.Queue(maxsize=max_queue)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.directories = 0
+        self.files = 0
+        self.done = False  # Set once every directory has been listed and every file yielded
+
+    def _put(self, item):
+        # Block while the consumer catches up, but give up if it went away
+        while not self.stopped.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _submit(self, executor, directory):
+        with self.lock:
+            self.outstanding += 1
+        executor.submit(self._scan, executor, directory)
+
+    def _scan(self, executor, directory):
+        start = time.perf_counter()
+        try:
+            if self.stopped.is_set():
+                return
+            found = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not is_excluded(entry.path, entry.name, self.exclude):
+                                self._submit(executor, entry.path)
+                        elif entry.name.lower().endswith(self.extensions) and entry.is_file(follow_symlinks=False):
+                            found.append(entry.path)
+                    except OSError as e:
+                        logging.debug(f"Skipping {entry.path}: {e}")
+            if found:
+                self._put(found)  # One queue item per directory keeps locking overhead low
+            with self.lock:
+                self.directories += 1
+        except OSError as e:
+            logging.debug(f"Cannot list {directory}: {e}")
+        finally:
+            METRICS.observe("discovery", time.perf_counter() - start)
+            with self.lock:
+                self.outstanding -= 1
+                finished = self.outstanding == 0
+            if finished:
+                self._put(_DONE)
+
+    # Yields matching file paths as they are discovered
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with self.lock:
+                self.outstanding += 1  # Held until every root has been submitted
+            for root in self.roots:
+                self._submit(executor, root)
+            with self.lock:
+                self.outstanding -= 1
+                finished = self.outstanding == 0
+            if finished:
+                self._put(_DONE)
+            while True:
+                found = self.results.get()
+                METRICS.set_gauge("discovery_queue", self.results.qsize())
+                if found is _DONE:
+                    self.done = True
+                    break
+                for path in found:
+                    self.files += 1
+                    yield path
+        finally:
+            self.stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to stream media file paths under the given roots
+def walk_media_files(roots=None, exclude=None, extensions=MEDIA_EXTENSIONS, workers=8):
+    return iter(ParallelWalker(roots, exclude, extensions, workers))
@@ -0,0 +1,172 @@
+import os
+import logging
+import cv2
+from PIL import Image
+from file_walker import VIDEO_EXTENSIONS
+
+# Duplicate groups from pairwise matches. Every above-threshold match the
+# detectors report is an edge between two files; edges are merged with
+# union-find (union by size, path halving), so 20 variants of one photo end up
+# in one group of 20 however they were matched and in whichever order they
+# were scanned. Each group then keeps one file chosen by a policy:
+#   resolution - most pixels (then largest file)
+#   size       - largest file
+#   oldest     - earliest modification time (then largest file)
+# Ties are broken by path, so the keeper does not depend on scan order either.
+
+KEEPER_POLICIES = ("resolution", "size", "oldest")
+KEEPER_POLICY = "resolution"
+
+
+# Disjoint sets over the integers 0..n-1, grown one element at a time
+class UnionFind:
+    def __init__(self):
+        self.parent = []
+        self.size = []
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self):
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, element):
+        parent = self.parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]  # Path halving keeps the trees flat
+            element = parent[element]
+        return element
+
+    # Merges the sets of a and b and returns the root of the merged set
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+class DuplicateGroups:
+    def __init__(self):
+        self.ids = {}  # path -> element
+        self.paths = []  # element -> path
+        self.sets = UnionFind()
+        self.edges = 0
+        self.matches = {}  # path -> (other, stage, score) of the match that first linked it
+
+    def _id(self, path):
+        element = self.ids.get(path)
+        if element is None:
+            element = self.ids[path] = self.sets.add()
+            self.paths.append(path)
+        return element
+
+    # Records that path matches other (above the detector's threshold)
+    def add_edge(self, path, other, stage=None, score=None):
+        self.sets.union(self._id(path), self._id(other))
+        self.edges += 1
+        if path not in self.matches:
+            self.matches[path] = (other, stage, score)
+
+    # Records (path, other, stage, score) edges, e.g. the duplicates yielded by a scan
+    def add_edges(self, edges):
+        for path, other, stage, score in edges:
+            self.add_edge(path, other, stage, score)
+
+    # Merges the groups of another DuplicateGroups into this one
+    def update(self, other):
+        for group in other.groups():
+            for path in group[1:]:
+                _, stage, score = other.matches.get(path, (None, None, None))
+                self.add_edge(path, group[0], stage, score)
+
+    # Returns the group (list of paths, in the order they were first seen) that contains path
+    def group_of(self, path):
+        if path not in self.ids:
+            return [path]
+        root = self.sets.find(self.ids[path])
+        return [member for element, member in enumerate(self.paths) if self.sets.find(element) == root]
+
+    # Returns every group with at least min_size files, each in the order its files were first seen,
+    # ordered by their first file
+    def groups(self, min_size=2):
+        members = {}
+        for element, path in enumerate(self.paths):
+            members.setdefault(self.sets.find(element), []).append(path)
+        return [group for group in members.values() if len(group) >= min_size]
+
+    def __len__(self):
+        return len(self.groups())
+
+    # Returns a DuplicateCluster for every group, keepers chosen by policy
+    def clusters(self, policy=None):
+        return [DuplicateCluster(group, self.matches, policy) for group in self.groups()]
+
+
+# A group of duplicate files, one of which is kept
+class DuplicateCluster:
+    def __init__(self, paths, matches=None, policy=None):
+        self.members = list(paths)
+        self.matches = matches or {}
+        self.policy = KEEPER_POLICY if policy is None else policy
+        self.keeper = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def paths(self):
+        return list(self.members)
+
+    # (path, stage, score) of every file but the keeper, with the match that put it in the group
+    @property
+    def duplicates(self):
+        keeper, rest = self.proposal()
+        return [(path,) + self.matches.get(path, (keeper, None, None))[1:] for path in rest]
+
+    # The file to keep and the rest, which are proposed for removal; the keeper is chosen once
+    def proposal(self):
+        if self.keeper is None:
+            self.keeper = choose_keeper(self.members, self.policy)
+        return self.keeper, [path for path in self.members if path != self.keeper]
+
+
+# Function to return (width, height) of an image or video without decoding it, or (0, 0)
+def media_resolution(path):
+    try:
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            capture = cv2.VideoCapture(path)
+            try:
+                return int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            finally:
+                capture.release()
+        with Image.open(path) as image:  # Reads only the header
+            return image.size
+    except Exception as e:
+        logging.debug(f"Cannot read the resolution of {path}: {e}")
+        return 0, 0
+
+
+# Function to return the sort key of a file under a keeper policy; the largest key is kept
+def keeper_key(path, policy=KEEPER_POLICY):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (float("-inf"),) * 2  # Files that disappeared are never kept
+    if policy == "resolution":
+        width, height = media_resolution(path)
+        return width * height, stat.st_size
+    if policy == "size":
+        return stat.st_size, 0
+    if policy == "oldest":
+        return -stat.st_mtime_ns, stat.st_size
+    raise ValueError(f"Unknown keeper policy: {policy}")
+
+
+# Function to pick the file to keep from a group; ties go to the first path in sorted order
+def choose_keeper(paths, policy=KEEPER_POLICY):
+    return max(sorted(paths), key=lambda path: keeper_key(path, policy))
@@ -0,0 +1,166 @@
+from itertools import combinations
+import numpy as np
+
+# Hamming-space index for 64-bit perceptual hashes (multi-index hashing).
+# Every hash is split into `chunks` equal substrings. If two hashes are within
+# distance d, at least one of their substrings is within d // chunks of each
+# other (pigeonhole), so a lookup only visits buckets near the query's chunks
+# instead of scanning every stored hash.
+#
+# Buckets are singly linked lists threaded through NumPy arrays: one dense
+# head table per chunk (2**chunk_bits int32 entries) plus one int32 link per
+# chunk per stored hash. Memory is therefore fixed at
+# 8 + 4 * chunks bytes per hash (plus the key list and key -> slot dict) and a constant
+# chunks * 2**chunk_bits * 4 bytes for the head tables.
+
+HASH_BITS = 64
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+# Function to convert an imagehash.ImageHash (or an int) to a 64-bit integer
+def hash_to_int(image_hash):
+    if isinstance(image_hash, (int, np.integer)):
+        return int(image_hash) & 0xFFFFFFFFFFFFFFFF
+    bits = np.asarray(image_hash.hash, dtype=bool).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+# Function to compute the Hamming distance between two 64-bit hashes
+def hamming_distance(hash1, hash2):
+    return bin(hash_to_int(hash1) ^ hash_to_int(hash2)).count("1")
+
+
+# Function to list every XOR mask of `bits` width with at most `radius` bits set
+def probe_masks(bits, radius):
+    masks = [0]
+    for flipped in range(1, radius + 1):
+        for positions in combinations(range(bits), flipped):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class HammingIndex:
+    def __init__(self, max_distance=6, chunks=4, initial_capacity=1024):
+        if HASH_BITS % chunks != 0 or HASH_BITS // chunks > 16:
+            raise ValueError("chunks must divide 64 into substrings of at most 16 bits")
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.heads = np.full((chunks, 1 << self.chunk_bits), -1, dtype=np.int32)
+        self.links = np.full((chunks, initial_capacity), -1, dtype=np.int32)
+        self.codes = np.zeros(initial_capacity, dtype=np.uint64)
+        self.keys = []  # None in slots freed by remove()
+        self.positions = {}  # key -> slot, so remove() needs no search
+        self.free = []  # Freed slots, reused by add()
+        self._masks = {}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "positions" not in state:  # Saved before slots were kept by key
+            self.positions = {key: position for position, key in enumerate(self.keys) if key is not None}
+
+    def __len__(self):
+        return len(self.keys) - len(self.free)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    # Approximate memory used by the hash arrays and bucket tables
+    def memory_bytes(self):
+        return self.heads.nbytes + self.links.nbytes + self.codes.nbytes
+
+    def _chunk_values(self, code):
+        return [(code >> (chunk * self.chunk_bits)) & self.chunk_mask for chunk in range(self.chunks)]
+
+    def _grow(self):
+        capacity = self.codes.shape[0] * 2
+        codes = np.zeros(capacity, dtype=np.uint64)
+        codes[:len(self.keys)] = self.codes[:len(self.keys)]
+        links = np.full((self.chunks, capacity), -1, dtype=np.int32)
+        links[:, :len(self.keys)] = self.links[:, :len(self.keys)]
+        self.codes = codes
+        self.links = links
+
+    # Stores a hash under a key, replacing the hash a key that is already stored had
+    def add(self, key, image_hash):
+        code = hash_to_int(image_hash)
+        if key in self.positions:
+            self.remove(key)  # Otherwise its old slot would stay linked in the buckets
+        if self.free:
+            position = self.free.pop()
+            self.keys[position] = key
+        else:
+            if len(self.keys) == self.codes.shape[0]:
+                self._grow()
+            position = len(self.keys)
+            self.keys.append(key)
+        self.positions[key] = position
+        self.codes[position] = code
+        for chunk, value in enumerate(self._chunk_values(code)):
+            self.links[chunk, position] = self.heads[chunk, value]
+            self.heads[chunk, value] = position
+        return position
+
+    # Removes a stored key and unlinks it from its buckets; its slot is reused by the next add().
+    # Returns False if the key is not stored.
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return False
+        for chunk, value in enumerate(self._chunk_values(int(self.codes[position]))):
+            links = self.links[chunk]
+            current = self.heads[chunk, value]
+            if current == position:
+                self.heads[chunk, value] = links[position]
+            else:
+                while links[current] != position:
+                    current = links[current]
+                links[current] = links[position]
+            links[position] = -1
+        self.keys[position] = None
+        self.free.append(position)
+        return True
+
+    def _candidates(self, code, max_distance):
+        radius = max_distance // self.chunks
+        if radius not in self._masks:
+            self._masks[radius] = probe_masks(self.chunk_bits, radius)
+        candidates = set()
+        for chunk, value in enumerate(self._chunk_values(code)):
+            heads = self.heads[chunk]
+            links = self.links[chunk]
+            for mask in self._masks[radius]:
+                position = heads[value ^ mask]
+                while position != -1:
+                    candidates.add(int(position))
+                    position = links[position]
+        return np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+
+    # Returns (key, distance) pairs within max_distance, closest first
+    def query(self, image_hash, max_distance=None, k=None):
+        if max_distance is None:
+            max_distance = self.max_distance
+        code = hash_to_int(image_hash)
+        candidates = self._candidates(code, max_distance)
+        if len(candidates) == 0:
+            return []
+        distances = popcount(self.codes[candidates] ^ np.uint64(code)).astype(np.int64)
+        keep = distances <= max_distance
+        candidates = candidates[keep]
+        distances = distances[keep]
+        order = np.lexsort((candidates, distances))
+        if k is not None:
+            order = order[:k]
+        return [(self.keys[candidates[i]], int(distances[i])) for i in order]
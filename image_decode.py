@@ -0,0 +1,124 @@
+import logging
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+
+# Reduced-resolution image decoding. Hashing and VGG16 only need a few hundred
+# pixels, so JPEGs are decoded in the DCT domain at 1/2, 1/4 or 1/8 scale
+# (PIL draft mode or cv2 IMREAD_REDUCED_*) to the smallest size that is still
+# at least the target size, instead of decoding all 40 megapixels and then
+# throwing them away. Every decoded image is also turned upright according to
+# its EXIF orientation and converted to a plain RGB or L image, so rotated,
+# transparent, palette, grayscale and 16-bit copies compare like the original.
+# Images can be given as a path or as an in-memory file (BytesIO) holding
+# contents read ahead by prefetch.py.
+
+# Decoder used for JPEGs: "pil" (draft mode) or "cv2" (IMREAD_REDUCED_*); other formats always use PIL
+DECODE_BACKEND = "pil"
+
+# Colour that transparent pixels are flattened onto
+BACKGROUND = (255, 255, 255)
+
+# EXIF orientations that rotate the image by 90 degrees, swapping width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+CV2_REDUCED_FLAGS = {
+    "RGB": {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+            8: cv2.IMREAD_REDUCED_COLOR_8},
+    "L": {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+          8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+
+# Function to return the EXIF orientation tag of an opened image (1 = upright)
+def exif_orientation(image):
+    try:
+        return image.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+
+# Function to return the largest DCT scale (1, 2, 4 or 8) that keeps the image at least min_size
+def reduction_scale(size, min_size):
+    if min_size is None:
+        return 1
+    scale = min(size[0] // max(1, min_size[0]), size[1] // max(1, min_size[1]))
+    for factor in (8, 4, 2):
+        if scale >= factor:
+            return factor
+    return 1
+
+
+# Function to convert any PIL mode to RGB or L: transparency is flattened onto BACKGROUND,
+# palettes are expanded and 16-bit or float images are rescaled to 8 bits
+def convert_mode(image, mode="RGB"):
+    if image.mode == mode:
+        return image
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        pixels = np.asarray(image, dtype=np.float32)
+        peak = 65535.0 if image.mode.startswith("I;16") else float(pixels.max()) or 1.0
+        image = Image.fromarray(np.clip(pixels * (255.0 / peak), 0, 255).astype(np.uint8), "L")
+    if image.mode in ("RGBA", "LA", "PA", "La", "RGBa"):
+        background = Image.new("RGBA", image.size, BACKGROUND + (255,))
+        background.alpha_composite(image.convert("RGBA"))
+        image = background
+    return image.convert(mode) if image.mode != mode else image
+
+
+# Function to rewind an in-memory file before it is opened again (paths are returned unchanged)
+def rewind(image):
+    if hasattr(image, "seek"):
+        image.seek(0)
+    return image
+
+
+# Function to open an image (path, file object or PIL image) upright in the given mode, decoding JPEGs at the
+# smallest DCT scale that is still at least min_size (width, height of the upright image)
+def load_image(image, min_size=None, mode="RGB"):
+    if not isinstance(image, Image.Image):
+        image = Image.open(rewind(image))
+    orientation = exif_orientation(image)
+    if min_size is not None and image.format == "JPEG":
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            min_size = (min_size[1], min_size[0])
+        # Decode straight to grayscale when that is what is wanted, it skips the colour conversion
+        image.draft("L" if mode == "L" and image.mode == "RGB" else image.mode, min_size)
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    return convert_mode(image, mode)
+
+
+# Function to decode a JPEG with OpenCV at a reduced scale, returning an upright RGB or L array,
+# or None if OpenCV cannot decode it. image_path may also be an in-memory file.
+def load_array_cv2(image_path, min_size=None, mode="RGB"):
+    with Image.open(rewind(image_path)) as header:  # Reads only the header, for the size and orientation
+        size = header.size
+        if exif_orientation(header) in TRANSPOSED_ORIENTATIONS and min_size is not None:
+            min_size = (min_size[1], min_size[0])
+    if hasattr(image_path, "getbuffer"):
+        data = np.frombuffer(image_path.getbuffer(), dtype=np.uint8)
+    else:
+        data = np.fromfile(image_path, dtype=np.uint8)  # imread cannot open non-ASCII paths on Windows
+    pixels = cv2.imdecode(data, CV2_REDUCED_FLAGS[mode][reduction_scale(size, min_size)])
+    if pixels is None:
+        return None
+    if mode == "RGB":
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+    return pixels
+
+
+# Function to decode an image and resize it to exactly `size`, returning a PIL image in the given mode
+def load_resized(image, size, mode="RGB"):
+    if DECODE_BACKEND == "cv2" and not isinstance(image, Image.Image):
+        try:
+            with Image.open(rewind(image)) as header:
+                is_jpeg = header.format == "JPEG"
+            if is_jpeg:
+                pixels = load_array_cv2(image, size, mode)
+                if pixels is not None:
+                    return Image.fromarray(pixels, mode).resize(size)
+        except Exception as e:
+            logging.debug(f"OpenCV could not decode {image}, falling back to PIL: {e}")
+    return load_image(image, size, mode).resize(size)
@@ -0,0 +1,119 @@
+from functools import partial
+import imagehash
+from hamming_index import hash_to_int
+from image_decode import load_image
+from file_walker import VIDEO_EXTENSIONS
+from video_fingerprint import representative_hash, video_signature
+from worker_pool import parallel_map
+from prefetch import Prefetcher, buffer_source, call_prefetched
+from multi_hash import hash_image, record_from_phash
+
+# Perceptual hashes of media files, shared by the desktop scan, the headless
+# CLI, the watcher and the Android app. Images get a pHash (or a record of
+# every hash family, see multi_hash.py) computed from one reduced-size decode;
+# videos get the pHash of a representative frame. Results are kept in the
+# on-disk FeatureCache, and iter_file_hashes() hashes the files missing from it
+# on a process pool. Nothing here touches the files beyond reading them.
+
+# Maximum number of differing pHash bits for two files to count as duplicates (pHash-only matching)
+HASH_DISTANCE_THRESHOLD = 6
+
+# Smallest size images are decoded at before hashing (pHash itself works on 32x32)
+HASH_DECODE_SIZE = (256, 256)
+
+# Number of worker processes used for hashing (None uses one per core)
+HASH_WORKERS = None
+
+
+# Function to generate hash of an image (data: its contents, if already read into memory)
+def get_image_hash(image_path, data=None):
+    try:
+        img = load_image(buffer_source(image_path, data), HASH_DECODE_SIZE, mode="L")  # Upright, decoded near hash size
+        return imagehash.phash(img)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return None
+
+
+# Function to generate a hash from the first non-blank sampled frame of a video (skips black fade-ins)
+def get_video_hash(video_path):
+    try:
+        video_hash = representative_hash(video_path)
+        if video_hash is None:
+            print(f"Could not read frame from video: {video_path}")
+        return video_hash
+    except Exception as e:
+        print(f"Error processing video {video_path}: {e}")
+        return None
+
+
+# Function to return the hash of a file (image or video)
+def get_file_hash(file_path, data=None):
+    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+        return get_image_hash(file_path, data)
+    elif file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):
+        return get_video_hash(file_path)
+    else:
+        return None
+
+
+# Function to return the hash of a file as a 64-bit integer (safe to run in worker processes)
+def hash_file(file_path, data=None):
+    file_hash = get_file_hash(file_path, data)
+    if file_hash is None:
+        return None
+    return hash_to_int(file_hash)
+
+
+# Function to return the multi-hash record of a file (videos only get the pHash of a representative frame)
+def get_file_record(file_path, data=None):
+    if file_path.lower().endswith(VIDEO_EXTENSIONS):
+        video_hash = get_video_hash(file_path)
+        return None if video_hash is None else record_from_phash(hash_to_int(video_hash))
+    try:
+        return hash_image(buffer_source(file_path, data))
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+
+# Functions computing each kind of cached hash (module-level, so they can run in worker processes)
+HASH_FUNCTIONS = {"phash": hash_file, "multihash": get_file_record}
+
+
+# Function to return the 64-bit hash of a file, reusing the on-disk cache if the file is unchanged
+def get_cached_file_hash(file_path, cache):
+    return cache.get_or_compute(file_path, "phash", hash_file)
+
+
+# Function to return the multi-hash record of a file, reusing the on-disk cache if the file is unchanged
+def get_cached_file_record(file_path, cache):
+    return cache.get_or_compute(file_path, "multihash", get_file_record)
+
+
+# Function to return the temporal pHash signature of a video, reusing the on-disk cache if the file is unchanged
+def get_cached_video_signature(file_path, cache):
+    return cache.get_or_compute(file_path, "video_signature", video_signature)
+
+
+# Function to yield (path, hash) for each file, hashing files missing from the cache on a process pool.
+# kind selects the hash: "phash" (64-bit int) or "multihash" (record of all hash families). Files to hash
+# are read ahead on prefetcher's I/O threads and hashed from memory.
+def iter_file_hashes(file_paths, cache, workers=HASH_WORKERS, ordered=False, executor=None, kind="phash",
+                     prefetcher=None):
+    cached = {}
+
+    def need(path):
+        file_hash = cache.get(path, kind)
+        if file_hash is not None:
+            cached[path] = file_hash
+        return file_hash is None
+
+    files = (prefetcher or Prefetcher()).iterate(file_paths, need)
+    for item, file_hash in parallel_map(partial(call_prefetched, HASH_FUNCTIONS[kind]), files, workers,
+                                        ordered=ordered, lookup=lambda item: cached.get(item.path),
+                                        executor=executor, stage="hash"):
+        path = item.path
+        if cached.pop(path, None) is None and file_hash is not None:
+            cache.put(path, kind, file_hash)
+        yield path, file_hash
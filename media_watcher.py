@@ -0,0 +1,393 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import OrderedDict
+from checkpoint import ScanCheckpoint, checkpoint_path
+from feature_cache import FeatureCache
+from dedup_pipeline import DedupPipeline
+from file_walker import DEFAULT_EXCLUDES, MEDIA_EXTENSIONS, ParallelWalker, is_excluded
+from media_hashing import get_cached_file_hash, iter_file_hashes
+from metrics import METRICS
+
+# Incremental watch mode. Instead of rescanning everything, a MediaWatcher
+# keeps the duplicate index of its roots (a DedupPipeline) and only hashes, and
+# with the CNN method featurizes, files that are new or changed:
+#   - on Linux, changes come from inotify (through libc, no extra package);
+#     elsewhere, or when the inotify watch limit is reached, the roots are
+#     polled for files whose modification or change time is newer than the last
+#     poll
+#   - a new file is only processed once its size and modification time have
+#     stayed the same for settle_seconds, so files that are still being copied
+#     are never read half-written
+#   - deleted and rewritten files are removed from the index, and their slots
+#     are reused, so memory stays flat over long uptimes
+# The index is saved every few minutes and when the watcher stops; a restarted
+# watcher loads it and catches up on the files that changed while it was down.
+
+# Seconds a file's size and modification time must stay unchanged before it is processed
+SETTLE_SECONDS = 2.0
+
+# Seconds between two polls when inotify is not available
+POLL_INTERVAL_SECONDS = 5.0
+
+# Seconds between two saves of the index (only when it changed)
+SAVE_INTERVAL_SECONDS = 300
+
+# Where watch indexes are kept, one per set of roots
+WATCH_DIR = os.path.join(os.path.expanduser("~"), ".mediamatch", "watch")
+
+# Recently processed files remembered to skip repeated events for an unchanged file
+RECENT_FILES = 10000
+
+# Slack (seconds) when comparing file times with the last poll, for coarse file system timestamps
+TIME_SLACK_SECONDS = 2.0
+
+# inotify event masks (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+# Function to yield media files under the roots whose modification or change time (a move changes the
+# latter) is at or after `since`
+def iter_changed_files(roots, exclude, since, extensions=MEDIA_EXTENSIONS):
+    for path in ParallelWalker(roots, exclude, extensions):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if max(stat.st_mtime, stat.st_ctime) >= since:
+            yield path
+
+
+# Reports changed files with inotify. poll() returns ("changed" | "removed", path) events,
+# ("directory", path) for a directory that appeared (its files may have landed before it was watched)
+# and ("rescan", root) when the kernel queue overflowed and events were lost.
+class InotifySource:
+    def __init__(self, roots, exclude):
+        self.roots = roots
+        self.exclude = exclude
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # watch descriptor -> directory
+
+    # Watches a directory and everything under it; raises OSError when the watch limit is reached
+    def watch(self, directory):
+        pending = [directory]
+        while pending:
+            directory = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+                logging.debug(f"Cannot watch {directory}: {os.strerror(error)}")
+                continue
+            self.directories[wd] = directory
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not is_excluded(entry.path, entry.name,
+                                                                                   self.exclude):
+                            pending.append(entry.path)
+            except OSError as e:
+                logging.debug(f"Cannot list {directory}: {e}")
+
+    def start(self):
+        for root in self.roots:
+            self.watch(root)
+        logging.info(f"Watching {len(self.directories)} directories with inotify")
+
+    # Stops watching a directory that was moved away or deleted, and everything under it
+    def _unwatch(self, directory):
+        prefix = directory + os.sep
+        for wd, watched in list(self.directories.items()):
+            if watched == directory or watched.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.directories[wd]
+
+    def poll(self, timeout):
+        events = []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return events
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflowed, rescanning the roots")
+                events.extend(("rescan", root) for root in self.roots)
+                continue
+            directory = self.directories.get(wd)
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self.directories.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not is_excluded(path, name, self.exclude):
+                    try:
+                        self.watch(path)
+                    except OSError as e:
+                        logging.error(f"Cannot watch {path}: {e}")
+                    events.append(("directory", path))
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch(path)
+            elif name.lower().endswith(MEDIA_EXTENSIONS):
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    events.append(("removed", path))
+                else:
+                    events.append(("changed", path))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Reports changed files by walking the roots every `interval` seconds
+class PollingSource:
+    def __init__(self, roots, exclude, interval=POLL_INTERVAL_SECONDS):
+        self.roots = roots
+        self.exclude = exclude
+        self.interval = interval
+        self.last_poll = None
+
+    def start(self):
+        self.last_poll = time.time()
+
+    def poll(self, timeout):
+        wait = self.last_poll + self.interval - time.time()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if wait > timeout:
+                return []
+        since = self.last_poll - TIME_SLACK_SECONDS
+        self.last_poll = time.time()
+        return [("changed", path) for path in iter_changed_files(self.roots, self.exclude, since)]
+
+    def close(self):
+        pass
+
+
+# Long-running duplicate detection for folders that keep receiving files. on_duplicate(path,
+# original, stage, score) is called for every new duplicate, on the thread that runs run().
+class MediaWatcher:
+    def __init__(self, roots, exclude=None, cache=None, method="phash", match_distance=4, candidate_distance=10,
+                 similarity_threshold=0.9, settle_seconds=SETTLE_SECONDS, use_inotify=True,
+                 poll_interval=POLL_INTERVAL_SECONDS, state_path=None, on_duplicate=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.exclude = DEFAULT_EXCLUDES if exclude is None else exclude
+        self.cache = cache if cache is not None else FeatureCache()
+        self.method = method
+        self.match_distance = match_distance
+        self.candidate_distance = candidate_distance
+        self.similarity_threshold = similarity_threshold
+        self.settle_seconds = settle_seconds
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.checkpoint = ScanCheckpoint(state_path or checkpoint_path(self.roots, WATCH_DIR),
+                                         interval=SAVE_INTERVAL_SECONDS)
+        self.on_duplicate = on_duplicate
+        self.pipeline = self._make_pipeline()
+        self.source = None
+        self.pending = {}  # path -> (size, mtime_ns, time the file was last seen changing)
+        self.recent = OrderedDict()  # path -> (size, mtime_ns) of recently processed files
+        self.last_seen = time.time()  # Files changed before this time have been queued
+        self.dirty = False
+        self.stopped = threading.Event()
+        self.processed = 0
+        self.duplicates = 0
+
+    def _make_pipeline(self):
+        feature_fn = None
+        if self.method == "cnn":
+            from mediamatch_core import get_cached_features  # Loads the CNN on first use
+            feature_fn = lambda path: get_cached_features(path, self.cache)
+        hash_fn = None if self.method == "exact" else lambda path: get_cached_file_hash(path, self.cache)
+        # Without the CNN stage, pHash neighbours beyond match_distance are never used
+        candidate_distance = self.candidate_distance if feature_fn is not None else self.match_distance
+        return DedupPipeline(hash_fn, feature_fn, self.match_distance, candidate_distance, self.similarity_threshold)
+
+    # Settings a saved index must match to be loaded
+    def settings(self):
+        embedding = None
+        if self.method == "cnn":
+            from mediamatch_core import feature_kind
+            embedding = feature_kind()  # Features of another model must not be matched against this index
+        return {"roots": sorted(self.roots), "exclude": self.exclude, "method": self.method,
+                "match_distance": self.match_distance, "candidate_distance": self.candidate_distance,
+                "similarity_threshold": self.similarity_threshold, "embedding": embedding}
+
+    # Loads the saved index; files changed since it was saved are queued. Returns False if there is none.
+    def restore(self):
+        state = self.checkpoint.load(self.settings())
+        if state is None:
+            return False
+        self.pipeline.restore(state["pipeline"])
+        logging.info(f"Loaded the watch index of {self.pipeline.unique} files, catching up on changes")
+        self._rescan(self.roots, state["time"] - TIME_SLACK_SECONDS)
+        return True
+
+    # Takes over the index of a finished scan of the same roots (a DuplicateScan's pipeline)
+    def adopt(self, pipeline):
+        self.pipeline.restore(pipeline.state())
+        self.dirty = True
+
+    # Builds the index from the files already under the roots (hashing them on a process pool),
+    # without reporting their duplicates. Returns False if stop() was called before it finished.
+    def build(self):
+        def paths():
+            for path in ParallelWalker(self.roots, self.exclude):
+                if self.stopped.is_set():
+                    return
+                yield path
+
+        hash_stream = None
+        if self.method != "exact":
+            hash_stream = lambda paths: iter_file_hashes(paths, self.cache)
+        for _ in self.pipeline.run(paths(), hash_stream=hash_stream):
+            pass
+        self.dirty = True
+        return not self.stopped.is_set()
+
+    def save(self):
+        self.cache.flush()
+        self.checkpoint.save(self.settings(), {"pipeline": self.pipeline.state(), "time": self.last_seen})
+        self.dirty = False
+
+    def _rescan(self, directories, since):
+        for path in iter_changed_files(directories, self.exclude, since):
+            self._changed(path)
+
+    def _changed(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if self.recent.get(path) == (stat.st_size, stat.st_mtime_ns):
+            return  # Already processed in this state
+        self.pending[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def _removed(self, path):
+        self.pending.pop(path, None)
+        self.recent.pop(path, None)
+        if self.pipeline.remove(path):
+            self.dirty = True
+
+    # Processes the pending files that have not changed for settle_seconds
+    def _settle(self):
+        now = time.monotonic()
+        for path, (size, mtime_ns, changed) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]  # Gone before it settled, e.g. a temporary file
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)  # Still being written
+            elif now - changed >= self.settle_seconds:
+                del self.pending[path]
+                self._process(path, (size, mtime_ns))
+        METRICS.set_gauge("watch_pending", len(self.pending))
+
+    def _process(self, path, state):
+        if path in self.pipeline:
+            self.pipeline.remove(path)  # A rewritten file must not match its own old entry
+        match = self.pipeline.check(path)
+        while match is not None and not os.path.exists(match[0]):
+            if not self.pipeline.remove(match[0]):  # Deleted while the watcher was down
+                break
+            match = self.pipeline.check(path)
+        self.processed += 1
+        self.dirty = True
+        METRICS.count("files_processed")
+        self.recent[path] = state
+        if len(self.recent) > RECENT_FILES:
+            self.recent.popitem(last=False)
+        if match is not None:
+            self.duplicates += 1
+            METRICS.count(f"duplicates_{match[1]}")
+            if self.on_duplicate is not None:
+                self.on_duplicate(path, *match)
+
+    def _start_source(self):
+        if self.use_inotify and sys.platform.startswith("linux"):
+            source = InotifySource(self.roots, self.exclude)
+            try:
+                source.start()
+                return source
+            except OSError as e:
+                source.close()
+                logging.warning(f"Falling back to polling every {self.poll_interval:g}s: {e}")
+        source = PollingSource(self.roots, self.exclude, self.poll_interval)
+        source.start()
+        return source
+
+    # Starts watching. Call before build() or a full scan, so files that land meanwhile are not missed.
+    def start(self):
+        self.source = self._start_source()
+        self.last_seen = time.time()
+        return self
+
+    # Watches until stop() is called, then saves the index
+    def run(self):
+        if self.source is None:
+            self.start()
+        try:
+            while not self.stopped.is_set():
+                poll_start = time.time()
+                for kind, path in self.source.poll(0.5 if self.pending else 1.0):
+                    if kind == "changed":
+                        self._changed(path)
+                    elif kind == "removed":
+                        self._removed(path)
+                    elif kind == "directory":
+                        self._rescan([path], 0)  # Moved-in directories keep the times of their files
+                    else:
+                        self._rescan([path], self.last_seen - TIME_SLACK_SECONDS)
+                if not self.pending:
+                    self.last_seen = poll_start  # Everything changed before this poll has been processed
+                self._settle()
+                if self.dirty and self.checkpoint.due():
+                    self.save()
+        finally:
+            self.source.close()
+            self.source = None
+            self.save()
+
+    def stop(self):
+        self.stopped.set()
+
+    # Stops watching and trims and closes the cache; the index is only saved by run()
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        self.cache.evict()
+        self.cache.close()
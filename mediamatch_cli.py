@@ -0,0 +1,353 @@
+import os
+import sys
+import csv
+import json
+import signal
+import logging
+import argparse
+import contextlib
+import mediamatch_core
+from metrics import REPORT_INTERVAL_SECONDS, MetricsReporter, profiled, serve_status
+from feature_cache import CACHE_PATH, FeatureCache
+from checkpoint import ScanCheckpoint, checkpoint_path
+from grouping import KEEPER_POLICIES, KEEPER_POLICY
+from embedding_backends import BACKENDS
+from media_watcher import POLL_INTERVAL_SECONDS, SETTLE_SECONDS, MediaWatcher
+
+# Non-interactive duplicate scanner for scheduled runs. Duplicates are written
+# as they are found, one record per duplicate file, to JSON Lines or CSV.
+# Records that share a "cluster" value (the first copy found) belong to the
+# same group. With --group the matches are merged into clusters with union-find
+# instead and written once the scan is done: one record per file except the
+# keeper chosen by --keep, and "cluster" is that keeper, so the report can be
+# applied with file_actions.py. Nothing is deleted. The scan state is
+# checkpointed periodically when the scan is stopped with Ctrl-C or SIGTERM;
+# --resume continues an interrupted scan of the same roots and repeats the
+# duplicates it had already reported. --metrics and --status-port
+# expose the scan's counters, latency histograms and queue depths while it runs,
+# and --profile writes a cProfile and tracemalloc report of the whole run.
+# --watch keeps running instead: it loads (or first builds) the saved index of
+# the roots and reports duplicates among new and changed files within seconds
+# of them landing, until it is stopped with Ctrl-C or SIGTERM. --batch is meant
+# for nightly full-library runs: it hashes every file first and then compares
+# all pHashes (and CNN embeddings) with each other at once, in tiles, and
+# writes the clusters like --group.
+#
+# Exit codes: 0 no duplicates, 1 duplicates found, 2 usage or scan error,
+# 130 interrupted.
+
+EXIT_NO_DUPLICATES = 0
+EXIT_DUPLICATES = 1
+EXIT_ERROR = 2
+EXIT_INTERRUPTED = 130
+
+FIELDS = ("cluster", "path", "stage", "score", "size")
+
+
+# Function to build the record written for one duplicate
+def duplicate_record(path, original, stage, score):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = None
+    return {"cluster": original, "path": path, "stage": stage,
+            "score": None if score is None else round(float(score), 4), "size": size}
+
+
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()  # Keep the output usable by a downstream reader while the scan runs
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.stream.flush()
+
+
+WRITERS = {
+    "jsonl": JsonLinesWriter,
+    "csv": CsvWriter,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find duplicate images and videos without prompting and report them as JSON Lines or CSV.",
+        epilog="Exit status is 0 if no duplicates were found, 1 if duplicates were found and 2 on error.")
+    parser.add_argument("roots", nargs="+", help="Directories to scan")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help="Directory name or path glob to skip (repeatable, replaces the defaults)")
+    parser.add_argument("--method", choices=mediamatch_core.METHODS, default="phash",
+                        help="exact: identical bytes; phash: also perceptual hashes; "
+                             "cnn: also CNN features for borderline files (default: phash)")
+    parser.add_argument("--cnn-all", action="store_true",
+                        help="With --method cnn, compare the CNN features of every file instead of using the funnel")
+    parser.add_argument("--match-distance", type=int, default=mediamatch_core.PHASH_MATCH_DISTANCE,
+                        help="pHash bits within which files are duplicates")
+    parser.add_argument("--candidate-distance", type=int, default=mediamatch_core.PHASH_CANDIDATE_DISTANCE,
+                        help="pHash bits within which the CNN decides")
+    parser.add_argument("--similarity-threshold", type=float, default=mediamatch_core.SIMILARITY_THRESHOLD,
+                        help="Minimum cosine similarity of CNN features for a CNN match")
+    parser.add_argument("--workers", type=int, default=mediamatch_core.WORKERS, help="Worker processes")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=mediamatch_core.EMBEDDING_BACKEND,
+                        help="CNN used with --method cnn; mobilenet_v3_small runs on TFLite "
+                             f"(default: {mediamatch_core.EMBEDDING_BACKEND})")
+    parser.add_argument("--model-threads", type=int, help="CPU threads the CNN may use (default: the runtime's)")
+    parser.add_argument("--int8", action="store_true", help="Use the CNN's int8 quantized model")
+    parser.add_argument("--group", action="store_true",
+                        help="Report whole duplicate clusters with their keeper once the scan is done")
+    parser.add_argument("--keep", choices=KEEPER_POLICIES, default=KEEPER_POLICY,
+                        help=f"File kept from each cluster with --group (default: {KEEPER_POLICY})")
+    parser.add_argument("--batch", action="store_true",
+                        help="Compare all files with each other at once after hashing them (for nightly runs), "
+                             "and report clusters like --group")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and report duplicates among new and changed files as they land")
+    parser.add_argument("--settle-seconds", type=float, default=SETTLE_SECONDS,
+                        help="With --watch, seconds a file must stay unchanged before it is processed")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SECONDS,
+                        help="With --watch, seconds between two polls when inotify is not used")
+    parser.add_argument("--no-inotify", action="store_true", help="With --watch, poll instead of using inotify")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("-o", "--output", help="Write the report to this file instead of stdout")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Hash and feature cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the cache")
+    parser.add_argument("--resume", action="store_true", help="Continue the interrupted scan of these roots")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: one per set of roots under ~/.mediamatch)")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not save checkpoints")
+    parser.add_argument("--metrics", metavar="FILE", help="Write scan metrics to this JSON file while scanning")
+    parser.add_argument("--metrics-interval", type=float, default=REPORT_INTERVAL_SECONDS,
+                        help="Seconds between two writes of the metrics file")
+    parser.add_argument("--status-port", type=int, help="Serve scan metrics as JSON on this localhost port")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="Profile the scan, writing PREFIX.prof (cProfile) and PREFIX.memory.txt (tracemalloc)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Do not print the summary to stderr")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log progress to stderr")
+    args = parser.parse_args(argv)
+    missing = [root for root in args.roots if not os.path.isdir(root)]
+    if missing:
+        parser.error(f"not a directory: {', '.join(missing)}")
+    if args.watch and (args.cnn_all or args.group):
+        parser.error("--watch cannot be combined with --cnn-all or --group")
+    if args.batch and (args.watch or args.cnn_all or args.resume):
+        parser.error("--batch cannot be combined with --watch, --cnn-all or --resume")
+    return args
+
+
+# Function to apply the worker and CNN settings of the command line
+def configure(args):
+    mediamatch_core.WORKERS = args.workers
+    mediamatch_core.EMBEDDING_BACKEND = args.backend
+    mediamatch_core.EMBEDDING_THREADS = args.model_threads
+    mediamatch_core.EMBEDDING_QUANTIZED = args.int8
+
+
+# Function to open the hash and feature cache selected on the command line
+def open_cache(args):
+    return FeatureCache(":memory:" if args.no_cache else args.cache, max_bytes=mediamatch_core.FEATURE_CACHE_MAX_BYTES)
+
+
+def run(args):
+    configure(args)
+    cache = open_cache(args)
+    checkpoint = None
+    if not args.no_checkpoint:
+        checkpoint = ScanCheckpoint(args.checkpoint or checkpoint_path(args.roots))
+    scan = mediamatch_core.DuplicateScan(args.roots, args.exclude, use_funnel=not args.cnn_all, cache=cache,
+                                         method=args.method, match_distance=args.match_distance,
+                                         candidate_distance=args.candidate_distance,
+                                         similarity_threshold=args.similarity_threshold,
+                                         checkpoint=checkpoint, resume=args.resume)
+    if args.resume and not scan.resumed:
+        logging.warning("No checkpoint to resume from, starting a new scan")
+
+    # The first Ctrl-C or SIGTERM stops the scan at the next file and saves a checkpoint,
+    # a second Ctrl-C interrupts immediately
+    def stop(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        scan.abort()
+
+    # Set up inside the try, so a busy status port or an unwritable output still restores and closes everything
+    handlers = {}
+    output = sys.stdout
+    reporter = server = None
+    try:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, stop)
+        if args.output:
+            output = open(args.output, "w", newline="")
+        if args.metrics:
+            reporter = MetricsReporter(args.metrics, interval=args.metrics_interval).start()
+        if args.status_port is not None:
+            server = serve_status(args.status_port)
+        writer = WRITERS[args.format](output)
+        with profiled(args.profile) if args.profile else contextlib.nullcontext():
+            for path, original, stage, score in scan:
+                if not args.group:
+                    writer.write(duplicate_record(path, original, stage, score))
+            if args.group and not scan.aborted:
+                for cluster in scan.clusters(args.keep):
+                    keeper, _ = cluster.proposal()
+                    for path, stage, score in cluster.duplicates:
+                        writer.write(duplicate_record(path, keeper, stage, score))
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        scan.close()
+        if reporter is not None:
+            reporter.stop()
+        if server is not None:
+            server.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+    if scan.aborted:
+        if not args.quiet:
+            print(f"Scan stopped after {len(scan.processed)} files, run again with --resume to continue.",
+                  file=sys.stderr)
+        return EXIT_INTERRUPTED
+    if not args.quiet:
+        for line in scan.report():
+            print(line, file=sys.stderr)
+        print(f"{scan.walker.files} files scanned, {scan.duplicates} duplicates, "
+              f"{scan.unique_files()} unique.", file=sys.stderr)
+    return EXIT_DUPLICATES if scan.duplicates else EXIT_NO_DUPLICATES
+
+
+# Function to compare all files under the roots at once and report every cluster but its keeper
+def batch(args):
+    configure(args)
+    scan = mediamatch_core.BatchScan(args.roots, args.exclude, open_cache(args), method=args.method,
+                                     match_distance=args.match_distance,
+                                     similarity_threshold=args.similarity_threshold)
+
+    def stop(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        scan.abort()
+
+    duplicates = 0
+    # Set up inside the try, so a busy status port or an unwritable output still restores and closes everything
+    handlers = {}
+    output = sys.stdout
+    reporter = server = None
+    try:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, stop)
+        if args.output:
+            output = open(args.output, "w", newline="")
+        if args.metrics:
+            reporter = MetricsReporter(args.metrics, interval=args.metrics_interval).start()
+        if args.status_port is not None:
+            server = serve_status(args.status_port)
+        writer = WRITERS[args.format](output)
+        with profiled(args.profile) if args.profile else contextlib.nullcontext():
+            if scan.run():
+                for cluster in scan.clusters(args.keep):
+                    keeper, _ = cluster.proposal()
+                    for path, stage, score in cluster.duplicates:
+                        writer.write(duplicate_record(path, keeper, stage, score))
+                        duplicates += 1
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        scan.close()
+        if reporter is not None:
+            reporter.stop()
+        if server is not None:
+            server.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+    if not scan.completed:
+        if not args.quiet:
+            print("Scan stopped.", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    if not args.quiet:
+        for line in scan.report():
+            print(line, file=sys.stderr)
+        print(f"{scan.walker.files} files scanned, {duplicates} duplicates, "
+              f"{scan.walker.files - duplicates} unique.", file=sys.stderr)
+    return EXIT_DUPLICATES if duplicates else EXIT_NO_DUPLICATES
+
+
+# Function to watch the roots and report duplicates among new and changed files until stopped. Files
+# already under the roots are indexed first (once; the index is saved) but not reported.
+def watch(args):
+    configure(args)
+
+    def stop(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        watcher.stop()
+
+    # Set up inside the try, so a cache that cannot be opened or a busy status port still restores
+    # and closes everything
+    handlers = {}
+    output = sys.stdout
+    cache = watcher = reporter = server = None
+    try:
+        if args.output:
+            output = open(args.output, "w", newline="")
+        writer = WRITERS[args.format](output)
+        cache = open_cache(args)
+        watcher = MediaWatcher(args.roots, args.exclude, cache, method=args.method,
+                               match_distance=args.match_distance, candidate_distance=args.candidate_distance,
+                               similarity_threshold=args.similarity_threshold, settle_seconds=args.settle_seconds,
+                               use_inotify=not args.no_inotify, poll_interval=args.poll_interval,
+                               on_duplicate=lambda *duplicate: writer.write(duplicate_record(*duplicate)))
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, stop)
+        if args.metrics:
+            reporter = MetricsReporter(args.metrics, interval=args.metrics_interval).start()
+        if args.status_port is not None:
+            server = serve_status(args.status_port)
+        watcher.start()  # Before indexing, so files that land meanwhile are not missed
+        if watcher.restore() or watcher.build():
+            logging.info(f"Watching {', '.join(watcher.roots)}")
+            watcher.run()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if watcher is not None:
+            watcher.close()  # Also closes the cache
+        elif cache is not None:
+            cache.close()
+        if reporter is not None:
+            reporter.stop()
+        if server is not None:
+            server.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+    if not args.quiet:
+        print(f"{watcher.processed} new or changed files processed, {watcher.duplicates} duplicates.",
+              file=sys.stderr)
+    return EXIT_DUPLICATES if watcher.duplicates else EXIT_NO_DUPLICATES
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(message)s')
+    try:
+        if args.watch:
+            return watch(args)
+        return batch(args) if args.batch else run(args)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        logging.error(f"Scan failed: {e}")
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
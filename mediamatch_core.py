@@ -0,0 +1,578 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+from PIL import Image
+from similarity_index import make_index, normalize_vector
+from compact_embedding import CompactEmbedder, quantize_int8
+from embedding_backends import backend_spec, make_backend
+from batch_inference import BatchFeatureExtractor, load_model_input
+from feature_cache import FeatureCache
+from file_walker import ParallelWalker, VIDEO_EXTENSIONS
+from dedup_pipeline import DedupPipeline
+from exact_dedup import ExactDuplicateFinder
+from batch_similarity import cosine_pairs, hamming_pairs
+from grouping import DuplicateGroups
+from video_fingerprint import iter_sampled_frames, is_blank
+from media_hashing import iter_file_hashes
+from worker_pool import default_workers, ignore_interrupts
+from metrics import METRICS
+
+# Duplicate detection library behind the MediaMatch GUI. Importing it has no
+# side effects: the CNN (VGG16 on TensorFlow by default, or a smaller model on
+# TFLite, see embedding_backends.py) is loaded on first use (or
+# in the background with load_model_async), and the worker pool is only started
+# when a scan needs it, so pHash-only and headless runs never pay for them.
+
+# Number of worker processes used for decoding and hashing (one per core by default)
+WORKERS = default_workers()
+
+# Similarity index used for near-duplicate lookup ("exact" or "lsh") and its options. The index
+# stores its vectors as int8 with a per-vector scale and scores queries on that matrix directly.
+SIMILARITY_INDEX = "exact"
+SIMILARITY_INDEX_OPTIONS = {"dtype": "int8"}
+SIMILARITY_THRESHOLD = 0.9
+
+# Number of images sent to the model in one call
+BATCH_SIZE = 32
+
+# CNN that computes the embeddings (a name from embedding_backends.BACKENDS), the CPU threads its
+# runtime may use (None lets it decide) and whether its int8 model is used
+EMBEDDING_BACKEND = "vgg16"
+EMBEDDING_THREADS = None
+EMBEDDING_QUANTIZED = False
+
+# Run the exact -> pHash -> VGG16 funnel instead of running VGG16 on every file. Files within
+# PHASH_MATCH_DISTANCE bits are duplicates outright, VGG16 only decides files whose closest pHash
+# neighbours are within PHASH_CANDIDATE_DISTANCE bits.
+USE_FUNNEL = True
+PHASH_MATCH_DISTANCE = 4
+PHASH_CANDIDATE_DISTANCE = 10
+
+# Compact embeddings: the 7x7x512 VGG16 feature map is average-pooled to 512 values, projected with
+# the PCA saved at PCA_PATH if one exists, L2-normalized and kept as float16 (about 1 KB per file
+# instead of 100 KB). Set to False to use the full flattened feature map. Other backends use
+# pca_<backend>.npz next to PCA_PATH.
+COMPACT_EMBEDDINGS = True
+PCA_PATH = os.path.join(os.path.expanduser("~"), ".mediamatch", "pca.npz")
+
+# Size cap of the on-disk feature cache, least recently used entries are evicted first
+FEATURE_CACHE_MAX_BYTES = 4 * 1024 ** 3
+
+# Lazily created shared state
+model = None
+model_lock = threading.Lock()
+executor = None
+executor_lock = threading.Lock()
+feature_extractor = None
+embedder = None
+
+
+# Function to return the worker process pool used for decoding and hashing, starting it on first use
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=ignore_interrupts)
+    return executor
+
+
+# Function to drop a worker pool whose workers died, so the next scan starts a new one
+def reset_executor():
+    global executor, feature_extractor
+    with executor_lock:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+        feature_extractor = None  # Holds the old pool
+
+
+# Function to load the embedding backend (a pre-trained CNN) on first use
+def get_model():
+    global model
+    with model_lock:
+        if model is None:
+            model = make_backend(EMBEDDING_BACKEND, EMBEDDING_THREADS, EMBEDDING_QUANTIZED)
+    return model
+
+
+# Function to start loading the model on a background thread; callers of get_model() wait for it
+def load_model_async():
+    thread = threading.Thread(target=get_model, daemon=True)
+    thread.start()
+    return thread
+
+
+# Function to check whether the model has finished loading
+def model_loaded():
+    return model is not None
+
+
+# Function to apply the model's input preprocessing to a batch of RGB images
+def preprocess_input(batch):
+    return get_model().preprocess(batch)
+
+
+# Function to return the extractor that batches images through the model while the executor
+# decodes the next ones
+def get_feature_extractor():
+    global feature_extractor
+    if feature_extractor is None:
+        feature_extractor = BatchFeatureExtractor(get_model(), preprocess_input, batch_size=BATCH_SIZE,
+                                                  executor=get_executor(),
+                                                  target_size=backend_spec(EMBEDDING_BACKEND)["input_size"])
+    return feature_extractor
+
+
+# Function to return the compact embedder, or None when full feature maps are used
+def get_embedder():
+    global embedder
+    if COMPACT_EMBEDDINGS and embedder is None:
+        pca_path = PCA_PATH
+        if EMBEDDING_BACKEND != "vgg16":
+            pca_path = os.path.join(os.path.dirname(PCA_PATH), f"pca_{EMBEDDING_BACKEND}.npz")
+        embedder = CompactEmbedder(pca_path, feature_shape=backend_spec(EMBEDDING_BACKEND)["feature_shape"])
+    return embedder
+
+
+# Function to return the cache kind of the stored features, so changing the model or the embedding never
+# mixes vector types (VGG16 features keep their original kinds)
+def feature_kind():
+    backend = EMBEDDING_BACKEND + ("_int8" if EMBEDDING_QUANTIZED and EMBEDDING_BACKEND != "vgg16" else "")
+    if not COMPACT_EMBEDDINGS:
+        return backend
+    if backend == "vgg16":
+        return get_embedder().name
+    return f"{backend}_{get_embedder().name}"
+
+
+# Function to extract features from an image using the embedding backend
+def extract_image_features(image_path):
+    try:
+        img_array = load_model_input(image_path, get_model().input_size)  # Decode and resize to the model input
+        img_array = np.expand_dims(img_array, axis=0)
+        img_array = preprocess_input(img_array)
+        features = get_model().predict(img_array)
+        return features.flatten()  # Flatten the features to a 1D array
+    except Exception as e:
+        logging.error(f"Error processing {image_path}: {e}")
+        return None
+
+
+# Function to extract features from a video by sampling frames using the embedding backend
+def extract_video_features(video_path):
+    try:
+        frames = []
+        # Sample 5 frames evenly spaced in time, skipping black or flat frames such as fade-ins
+        for timestamp, frame in iter_sampled_frames(video_path, count=5):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if is_blank(gray):
+                logging.debug(f"Skipping blank frame at {timestamp:.1f}s in {video_path}")
+                continue
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frames.append(load_model_input(Image.fromarray(rgb), get_model().input_size))
+        if not frames:
+            logging.warning(f"Could not read any frames from video: {video_path}")
+            return []
+        batch = preprocess_input(np.stack(frames))
+        with METRICS.timed("inference"):
+            features = get_model().predict_on_batch(batch)  # All sampled frames in one model call
+        return [frame_features.flatten() for frame_features in np.asarray(features)]
+    except Exception as e:
+        logging.error(f"Error processing video {video_path}: {e}")
+        return None
+
+
+# Function to compare two images or videos based on their features
+def compare_features(features1, features2):
+    return float(np.dot(normalize_vector(features1), normalize_vector(features2)))  # Cosine similarity
+
+
+# Function to reduce image or video features to a single vector for the similarity index
+def as_feature_vector(features):
+    if isinstance(features, list):
+        if not features:
+            return None
+        return np.mean(features, axis=0)  # Average the sampled video frames
+    return features
+
+
+# Function to reduce image or video features to the vector that is cached and indexed
+def embed_features(features):
+    features = as_feature_vector(features)
+    if features is None or not COMPACT_EMBEDDINGS:
+        return features
+    return get_embedder()(features)
+
+
+# Function to get AI-powered features from a file (image or video)
+def get_file_features(file_path):
+    if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):  # Image formats
+        return extract_image_features(file_path)
+    elif file_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.flv')):  # Video formats
+        return extract_video_features(file_path)
+    else:
+        return None
+
+
+# Function to yield (path, features) for every file as it streams in, using cached features for
+# unchanged files and batching the remaining images through the model
+def iter_file_features(file_paths, cache):
+    video_paths = []
+    cached_paths = set()
+    kind = feature_kind()
+
+    def image_paths():
+        for path in file_paths:
+            if path.lower().endswith(VIDEO_EXTENSIONS):
+                video_paths.append(path)  # Videos are processed after all images
+            else:
+                yield path
+
+    def lookup(path):
+        features = cache.get(path, kind)
+        if features is not None:
+            cached_paths.add(path)
+        return features
+
+    feature_extractor = get_feature_extractor()
+    for path, features in feature_extractor.extract(image_paths(), lookup=lookup):
+        if path in cached_paths:
+            cached_paths.discard(path)
+        elif features is not None:
+            features = embed_features(features)
+            cache.put(path, kind, features)
+        yield path, features
+    logging.info(f"Extracted image features at {feature_extractor.throughput():.1f} images/sec")
+
+    for path in video_paths:
+        yield path, cache.get_or_compute(path, kind, lambda p: embed_features(extract_video_features(p)))
+
+
+# Function to return the VGG16 feature vector of a file, reusing the on-disk cache if the file is unchanged
+def get_cached_features(file_path, cache):
+    return cache.get_or_compute(file_path, feature_kind(), lambda p: embed_features(get_file_features(p)))
+
+
+# Function to yield (path, existing_file, stage, score) by comparing VGG16 features of every file.
+# on_decided(path, duplicate or None) is called as soon as each file has been decided, and
+# on_edge(path, existing_file, stage, score) for every stored file above the threshold. With on_edge,
+# duplicates are stored as well and added to `linked`, so grouping does not depend on scan order;
+# they are never reported as the existing file.
+def iter_cnn_duplicates(file_paths, cache, threshold=None, index=None, on_decided=None, on_edge=None,
+                        linked=None):
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    if index is None:
+        index = make_index(SIMILARITY_INDEX, **SIMILARITY_INDEX_OPTIONS)
+    linked = set() if linked is None else linked
+    for path, file_features in iter_file_features(file_paths, cache):
+        file_features = as_feature_vector(file_features)
+        duplicate = None
+        if file_features is not None:
+            with METRICS.timed("index_lookup"):
+                matches = index.query(file_features, k=None if on_edge else 1, threshold=threshold)
+            if on_edge is not None:
+                for existing_file, similarity in matches:
+                    on_edge(path, existing_file, "cnn", similarity)
+            originals = [match for match in matches if match[0] not in linked]
+            if originals:
+                existing_file, similarity = originals[0]  # Most similar stored file above the threshold
+                duplicate = (path, existing_file, "cnn", similarity)
+            if duplicate is None or on_edge is not None:
+                index.add(path, file_features)  # Store the file features if no duplicate found
+                if duplicate is not None:
+                    linked.add(path)
+        if on_decided is not None:
+            on_decided(path, duplicate)
+        if duplicate is not None:
+            yield duplicate
+
+
+# Detection methods, cheapest first: byte-identical files only, plus perceptual hashes, plus
+# VGG16 features for the files the hashes cannot decide
+METHODS = ("exact", "phash", "cnn")
+
+
+# Raised inside a running scan to unwind it as soon as abort() has been called
+class ScanAborted(Exception):
+    pass
+
+
+# One duplicate scan over a set of roots. Iterating it yields (path, existing_file, stage, score)
+# for every duplicate while files are still being discovered; abort() stops it after at most the
+# file (or model batch) in progress. Thresholds default to the module settings.
+# With a checkpoint the scan state is saved periodically and when the scan stops early, and
+# resume=True continues from the saved state: finished files are skipped and duplicates that were
+# still waiting for a decision are yielded again first.
+# Every match found along the way is merged into `groups` (a grouping.DuplicateGroups), so once the
+# scan is done clusters() returns each set of duplicates as one cluster with a keeper.
+# Creating a scan resets the process-wide METRICS, which then describe this scan.
+class DuplicateScan:
+    def __init__(self, roots=None, exclude=None, use_funnel=None, cache=None, method="cnn",
+                 match_distance=None, candidate_distance=None, similarity_threshold=None,
+                 checkpoint=None, resume=False):
+        if method not in METHODS:
+            raise ValueError(f"Unknown detection method: {method}")
+        self.walker = ParallelWalker(roots, exclude)
+        self.cache = cache if cache is not None else FeatureCache(max_bytes=FEATURE_CACHE_MAX_BYTES)
+        self.use_funnel = USE_FUNNEL if use_funnel is None else use_funnel
+        self.method = method
+        self.match_distance = PHASH_MATCH_DISTANCE if match_distance is None else match_distance
+        self.candidate_distance = PHASH_CANDIDATE_DISTANCE if candidate_distance is None else candidate_distance
+        self.similarity_threshold = SIMILARITY_THRESHOLD if similarity_threshold is None else similarity_threshold
+        self.pipeline = None
+        self.index = None
+        self.linked = set()  # Duplicates stored in self.index for grouping
+        self.aborted = False
+        self.completed = False
+        self.resumable = False  # Stopped between files, so the in-memory state is consistent
+        self.duplicates = 0
+        self.processed = set()  # Files that have been decided
+        self.pending = {}  # path -> duplicate, until resolve(path) records that it was dealt with
+        self.groups = DuplicateGroups()
+        self.checkpoint = checkpoint
+        self.restored = None
+        METRICS.reset()
+        if checkpoint is not None and resume:
+            state = checkpoint.load(self.settings())
+            if state is not None:
+                self.processed = state["processed"]
+                self.pending = state["pending"]
+                self.restored = state["index"]
+                self.linked = state.get("linked", set())
+                self.groups = state["groups"]
+                logging.info(f"Resuming scan: {len(self.processed)} files already processed, "
+                             f"{len(self.pending)} duplicates pending")
+
+    # Settings a checkpoint must match to be resumed
+    def settings(self):
+        return {"roots": sorted(os.path.abspath(root) for root in self.walker.roots),
+                "exclude": self.walker.exclude, "method": self.method, "use_funnel": self.use_funnel,
+                "match_distance": self.match_distance, "candidate_distance": self.candidate_distance,
+                "similarity_threshold": self.similarity_threshold,
+                "embedding": feature_kind() if self.method == "cnn" else None}
+
+    @property
+    def resumed(self):
+        return self.restored is not None
+
+    def abort(self):
+        self.aborted = True
+
+    # Records that the user has dealt with a duplicate, so a resumed scan does not offer it again
+    def resolve(self, path):
+        self.pending.pop(path, None)
+
+    def _paths(self):
+        for path in self.walker:
+            if self.aborted:
+                raise ScanAborted()
+            if path not in self.processed:
+                yield path
+
+    def _decided(self, path, duplicate):
+        self.processed.add(path)
+        METRICS.count("files_processed")
+        METRICS.set_gauge("files_discovered", self.walker.files)
+        if duplicate is not None:
+            self.pending[path] = duplicate
+            METRICS.count(f"duplicates_{duplicate[2]}")
+        if self.aborted:
+            raise ScanAborted()
+        if self.checkpoint is not None and self.checkpoint.due():
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        self.cache.flush()  # Cached hashes and features of processed files must survive as well
+        index = self.pipeline.state() if self.pipeline is not None else self.index
+        self.checkpoint.save(self.settings(), {"processed": self.processed, "pending": self.pending, "index": index,
+                                               "linked": self.linked, "groups": self.groups})
+
+    def _duplicates(self):
+        cache = self.cache
+        if self.method == "cnn" and not self.use_funnel:
+            self.index = self.restored
+            if self.index is None:
+                self.index = make_index(SIMILARITY_INDEX, **SIMILARITY_INDEX_OPTIONS)
+            return iter_cnn_duplicates(self._paths(), cache, self.similarity_threshold, self.index, self._decided,
+                                       self.groups.add_edge, self.linked)
+        feature_fn = (lambda p: get_cached_features(p, cache)) if self.method == "cnn" else None
+        # Without the CNN stage, pHash neighbours beyond match_distance are never used
+        candidate_distance = self.candidate_distance if feature_fn is not None else self.match_distance
+        self.pipeline = DedupPipeline(None, feature_fn, self.match_distance, candidate_distance,
+                                      self.similarity_threshold)
+        if self.restored is not None:
+            self.pipeline.restore(self.restored)
+        self.pipeline.on_decided = self._decided
+        self.pipeline.on_edge = self.groups.add_edge
+        if self.method == "exact":
+            return self.pipeline.run(self._paths())
+        # pHashes are computed on the worker processes for files that survive the exact stage
+        return self.pipeline.run(self._paths(),
+                                 hash_stream=lambda paths: iter_file_hashes(paths, cache, executor=get_executor()))
+
+    def __iter__(self):
+        try:
+            # Duplicates found before the checkpoint that were never dealt with come first
+            for path, duplicate in list(self.pending.items()):
+                if not (os.path.exists(path) and os.path.exists(duplicate[1])):
+                    self.resolve(path)
+                    continue
+                self.duplicates += 1
+                yield duplicate
+            for duplicate in self._duplicates():
+                self.duplicates += 1
+                yield duplicate
+            self.completed = True
+        except ScanAborted:
+            self.resumable = True
+        except BrokenProcessPool:
+            reset_executor()
+            if not self.aborted:
+                raise
+            self.resumable = True  # Workers killed by the same Ctrl-C; the files they had are redone
+        except GeneratorExit:
+            self.resumable = True  # Closed by the consumer between two duplicates
+            raise
+
+    # Returns (files decided, files discovered so far, whether discovery has finished)
+    def progress(self):
+        return len(self.processed), max(self.walker.files, len(self.processed)), self.walker.done
+
+    # Returns the duplicate clusters found so far, each with a keeper chosen by policy (see grouping.py)
+    def clusters(self, policy=None):
+        return self.groups.clusters(policy)
+
+    # Files seen so far that were not duplicates
+    def unique_files(self):
+        return self.walker.files - self.duplicates
+
+    # Per-stage counts and timings of the funnel (when it ran), then the latency of each hot path
+    def report(self):
+        lines = self.pipeline.report() if self.pipeline is not None else []
+        return lines + METRICS.summary()
+
+    # Tidies the cache and the checkpoint: a complete scan removes its checkpoint and drops stale
+    # cache entries, a scan that stopped early saves a checkpoint to resume from
+    def close(self):
+        if self.checkpoint is not None:
+            if self.completed:
+                self.checkpoint.remove()
+            elif self.resumable:
+                self.save_checkpoint()
+        if self.completed:
+            self.cache.prune_stale(self.walker.roots)  # Drop entries for files that were deleted or changed
+        self.cache.evict()
+        self.cache.close()
+
+
+# Offline all-pairs scan for scheduled full-library runs. Files are first checked for identical
+# bytes, then the pHashes (and with method "cnn" the VGG16 embeddings) of all remaining files are
+# collected, from the cache where possible, and compared with each other in tiles (see
+# batch_similarity.py) instead of one index query per file. Every pair above the threshold is merged
+# into `groups`; there is no streaming, checkpoint or first-match decision, run() returns once all
+# pairs are known and clusters() then proposes a keeper for each group.
+class BatchScan:
+    def __init__(self, roots=None, exclude=None, cache=None, method="phash", match_distance=None,
+                 similarity_threshold=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown detection method: {method}")
+        self.walker = ParallelWalker(roots, exclude)
+        self.cache = cache if cache is not None else FeatureCache(max_bytes=FEATURE_CACHE_MAX_BYTES)
+        self.method = method
+        self.match_distance = PHASH_MATCH_DISTANCE if match_distance is None else match_distance
+        self.similarity_threshold = SIMILARITY_THRESHOLD if similarity_threshold is None else similarity_threshold
+        self.groups = DuplicateGroups()
+        self.pairs = {stage: 0 for stage in METHODS}
+        self.aborted = False
+        self.completed = False
+        METRICS.reset()
+
+    def abort(self):
+        self.aborted = True
+
+    def _check_aborted(self):
+        if self.aborted:
+            raise ScanAborted()
+
+    def _add_pairs(self, paths, pairs, stage):
+        for positions, others, scores in pairs:
+            self._check_aborted()
+            for position, other, score in zip(positions.tolist(), others.tolist(), scores.tolist()):
+                self.groups.add_edge(paths[other], paths[position], stage, score)  # The later file is the copy
+            self.pairs[stage] += len(positions)
+
+    def _exact(self):
+        survivors = []
+        for path, original in ExactDuplicateFinder().iter_check(self.walker):
+            self._check_aborted()
+            if original is None:
+                survivors.append(path)
+            else:
+                self.groups.add_edge(path, original, "exact", 1.0)
+                self.pairs["exact"] += 1
+        return survivors
+
+    def _phash(self, file_paths):
+        paths, codes = [], []
+        for path, file_hash in iter_file_hashes(file_paths, self.cache, executor=get_executor(), ordered=True):
+            self._check_aborted()
+            if file_hash is not None:
+                paths.append(path)
+                codes.append(file_hash)
+        logging.info(f"Comparing the pHashes of {len(paths)} files")
+        self._add_pairs(paths, hamming_pairs(np.array(codes, dtype=np.uint64), self.match_distance), "phash")
+
+    def _cnn(self, file_paths):
+        paths, vectors, scales = [], [], []
+        for path, features in iter_file_features(file_paths, self.cache):
+            self._check_aborted()
+            features = as_feature_vector(features)
+            if features is not None:
+                vector, scale = quantize_int8(normalize_vector(features))  # About 0.5 KB per file
+                paths.append(path)
+                vectors.append(vector)
+                scales.append(scale)
+        if not paths:
+            return
+        logging.info(f"Comparing the VGG16 embeddings of {len(paths)} files")
+        self._add_pairs(paths, cosine_pairs(np.stack(vectors), self.similarity_threshold,
+                                            np.array(scales, dtype=np.float32)), "cnn")
+
+    # Finds all duplicate pairs; returns False if the scan was aborted
+    def run(self):
+        try:
+            survivors = self._exact()
+            if self.method != "exact":
+                self._phash(survivors)
+            if self.method == "cnn":
+                self._cnn(survivors)
+            self.completed = True
+        except ScanAborted:
+            pass
+        except BrokenProcessPool:
+            reset_executor()
+            if not self.aborted:
+                raise
+        return self.completed
+
+    # Returns the duplicate clusters, each with a keeper chosen by policy (see grouping.py)
+    def clusters(self, policy=None):
+        return self.groups.clusters(policy)
+
+    # Pairs found by each stage, then the latency of each hot path
+    def report(self):
+        lines = [f"{stage}: {self.pairs[stage]} pairs"
+                 for stage in METHODS[:METHODS.index(self.method) + 1]]
+        for line in lines:
+            logging.info(line)
+        return lines + METRICS.summary()
+
+    def close(self):
+        if self.completed:
+            self.cache.prune_stale(self.walker.roots)  # Drop entries for files that were deleted or changed
+        self.cache.evict()
+        self.cache.close()
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Run metrics: counters, latency histograms and gauges (queue depths, progress)
+# for the hot paths of a scan - discovery, decode, hash, model inference, index
+# lookup and I/O. Everything is recorded in the process-wide METRICS registry;
+# work done on worker processes is timed there and recorded when its result
+# comes back. A snapshot is plain JSON, and can be written periodically with
+# MetricsReporter or served over HTTP with serve_status. profiled() wraps a run
+# in cProfile and tracemalloc for slow runs.
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+# Seconds between two metrics files written by MetricsReporter
+REPORT_INTERVAL_SECONDS = 10
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper bound of the bucket holding the q-th quantile (the maximum for the unbounded bucket)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        labels = [f"le_{bound:g}" for bound in self.buckets] + ["inf"]
+        return {"count": self.count, "total_seconds": self.total,
+                "mean_seconds": self.total / self.count if self.count else 0.0,
+                "p50_seconds": self.quantile(0.5), "p95_seconds": self.quantile(0.95),
+                "p99_seconds": self.quantile(0.99), "max_seconds": self.max,
+                "buckets": {label: count for label, count in zip(labels, self.counts) if count}}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value  # A single assignment, no lock needed
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    # Records the duration of the with-block in the named histogram
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {"time": time.time(), "uptime_seconds": time.time() - self.started,
+                    "counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "latency": {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())}}
+
+    # One line per histogram, for logs and end-of-run reports
+    def summary(self):
+        lines = []
+        for name, latency in self.snapshot()["latency"].items():
+            lines.append(f"{name}: {latency['count']} calls, {latency['total_seconds']:.2f}s total, "
+                         f"p50 {latency['p50_seconds'] * 1000:.1f}ms, p95 {latency['p95_seconds'] * 1000:.1f}ms, "
+                         f"max {latency['max_seconds'] * 1000:.1f}ms")
+        return lines
+
+    # Writes a snapshot as JSON; the file is replaced atomically so readers never see half of it
+    def dump(self, path):
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temporary, path)
+
+
+# Process-wide registry used by the scan code
+METRICS = Metrics()
+
+
+# Function to call func(*args) and return (result, seconds); module-level so it can run on a process pool
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Writes the metrics to a JSON file every `interval` seconds on a background thread, and once more on stop()
+class MetricsReporter:
+    def __init__(self, path, metrics=METRICS, interval=REPORT_INTERVAL_SECONDS):
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._dump()
+
+    def _dump(self):
+        try:
+            self.metrics.dump(self.path)
+        except OSError as e:
+            logging.error(f"Cannot write metrics to {self.path}: {e}")
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self._dump()
+
+
+# Function to serve the metrics as JSON on http://host:port/ from a background thread; returns the
+# server, whose shutdown() stops it
+def serve_status(port, host="127.0.0.1", metrics=METRICS):
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(metrics.snapshot(), indent=1).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(f"Status request: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving scan metrics on http://{host}:{server.server_port}/")
+    return server
+
+
+# Profiles the with-block with cProfile and tracemalloc. Writes <prefix>.prof (open it with pstats or
+# snakeviz) and <prefix>.memory.txt with the peak traced memory and the top allocation sites.
+@contextmanager
+def profiled(prefix, top=25):
+    import cProfile
+    import tracemalloc
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(f"{prefix}.prof")
+        with open(f"{prefix}.memory.txt", "w") as f:
+            f.write(f"Traced memory: {current / 1024 ** 2:.1f} MB at exit, {peak / 1024 ** 2:.1f} MB peak\n\n")
+            for statistic in snapshot.statistics("lineno")[:top]:
+                f.write(f"{statistic}\n")
+        logging.info(f"Wrote profile to {prefix}.prof and {prefix}.memory.txt")
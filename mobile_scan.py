@@ -0,0 +1,380 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from feature_cache import FeatureCache
+from file_walker import MEDIA_EXTENSIONS, VIDEO_EXTENSIONS, is_excluded
+from hamming_index import HammingIndex
+from multi_hash import MultiHashIndex
+from similarity_index import normalize_vector
+from media_hashing import HASH_DISTANCE_THRESHOLD, get_cached_file_hash, get_cached_file_record
+
+# Low-memory duplicate scan for phones. Instead of walking the whole file
+# system with a thread pool, the media directories of the shared storage (DCIM,
+# Pictures, Movies, ...) are walked one directory at a time and their files are
+# streamed, so memory stays bounded however large DCIM gets. Files are hashed
+# one at a time on a single worker thread, so decoding a video or loading the
+# CNN never holds up the Kivy thread; results are posted to it with
+# kivy.clock.Clock, and no process pool competes with the UI. pHashes are kept
+# as 64-bit integers in a HammingIndex (NumPy uint64 arrays, about 24 bytes per
+# file plus its path), never as ImageHash objects. Before every file a
+# PowerMonitor looks at the battery and the thermal state, and the scan slows
+# down or pauses on a low battery or a hot phone. With a feature_fn (an
+# on-device CNN, see embedding_backends.py), files whose nearest pHashes are
+# close but not within the match distance are decided by the cosine similarity
+# of their embeddings.
+
+# Directories under the shared storage root that are scanned (those that exist)
+MEDIA_DIRECTORIES = ("DCIM", "Pictures", "Movies", "Download", "WhatsApp/Media",
+                     "Android/media/com.whatsapp/WhatsApp/Media")
+
+# Directories that are never scanned: hidden ones (such as DCIM/.thumbnails) and app-private data
+MOBILE_EXCLUDES = [".*", "*/Android/data", "*/Android/obb"]
+
+# Files hashed between two pauses while throttled, and the length of those pauses
+CHUNK_SIZE = 16
+THROTTLED_DELAY_SECONDS = 0.5
+
+# Seconds between two power checks while paused
+PAUSED_RECHECK_SECONDS = 30
+
+# Seconds between two battery and thermal readings
+POWER_CHECK_INTERVAL_SECONDS = 30
+
+# Battery levels (percent, while not charging) below which the scan slows down or pauses
+THROTTLE_BATTERY_PERCENT = 30
+PAUSE_BATTERY_PERCENT = 15
+
+# Android thermal status (PowerManager.THERMAL_STATUS_*) at which the scan slows down or pauses:
+# 2 is MODERATE, 3 is SEVERE
+THROTTLE_THERMAL_STATUS = 2
+PAUSE_THERMAL_STATUS = 3
+
+# Battery temperatures (degrees Celsius) used instead where the thermal status is unavailable
+THROTTLE_BATTERY_CELSIUS = 40
+PAUSE_BATTERY_CELSIUS = 45
+
+# pHash bits within which a borderline match is decided by the CNN, and the cosine similarity it needs
+CANDIDATE_DISTANCE = 12
+SIMILARITY_THRESHOLD = 0.9
+
+# Files between two "Scanned N files" status messages
+STATUS_EVERY = 200
+
+# Where the battery is described on Linux and most Android kernels
+POWER_SUPPLY_PATH = "/sys/class/power_supply/battery"
+
+
+# Function to return the root of the shared storage (/storage/emulated/0 on most phones)
+def external_storage_root():
+    try:
+        from android.storage import primary_external_storage_path  # Only available under python-for-android
+        return primary_external_storage_path()
+    except ImportError:
+        return os.environ.get("EXTERNAL_STORAGE", os.path.expanduser("~"))
+
+
+# Function to return the media directories to scan, or the storage root if it has none of them
+def media_roots(root=None):
+    root = root or external_storage_root()
+    roots = [os.path.join(root, directory) for directory in MEDIA_DIRECTORIES]
+    return [path for path in roots if os.path.isdir(path)] or [root]
+
+
+# Function to yield media file paths under the roots, listing one directory at a time. Only the
+# directories still to be listed are held in memory.
+def iter_media_files(roots, exclude=None, extensions=MEDIA_EXTENSIONS):
+    exclude = MOBILE_EXCLUDES if exclude is None else exclude
+    pending = list(reversed(roots))
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not is_excluded(entry.path, entry.name, exclude):
+                                pending.append(entry.path)
+                        elif entry.name.lower().endswith(extensions) and entry.is_file(follow_symlinks=False):
+                            yield entry.path
+                    except OSError as e:
+                        logging.debug(f"Skipping {entry.path}: {e}")
+        except OSError as e:
+            logging.debug(f"Cannot list {directory}: {e}")
+
+
+# Function to read a number from a sysfs file, or None
+def read_number(path):
+    try:
+        with open(path) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+# Reads the battery and thermal state and decides whether the scan should run, slow down or pause.
+# Readings come from plyer and the Android PowerManager where available, from sysfs otherwise;
+# when nothing can be read the scan simply runs.
+class PowerMonitor:
+    def __init__(self, interval=POWER_CHECK_INTERVAL_SECONDS):
+        self.interval = interval
+        self.checked = None
+        self.state = ("run", None)
+        self.power_manager = None
+        self.thermal_available = True
+
+    # Returns (percent, charging), either of which may be None
+    def battery(self):
+        try:
+            from plyer import battery
+            status = battery.status
+            if status.get("percentage") is not None:
+                return status["percentage"], status.get("isCharging")
+        except Exception as e:
+            logging.debug(f"Battery status unavailable from plyer: {e}")
+        percent = read_number(os.path.join(POWER_SUPPLY_PATH, "capacity"))
+        try:
+            with open(os.path.join(POWER_SUPPLY_PATH, "status")) as f:
+                charging = f.read().strip() in ("Charging", "Full")
+        except OSError:
+            charging = None
+        return percent, charging
+
+    # Returns the Android thermal status (0 NONE to 6 SHUTDOWN), or None before Android 10 and off Android
+    def thermal_status(self):
+        if not self.thermal_available:
+            return None
+        try:
+            if self.power_manager is None:
+                from jnius import autoclass
+                activity = autoclass("org.kivy.android.PythonActivity").mActivity
+                context = autoclass("android.content.Context")
+                self.power_manager = activity.getSystemService(context.POWER_SERVICE)
+            return self.power_manager.getCurrentThermalStatus()
+        except Exception as e:
+            logging.debug(f"Thermal status unavailable: {e}")
+            self.thermal_available = False  # Do not retry the import on every check
+            return None
+
+    # Returns the battery temperature in degrees Celsius, or None
+    def battery_celsius(self):
+        tenths = read_number(os.path.join(POWER_SUPPLY_PATH, "temp"))
+        return None if tenths is None else tenths / 10
+
+    def _read(self):
+        percent, charging = self.battery()
+        if percent is not None and not charging:
+            if percent < PAUSE_BATTERY_PERCENT:
+                return "pause", f"battery at {percent:.0f}%"
+        thermal = self.thermal_status()
+        celsius = self.battery_celsius() if thermal is None else None
+        if thermal is not None and thermal >= PAUSE_THERMAL_STATUS:
+            return "pause", f"thermal status {thermal}"
+        if celsius is not None and celsius >= PAUSE_BATTERY_CELSIUS:
+            return "pause", f"battery at {celsius:.0f}°C"
+        if percent is not None and not charging and percent < THROTTLE_BATTERY_PERCENT:
+            return "throttle", f"battery at {percent:.0f}%"
+        if thermal is not None and thermal >= THROTTLE_THERMAL_STATUS:
+            return "throttle", f"thermal status {thermal}"
+        if celsius is not None and celsius >= THROTTLE_BATTERY_CELSIUS:
+            return "throttle", f"battery at {celsius:.0f}°C"
+        return "run", None
+
+    # Returns ("run" | "throttle" | "pause", reason), reading the device at most once per interval
+    def check(self):
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= self.interval:
+            self.checked = now
+            self.state = self._read()
+        return self.state
+
+
+# Function to run func(*args) on the Kivy thread, waiting until it has run if wait is set
+def post_to_kivy(func, *args, wait=False):
+    from kivy.clock import Clock
+    done = threading.Event()
+
+    def call(dt):
+        try:
+            func(*args)
+        finally:
+            done.set()
+
+    Clock.schedule_once(call)
+    if wait:
+        done.wait()
+
+
+# A pHash (or multi-hash) scan that hashes one file at a time on a worker thread. on_duplicate(path,
+# matches, stage) is called with the (stored path, score) pairs of every duplicate, where stage is
+# "phash" (scores are distances) or "cnn" (scores are similarities), and may pause() the scan while the
+# user decides; the next file is only hashed once it has returned. on_status(message) reports progress
+# and power state changes, and on_finished(scan) runs once the scan is complete or aborted. After
+# start() all callbacks are posted to the Kivy thread; run() calls them on the calling thread.
+# feature_fn(path), if given, returns the CNN embedding of a file (or None). With multi_hash, images are
+# matched by the weighted vote of multi_hash.py and videos by their frame pHash alone.
+class MobileScan:
+    def __init__(self, roots=None, exclude=None, cache=None, max_distance=HASH_DISTANCE_THRESHOLD,
+                 chunk_size=CHUNK_SIZE, power=None, on_duplicate=None, on_status=None, on_finished=None,
+                 feature_fn=None, candidate_distance=CANDIDATE_DISTANCE, similarity_threshold=SIMILARITY_THRESHOLD,
+                 multi_hash=False):
+        self.roots = list(roots or media_roots())
+        self.cache = cache if cache is not None else FeatureCache()
+        self.max_distance = max_distance
+        self.candidate_distance = candidate_distance
+        self.feature_fn = feature_fn
+        self.similarity_threshold = similarity_threshold
+        self.multi_hash = multi_hash
+        # Without a CNN, pHash neighbours beyond max_distance are never used
+        phash_distance = candidate_distance if feature_fn is not None else max_distance
+        if multi_hash:
+            self.hashes = MultiHashIndex(max_distance=max_distance)
+            self.videos = HammingIndex(max_distance=phash_distance)
+        else:
+            self.hashes = self.videos = HammingIndex(max_distance=phash_distance)
+        self.files = iter_media_files(self.roots, exclude)
+        self.chunk_size = chunk_size
+        self.power = power or PowerMonitor()
+        self.on_duplicate = on_duplicate
+        self.on_status = on_status
+        self.on_finished = on_finished
+        self.post = None  # Set by start() to hand callbacks to the Kivy thread
+        self.thread = None
+        self.running = threading.Event()  # Cleared while paused
+        self.running.set()
+        self.wakeup = threading.Event()  # Ends power and throttle waits early on abort
+        self.mode = "run"
+        self.scanned = 0
+        self.duplicates = 0
+        self.paused = False
+        self.aborted = False
+        self.completed = False
+        self.finished = False
+
+    # Number of files stored as unique
+    def unique_files(self):
+        return len(self.hashes) + (len(self.videos) if self.videos is not self.hashes else 0)
+
+    def _call(self, func, *args, wait=False):
+        if func is None:
+            return
+        if self.post is None:
+            func(*args)
+        else:
+            self.post(func, *args, wait=wait)
+
+    def _status(self, message):
+        self._call(self.on_status, message)
+
+    # Returns the index a file belongs in and its hash there, or (index, None) if it couldn't be hashed
+    def _hash(self, path):
+        if self.multi_hash and not path.lower().endswith(VIDEO_EXTENSIONS):
+            return self.hashes, get_cached_file_record(path, self.cache)
+        return self.videos, get_cached_file_hash(path, self.cache)
+
+    def _process(self, path):
+        self.scanned += 1
+        if self.scanned % STATUS_EVERY == 0:
+            self._status(f"Scanned {self.scanned} files...")
+        index, file_hash = self._hash(path)
+        if file_hash is None:
+            return
+        matches = index.query(file_hash)
+        neighbours = []
+        if isinstance(index, MultiHashIndex):
+            if not matches and self.feature_fn is not None:
+                # No vote passed: files with close pHashes are left to the CNN
+                neighbours = index.hashes.query(int(file_hash["phash"]), max_distance=self.candidate_distance)
+        elif self.feature_fn is not None:
+            close = [(other, distance) for other, distance in matches if distance <= self.max_distance]
+            neighbours = [] if close else matches
+            matches = close
+        stage = "phash"
+        if neighbours:
+            matches, stage = self._similar(path, [other for other, _ in neighbours]), "cnn"
+        if matches:
+            self.duplicates += 1
+            self._call(self.on_duplicate, path, matches, stage, wait=True)
+        else:
+            index.add(path, file_hash)
+
+    def _features(self, path):
+        features = self.feature_fn(path)
+        return None if features is None else normalize_vector(features)
+
+    # Returns the (neighbour, similarity) pairs at or above the similarity threshold, most similar first
+    def _similar(self, path, neighbours):
+        features = self._features(path)
+        if features is None:
+            return []
+        similar = []
+        for neighbour in neighbours:
+            neighbour_features = self._features(neighbour)
+            if neighbour_features is not None:
+                similarity = float(np.dot(features, neighbour_features))
+                if similarity >= self.similarity_threshold:
+                    similar.append((neighbour, similarity))
+        return sorted(similar, key=lambda match: -match[1])
+
+    # Waits while the power state asks for a pause
+    def _wait_for_power(self):
+        while not self.aborted:
+            mode, reason = self.power.check()
+            if mode != self.mode:
+                self.mode = mode
+                self._status({"run": "Resuming the scan at full speed.",
+                              "throttle": f"Slowing the scan down: {reason}.",
+                              "pause": f"Pausing the scan: {reason}."}[mode])
+            if mode != "pause":
+                return
+            self.wakeup.wait(PAUSED_RECHECK_SECONDS)
+
+    # Scans to the end on the calling thread, honouring pauses and the power state
+    def run(self):
+        try:
+            for path in self.files:
+                self.running.wait()  # While on_duplicate has paused the scan
+                self._wait_for_power()
+                if self.aborted:
+                    break
+                self._process(path)
+                if self.mode == "throttle" and self.scanned % self.chunk_size == 0:
+                    self.wakeup.wait(THROTTLED_DELAY_SECONDS)
+            else:
+                self.running.wait()  # Until the user has answered about the last file
+                self.completed = not self.aborted
+        finally:
+            self._finish()
+        return self
+
+    # Starts scanning on a worker thread, handing every callback to post (the Kivy thread by default)
+    def start(self, post=post_to_kivy):
+        self.post = post
+        self.thread = threading.Thread(target=self.run, name="MobileScan", daemon=True)
+        self.thread.start()
+        return self
+
+    def pause(self):
+        self.paused = True
+        self.running.clear()
+
+    def resume(self):
+        self.paused = False
+        self.running.set()
+
+    # Stops the scan after the file being hashed; on_finished still runs
+    def abort(self):
+        self.aborted = True
+        self.wakeup.set()
+        self.running.set()
+
+    def _finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.files.close()
+        if self.completed:
+            self.cache.prune_stale(self.roots)  # Drop entries for files that were deleted or changed
+        self.cache.close()
+        self._call(self.on_finished, self)
@@ -0,0 +1,209 @@
+import numpy as np
+from PIL import Image
+from image_decode import load_image
+from hamming_index import HammingIndex, popcount
+
+# Several perceptual hash families from a single decode. An image is decoded
+# once near hash size, turned into one 64x64 grayscale and one 64x64 HSV
+# thumbnail, and every family is computed from those with NumPy:
+#   ahash     - 8x8 block means above their mean
+#   dhash     - horizontal gradient signs of a 9x8 thumbnail
+#   phash     - low 8x8 DCT coefficients of a 32x32 thumbnail above their median
+#   whash     - Haar low band (8x8 block means with the DC removed) above its median
+#   colorhash - share of black, gray and six faint and six bright hue bins, 3 bits each
+# The families follow the imagehash definitions, but because they share one
+# thumbnail their bits are not identical to imagehash's, so they are cached
+# under their own kind. The hashes are stored in one packed record, and two
+# records are compared by weighted voting: every family whose Hamming distance is
+# within its match distance votes for "duplicate" with its weight.
+
+FAMILIES = ("ahash", "dhash", "phash", "whash", "colorhash")
+
+# One record per file: a bit mask of the computed families, then one 64-bit hash per family (41 bytes)
+RECORD_DTYPE = np.dtype([("families", "u1")] + [(family, "<u8") for family in FAMILIES])
+
+# Smallest size images are decoded at before hashing
+DECODE_SIZE = (256, 256)
+
+# Side of the shared grayscale and HSV thumbnails
+THUMBNAIL_SIZE = 64
+
+# Bits per colour hash bin
+COLOR_BIN_BITS = 3
+
+# Vote weight of each family; pHash and dHash are the most robust to recompression and resizing,
+# aHash and wHash largely agree with each other so each gets a smaller share
+WEIGHTS = {"ahash": 1.0, "dhash": 1.5, "phash": 2.0, "whash": 1.0, "colorhash": 0.5}
+
+# Largest Hamming distance at which a family votes for a match (colorhash has 42 bits, the others 64)
+MATCH_DISTANCES = {"ahash": 8, "dhash": 12, "phash": 10, "whash": 8, "colorhash": 4}
+
+# Fraction of the weight of the families both records have that must vote for a match
+VOTE_THRESHOLD = 0.6
+
+# Families both records must have for their vote to count, so a pHash-only record (a video frame) never
+# matches on its pHash alone
+MIN_VOTING_FAMILIES = 2
+
+# pHash distance within which stored files are considered by the vote at all
+CANDIDATE_DISTANCE = 14
+
+
+# Function to return the DCT-II matrix of size n, unnormalized like scipy.fftpack.dct (which pHash uses)
+def dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return (2 * np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))).astype(np.float32)
+
+
+DCT_32 = dct_matrix(32)
+
+
+# Function to pack n rows of up to 64 bits (first bit most significant) into n uint64 values
+def pack_bits(bits):
+    bits = np.asarray(bits, dtype=bool).reshape(len(bits), -1)
+    packed = np.packbits(bits, axis=1)
+    unused = 8 * packed.shape[1] - bits.shape[1]  # Padding bits packbits added at the end
+    words = np.zeros((len(bits), 8), dtype=np.uint8)
+    words[:, 8 - packed.shape[1]:] = packed
+    return words.view(">u8").ravel().astype(np.uint64) >> np.uint64(unused)
+
+
+# Function to compute the grayscale families of a stack of 64x64 thumbnails (shape (n, 64, 64)),
+# returning {family: uint64 array of length n}
+def gray_hashes(grays, families=FAMILIES):
+    grays = np.asarray(grays, dtype=np.float32)
+    n = len(grays)
+    hashes = {}
+    blocks = grays.reshape(n, 8, 8, 8, 8).mean(axis=(2, 4))  # 8x8 block means
+    if "ahash" in families:
+        hashes["ahash"] = pack_bits(blocks > blocks.mean(axis=(1, 2), keepdims=True))
+    if "whash" in families:
+        # The Haar low band at 8x8 is the block means; removing the DC term does not change the median split
+        low = blocks - blocks.mean(axis=(1, 2), keepdims=True)
+        hashes["whash"] = pack_bits(low > np.median(low.reshape(n, -1), axis=1)[:, None, None])
+    if "phash" in families:
+        small = grays.reshape(n, 32, 2, 32, 2).mean(axis=(2, 4))
+        dct = DCT_32 @ small @ DCT_32.T  # 2D DCT of every thumbnail in one batched product
+        low = dct[:, :8, :8]
+        hashes["phash"] = pack_bits(low > np.median(low.reshape(n, -1), axis=1)[:, None, None])
+    if "dhash" in families:
+        # 9 columns by 8 rows: average 64 rows down to 8 and interpolate 64 columns down to 9
+        rows = grays.reshape(n, 8, 8, THUMBNAIL_SIZE).mean(axis=2)
+        columns = np.linspace(0, THUMBNAIL_SIZE - 1, 9)
+        left, fraction = np.floor(columns).astype(int), (columns % 1)[None, None, :]
+        right = np.minimum(left + 1, THUMBNAIL_SIZE - 1)
+        narrow = rows[:, :, left] * (1 - fraction) + rows[:, :, right] * fraction
+        hashes["dhash"] = pack_bits(narrow[:, :, 1:] > narrow[:, :, :-1])
+    return hashes
+
+
+# Function to compute the colour hash of a 64x64 HSV thumbnail and its grayscale intensity
+def color_hash(hsv, intensity, bin_bits=COLOR_BIN_BITS):
+    hue, saturation = hsv[..., 0].astype(np.int32), hsv[..., 1].astype(np.int32)
+    black = intensity < 256 // 8
+    gray = ~black & (saturation < 256 // 3)
+    colors = ~black & ~gray
+    faint = colors & (saturation < 256 * 2 // 3)
+    bright = colors & (saturation > 256 * 2 // 3)
+    color_pixels = max(1, int(colors.sum()))
+    hue_bins = np.linspace(0, 255, 7)
+    faint_counts = np.histogram(hue[faint], bins=hue_bins)[0]
+    bright_counts = np.histogram(hue[bright], bins=hue_bins)[0]
+    levels = 2 ** bin_bits
+    fractions = np.concatenate([[black.mean(), gray.mean()],
+                                faint_counts / color_pixels, bright_counts / color_pixels])
+    values = np.minimum(levels - 1, (fractions * levels).astype(np.int64))
+    bits = (values[:, None] >> np.arange(bin_bits - 1, -1, -1)) & 1
+    return pack_bits(bits.reshape(1, -1))[0]
+
+
+# Function to decode an image (path or PIL image) once and return its hash record
+def hash_image(image, families=FAMILIES):
+    image = load_image(image, DECODE_SIZE, mode="RGB")  # Upright, decoded near hash size
+    thumbnail = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX)
+    gray = np.asarray(thumbnail.convert("L"))
+    record = np.zeros((), dtype=RECORD_DTYPE)
+    for family, values in gray_hashes(gray[None], families).items():
+        record[family] = values[0]
+    if "colorhash" in families:
+        record["colorhash"] = color_hash(np.asarray(thumbnail.convert("HSV")), gray)
+    record["families"] = family_mask(families)
+    return record
+
+
+# Function to return the bit mask of a set of families
+def family_mask(families):
+    return sum(1 << FAMILIES.index(family) for family in families)
+
+
+# Function to wrap a single 64-bit pHash (e.g. of a video frame) in a record
+def record_from_phash(phash):
+    record = np.zeros((), dtype=RECORD_DTYPE)
+    record["phash"] = phash
+    record["families"] = family_mask(("phash",))
+    return record
+
+
+# Function to return {family: Hamming distances} between a record and an array of records
+def family_distances(record, records):
+    return {family: popcount(records[family] ^ record[family]).astype(np.int64) for family in FAMILIES}
+
+
+# Function to return the weighted vote (0 to 1) of every record in `records` for being a duplicate of
+# `record`. Only families present in both records vote, and records sharing fewer than min_families get 0.
+def vote(record, records, weights=None, match_distances=None, min_families=MIN_VOTING_FAMILIES):
+    weights = WEIGHTS if weights is None else weights
+    match_distances = MATCH_DISTANCES if match_distances is None else match_distances
+    shared = records["families"] & record["families"]
+    agree = np.zeros(len(records))
+    total = np.zeros(len(records))
+    voters = np.zeros(len(records), dtype=np.int64)
+    for bit, (family, distances) in enumerate(family_distances(record, records).items()):
+        present = (shared >> bit) & 1 == 1
+        voters += present
+        total += np.where(present, weights[family], 0.0)
+        agree += np.where(present & (distances <= match_distances[family]), weights[family], 0.0)
+    return np.divide(agree, total, out=np.zeros(len(records)), where=(total > 0) & (voters >= min_families))
+
+
+# Index of hash records: candidates are found by pHash in a HammingIndex and confirmed by weighted
+# voting over all families. query() has the HammingIndex interface and returns (key, pHash distance)
+# pairs, best vote first. max_distance, if given, is the pHash match distance of the vote, so the
+# pHash threshold of a scan still applies when it switches to multi-hash matching.
+class MultiHashIndex:
+    def __init__(self, candidate_distance=CANDIDATE_DISTANCE, vote_threshold=VOTE_THRESHOLD, weights=None,
+                 match_distances=None, max_distance=None, min_families=MIN_VOTING_FAMILIES, initial_capacity=1024):
+        self.hashes = HammingIndex(max_distance=candidate_distance)
+        self.vote_threshold = vote_threshold
+        self.weights = weights
+        if max_distance is not None:
+            match_distances = dict(MATCH_DISTANCES if match_distances is None else match_distances,
+                                   phash=max_distance)
+        self.match_distances = match_distances
+        self.min_families = min_families
+        self.records = np.zeros(initial_capacity, dtype=RECORD_DTYPE)
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, key, record):
+        position = self.hashes.add(key, int(record["phash"]))
+        if position == len(self.records):
+            self.records = np.concatenate([self.records, np.zeros(len(self.records), dtype=RECORD_DTYPE)])
+        self.records[position] = record
+        self.positions[key] = position
+        return position
+
+    # Returns (key, pHash distance) pairs whose vote reaches the threshold, best vote first
+    def query(self, record, k=None):
+        candidates = self.hashes.query(int(record["phash"]))
+        if not candidates:
+            return []
+        positions = np.array([self.positions[key] for key, _ in candidates])
+        scores = vote(record, self.records[positions], self.weights, self.match_distances, self.min_families)
+        order = sorted((i for i in range(len(candidates)) if scores[i] >= self.vote_threshold),
+                       key=lambda i: (-scores[i], candidates[i][1]))
+        if k is not None:
+            order = order[:k]
+        return [candidates[i] for i in order]
@@ -0,0 +1,154 @@
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from file_walker import VIDEO_EXTENSIONS
+from metrics import METRICS, timed_call
+
+# Read-ahead of file contents for the decode workers. Opening and reading a
+# photo on a NAS or network share costs a round trip or more, and a decode
+# worker that opens its own file sits idle for all of it. Prefetcher reads the
+# next files on a pool of I/O threads while the workers decode, and hands each
+# file over as bytes that decoders open from memory (BytesIO for PIL,
+# cv2.imdecode for OpenCV). Read-ahead is bounded by a number of files and a
+# byte budget that every read reserves before it starts, so memory stays flat
+# however far the walker runs ahead and however many reads are in flight. Videos
+# and very large files are not read into memory: cv2.VideoCapture needs a path,
+# so the page cache is only asked to start reading them (posix_fadvise, where
+# available) and they are decoded from the path as before.
+
+# I/O threads reading files ahead of the decoders (0 reads nothing ahead; decoders open the files themselves)
+PREFETCH_THREADS = 16
+
+# Files read ahead or being read at once, and the bytes they may hold
+PREFETCH_FILES = 64
+PREFETCH_BYTES = 256 * 1024 * 1024
+
+# Files larger than this are decoded from their path instead of from memory
+MAX_PREFETCH_FILE_BYTES = 64 * 1024 * 1024
+
+
+# A file handed to a decoder: its path and its contents, or None to open the path
+class PrefetchedFile:
+    __slots__ = ("path", "data")
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data
+
+    def __str__(self):  # Worker pools log failed items by str(), which must not dump the bytes
+        return self.path
+
+    def __getstate__(self):
+        return self.path, self.data
+
+    def __setstate__(self, state):
+        self.path, self.data = state
+
+
+# Function to return what a decoder should open: an in-memory file if the contents were read ahead, else the path
+def buffer_source(path, data=None):
+    return io.BytesIO(data) if data is not None else path
+
+
+# Function to run func(path, data) on a prefetched file (module-level, so it can run in worker processes)
+def call_prefetched(func, item):
+    return func(item.path, item.data)
+
+
+# Function to ask the OS to start reading a whole file into the page cache, without waiting for it
+def advise_willneed(path):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+class Prefetcher:
+    def __init__(self, threads=PREFETCH_THREADS, max_files=PREFETCH_FILES, max_bytes=PREFETCH_BYTES,
+                 max_file_bytes=MAX_PREFETCH_FILE_BYTES):
+        self.threads = threads
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.buffered = 0  # Bytes reserved by reads in flight or read but not yet handed over
+        self.peak_buffered = 0
+
+    # Returns the bytes to reserve for reading a file ahead, or 0 if it is to be decoded from its path
+    def _reservation(self, path):
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            return 0
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return 0  # Left to the decoder, which opens the path and reports the error
+        return size if size <= self.max_file_bytes else 0
+
+    # Returns the contents of a file, or None if it is to be opened from its path. Read errors are
+    # left to the decoder, which opens the path and reports them as it always has.
+    def _read(self, path, reserved):
+        try:
+            if not reserved:
+                advise_willneed(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read(reserved + 1)
+        except OSError as e:
+            logging.debug(f"Could not read {path} ahead: {e}")
+            return None
+        if len(data) > reserved:  # Grew since it was sized; never hold more than was reserved
+            return None
+        return data
+
+    # Yields a PrefetchedFile for every path, in order. need(path) may return False for files that
+    # will not be decoded (e.g. cached), which are passed through without reading them.
+    def iterate(self, paths, need=None):
+        if not self.threads:
+            for path in paths:
+                yield PrefetchedFile(path)
+            return
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        pending = deque()  # (path, future or None, bytes reserved)
+        waiting = None  # (path, bytes to reserve) of the next file, until the budget has room for it
+        try:
+            paths = iter(paths)
+            while True:
+                # Each read reserves its file's size before it is submitted and releases it when the file
+                # is handed over, so reads in flight and files waiting to be decoded never hold more than
+                # max_bytes together (a file larger than the budget is only read while nothing else is)
+                while len(pending) < self.max_files:
+                    if waiting is None:
+                        path = next(paths, None)
+                        if path is None:
+                            break
+                        if need is not None and not need(path):
+                            pending.append((path, None, 0))
+                            continue
+                        waiting = (path, self._reservation(path))
+                    path, reserved = waiting
+                    if reserved and self.buffered and self.buffered + reserved > self.max_bytes:
+                        break
+                    waiting = None
+                    self.buffered += reserved
+                    self.peak_buffered = max(self.peak_buffered, self.buffered)
+                    pending.append((path, executor.submit(timed_call, self._read, path, reserved), reserved))
+                METRICS.set_gauge("prefetch_in_flight", len(pending))
+                METRICS.set_gauge("prefetch_buffered_bytes", self.buffered)
+                if not pending:
+                    break
+                path, future, reserved = pending.popleft()
+                data = None
+                if future is not None:
+                    data, seconds = future.result()
+                    METRICS.observe("prefetch_read", seconds)
+                    if data is not None:
+                        METRICS.count("prefetch_bytes", len(data))
+                self.buffered -= reserved
+                yield PrefetchedFile(path, data)
+        finally:
+            self.buffered -= sum(reserved for _, _, reserved in pending)
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,78 @@
+import threading
+from file_actions import ActionExecutor, ActionPlan
+from grouping import DuplicateGroups
+
+# Decoupled duplicate review. The scanner adds every duplicate it finds to a
+# ReviewQueue and keeps going; matches are merged into clusters with
+# union-find (see grouping.py), so every variant of a file ends up in one
+# cluster whichever copy it was matched against. Once the scan is done the GUI
+# shows the clusters for batch decisions, and the chosen actions are applied by
+# an ActionWorker in the background (see file_actions.py) so the GUI stays
+# responsive.
+
+
+class ReviewQueue:
+    def __init__(self, policy=None):
+        self.lock = threading.Lock()
+        self.groups = DuplicateGroups()
+        self.policy = policy  # Keeper policy, grouping.KEEPER_POLICY by default
+
+    def __len__(self):
+        with self.lock:
+            return len(self.groups)
+
+    # Records that path matches original; any file can be matched against several others
+    def add(self, path, original, stage=None, score=None):
+        with self.lock:
+            self.groups.add_edge(path, original, stage, score)
+
+    # Merges the groups a scan has collected, e.g. DuplicateScan.groups
+    def update(self, groups):
+        with self.lock:
+            self.groups.update(groups)
+
+    def duplicate_count(self):
+        with self.lock:
+            return sum(len(group) - 1 for group in self.groups.groups())
+
+    # The clusters found so far, in the order their first files were found
+    def snapshot(self):
+        with self.lock:
+            return self.groups.clusters(self.policy)
+
+
+# Collects the reviewed actions and applies them in parallel on a background thread once closed
+class ActionWorker:
+    def __init__(self, on_progress=None, on_finished=None, executor=None):
+        self.executor = executor or ActionExecutor(on_progress=on_progress)
+        self.on_finished = on_finished
+        self.plan = ActionPlan()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def journal_path(self):
+        return self.executor.journal_path
+
+    # Queue an action ("delete", "quarantine", "hardlink" or "reflink") for a duplicate of keeper
+    def submit(self, path, action="delete", keeper=None):
+        self.plan.add(action, path, keeper)
+
+    # Signal that no more actions will be submitted and start applying them; on_finished runs when done
+    def close(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.executor.cancel()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def _run(self):
+        try:
+            done, failed = self.executor.run(self.plan)
+        except ValueError as e:  # Conflicting plan, nothing was applied
+            if self.executor.on_progress is not None:
+                self.executor.on_progress(str(e))
+            done, failed = 0, len(self.plan)
+        if self.on_finished is not None:
+            self.on_finished(done, failed)
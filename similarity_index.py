@@ -0,0 +1,202 @@
+import logging
+import numpy as np
+from compact_embedding import quantize_int8, quantized_similarities
+
+# Similarity indexes used to look up near-duplicate feature vectors.
+# Both backends keep every vector L2-normalized in one contiguous matrix, so a
+# cosine similarity is a single dot product and a query is one matrix-vector product.
+# The matrix can be stored as float32, float16 or int8 (with a per-row scale);
+# similarities are computed directly on the stored matrix.
+
+
+# Function to L2-normalize a single vector (zero vectors are left as zeros)
+def normalize_vector(vector, dtype=np.float32):
+    vector = np.asarray(vector, dtype=dtype).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+# Function to turn a similarity array into sorted (position, similarity) pairs
+def select_matches(similarities, k=None, threshold=None):
+    positions = np.arange(len(similarities))
+    if threshold is not None:
+        keep = similarities >= threshold
+        positions = positions[keep]
+        similarities = similarities[keep]
+    if k is not None and k < len(similarities):
+        top = np.argpartition(-similarities, k - 1)[:k]
+        positions = positions[top]
+        similarities = similarities[top]
+    order = np.argsort(-similarities, kind="stable")
+    return [(int(positions[i]), float(similarities[i])) for i in order]
+
+
+# Growable contiguous matrix of normalized vectors shared by the index backends
+class VectorStore:
+    def __init__(self, dim=None, initial_capacity=1024, dtype=np.float32):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.matrix = None
+        self.scales = None  # Per-row scale factors when stored as int8
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _ensure_capacity(self, dim):
+        if self.matrix is None:
+            if self.dim is None:
+                self.dim = dim
+            self.matrix = np.zeros((self.initial_capacity, self.dim), dtype=self.dtype)
+            self.scales = np.ones(self.initial_capacity, dtype=np.float32)
+        if dim != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {dim}")
+        if len(self.keys) == self.matrix.shape[0]:
+            # Double the capacity so incremental inserts stay amortized O(1)
+            grown = np.zeros((self.matrix.shape[0] * 2, self.dim), dtype=self.dtype)
+            grown[:len(self.keys)] = self.matrix[:len(self.keys)]
+            self.matrix = grown
+            scales = np.ones(grown.shape[0], dtype=np.float32)
+            scales[:len(self.keys)] = self.scales[:len(self.keys)]
+            self.scales = scales
+
+    def add(self, key, vector):
+        vector = normalize_vector(vector)
+        self._ensure_capacity(vector.shape[0])
+        position = len(self.keys)
+        if self.dtype == np.int8:
+            self.matrix[position], self.scales[position] = quantize_int8(vector)
+        else:
+            self.matrix[position] = vector
+        self.keys.append(key)
+        return position
+
+    def vectors(self):
+        if self.matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        return self.matrix[:len(self.keys)]
+
+    # Cosine similarities of a normalized query against all rows, or only the given positions
+    def similarities(self, query, positions=None):
+        matrix = self.vectors()
+        scales = self.scales[:len(self.keys)] if self.dtype == np.int8 else None
+        if positions is not None:
+            matrix = matrix[positions]
+            scales = scales[positions] if scales is not None else None
+        return quantized_similarities(matrix, query, scales)
+
+
+# Exact brute-force index: scores the query against every stored vector at once
+class ExactIndex:
+    def __init__(self, dim=None, initial_capacity=1024, dtype=np.float32):
+        self.store = VectorStore(dim, initial_capacity, dtype)
+
+    def __len__(self):
+        return len(self.store)
+
+    def add(self, key, vector):
+        self.store.add(key, vector)
+
+    def query(self, vector, k=None, threshold=None):
+        if len(self.store) == 0:
+            return []
+        query = normalize_vector(vector)
+        similarities = self.store.similarities(query)
+        return [(self.store.keys[position], similarity)
+                for position, similarity in select_matches(similarities, k, threshold)]
+
+
+# Approximate index using random-projection LSH (signed random hyperplanes).
+# Each of n_tables tables hashes a vector to an n_bits code; candidates from the
+# matching buckets are re-ranked exactly against the stored matrix.
+# Recall vs. speed is tuned with n_tables (more tables, more candidates) and
+# probes (how many extra buckets per table to visit by flipping the least
+# confident bits of the query code).
+class LSHIndex:
+    def __init__(self, dim=None, n_tables=8, n_bits=16, probes=0, seed=0, initial_capacity=1024,
+                 dtype=np.float32):
+        if n_bits > 62:
+            raise ValueError("n_bits must be at most 62")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.probes = probes
+        self.seed = seed
+        self.store = VectorStore(dim, initial_capacity, dtype)
+        self.tables = [{} for _ in range(n_tables)]
+        self.planes = None
+        self.bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.store)
+
+    def _project(self, vector):
+        if self.planes is None:
+            rng = np.random.default_rng(self.seed)
+            self.planes = rng.standard_normal((self.n_tables * self.n_bits, vector.shape[0])).astype(np.float32)
+        return (self.planes @ vector).reshape(self.n_tables, self.n_bits)
+
+    def _codes(self, projections):
+        return ((projections > 0).astype(np.int64) * self.bit_weights).sum(axis=1)
+
+    def add(self, key, vector):
+        position = self.store.add(key, vector)
+        projections = self._project(normalize_vector(vector))
+        for table, code in zip(self.tables, self._codes(projections)):
+            table.setdefault(int(code), []).append(position)
+
+    def _candidates(self, projections):
+        candidates = set()
+        codes = self._codes(projections)
+        for table_index, table in enumerate(self.tables):
+            code = int(codes[table_index])
+            candidates.update(table.get(code, ()))
+            if self.probes:
+                # Flip the bits whose projections are closest to the hyperplane first
+                uncertain = np.argsort(np.abs(projections[table_index]))[:self.probes]
+                for bit in uncertain:
+                    candidates.update(table.get(code ^ (1 << int(bit)), ()))
+        return np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+
+    def query(self, vector, k=None, threshold=None):
+        if len(self.store) == 0:
+            return []
+        query = normalize_vector(vector)
+        candidates = self._candidates(self._project(query))
+        if len(candidates) == 0:
+            return []
+        similarities = self.store.similarities(query, candidates)
+        return [(self.store.keys[candidates[position]], similarity)
+                for position, similarity in select_matches(similarities, k, threshold)]
+
+
+INDEX_BACKENDS = {
+    "exact": ExactIndex,
+    "lsh": LSHIndex,
+}
+
+
+# Function to create a similarity index by backend name ("exact" or "lsh")
+def make_index(kind="exact", **options):
+    try:
+        backend = INDEX_BACKENDS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown similarity index backend: {kind}")
+    logging.debug(f"Creating {kind} similarity index with options {options}")
+    return backend(**options)
+
+
+# Function to measure how many exact matches an approximate index also returns
+def measure_recall(exact_index, approximate_index, queries, k=None, threshold=None):
+    expected_total = 0
+    found_total = 0
+    for query in queries:
+        expected = {key for key, _ in exact_index.query(query, k=k, threshold=threshold)}
+        found = {key for key, _ in approximate_index.query(query, k=k, threshold=threshold)}
+        expected_total += len(expected)
+        found_total += len(expected & found)
+    if expected_total == 0:
+        return 1.0
+    return found_total / expected_total
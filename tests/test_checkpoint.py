@@ -0,0 +1,81 @@
+import os
+import pytest
+from checkpoint import ScanCheckpoint, checkpoint_path
+from feature_cache import FeatureCache
+
+# A checkpoint must give back exactly the state it saved, and nothing at all
+# to a scan with other settings or from a damaged file. An exact scan that is
+# aborted and resumed from its checkpoint must report the same duplicates as
+# one uninterrupted scan.
+
+SETTINGS = {"roots": ["/photos"], "method": "exact"}
+
+
+def test_round_trip(tmp_path):
+    checkpoint = ScanCheckpoint(str(tmp_path / "nested" / "scan.pickle"))
+    assert not checkpoint.exists()
+    state = {"processed": {"/photos/a.jpg"}, "pending": {"/photos/b.jpg": ("/photos/b.jpg", "/photos/a.jpg")}}
+    checkpoint.save(SETTINGS, state)
+    assert checkpoint.exists()
+    assert checkpoint.load(SETTINGS) == state
+    assert checkpoint.load(dict(SETTINGS, method="phash")) is None
+    checkpoint.remove()
+    assert checkpoint.load(SETTINGS) is None
+
+
+def test_damaged_checkpoint_is_ignored(tmp_path):
+    checkpoint = ScanCheckpoint(str(tmp_path / "scan.pickle"))
+    checkpoint.save(SETTINGS, {"processed": set()})
+    with open(checkpoint.path, "r+b") as f:
+        f.truncate(10)
+    assert checkpoint.load(SETTINGS) is None
+
+
+def test_path_depends_on_the_roots_only(tmp_path):
+    assert checkpoint_path(["/b", "/a"], str(tmp_path)) == checkpoint_path(["/a", "/b/"], str(tmp_path))
+    assert checkpoint_path(["/a"], str(tmp_path)) != checkpoint_path(["/a", "/b"], str(tmp_path))
+
+
+@pytest.fixture
+def photos(tmp_path):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    for group in range(6):
+        for copy in range(3):
+            (folder / f"g{group}_{copy}.jpg").write_bytes(f"group {group} ".encode() * (group + 10))
+    return str(folder)
+
+
+def scan(photos, tmp_path, checkpoint=None, resume=False):
+    pytest.importorskip("cv2")
+    pytest.importorskip("imagehash")
+    from mediamatch_core import DuplicateScan
+    cache = FeatureCache(str(tmp_path / "cache.sqlite"))
+    return DuplicateScan([photos], method="exact", cache=cache, checkpoint=checkpoint, resume=resume)
+
+
+def test_aborted_scan_resumes(photos, tmp_path):
+    uninterrupted = scan(photos, tmp_path)
+    expected = {duplicate[0] for duplicate in uninterrupted}
+    uninterrupted.close()
+    assert len(expected) == 12
+
+    checkpoint = ScanCheckpoint(str(tmp_path / "scan.pickle"))
+    first = scan(photos, tmp_path, checkpoint)
+    found = []
+    for duplicate in first:
+        found.append(duplicate[0])
+        first.abort()
+    first.close()
+    assert first.resumable and not first.completed and len(found) < len(expected)
+    assert checkpoint.exists()
+
+    resumed = scan(photos, tmp_path, checkpoint, resume=True)
+    assert resumed.resumed
+    again = [duplicate[0] for duplicate in resumed]
+    resumed.close()
+    assert resumed.completed
+    assert again[0] == found[0]  # Never resolved, so offered again first
+    assert set(found) | set(again) == expected
+    assert len(again) == len(set(again))
+    assert not checkpoint.exists()
@@ -0,0 +1,85 @@
+import os
+import pytest
+from dedup_pipeline import DedupPipeline
+
+# DedupPipeline must only ever report unique files as originals: a byte copy of
+# a file the pHash stage flagged is reported against that file's original,
+# whether files are checked one at a time or run through a hash stream that
+# reads ahead of the funnel.
+
+# Hashes by file name, so files with different bytes can share a hash
+HASHES = {"photo": 0b1011, "resized": 0b1010, "resized_copy": 0b1010, "other": 0xFFFF0000}
+
+
+def write(folder, name, data):
+    path = os.path.join(str(folder), name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return [
+        write(tmp_path, "photo", b"original pixels"),
+        write(tmp_path, "resized", b"resized pixels"),
+        write(tmp_path, "resized_copy", b"resized pixels"),
+        write(tmp_path, "other", b"other pixels"),
+    ]
+
+
+def file_hash(path):
+    return HASHES[os.path.basename(path)]
+
+
+# Hashes every path before handing any on, like a worker pool far ahead of the funnel
+def read_ahead(paths):
+    return [(path, file_hash(path)) for path in list(paths)]
+
+
+def test_check_resolves_copies_of_duplicates(paths):
+    photo, resized, resized_copy, other = paths
+    pipeline = DedupPipeline(file_hash, match_distance=2)
+    results = {path: pipeline.check(path) for path in paths}
+    assert results == {photo: None, resized: (photo, "phash", 1), resized_copy: (photo, "phash", 1), other: None}
+    assert pipeline.unique == 2
+
+
+@pytest.mark.parametrize("hash_stream", [None, read_ahead])
+def test_run_resolves_copies_of_duplicates(paths, hash_stream):
+    photo, resized, resized_copy, other = paths
+    pipeline = DedupPipeline(file_hash, match_distance=2)
+    decided = []
+    pipeline.on_decided = lambda path, duplicate: decided.append(path)
+    duplicates = list(pipeline.run(paths, hash_stream=hash_stream))
+    assert sorted(duplicates) == [(resized, photo, "phash", 1), (resized_copy, photo, "phash", 1)]
+    assert sorted(decided) == sorted(paths)
+
+
+def test_edges_keep_the_byte_copy(paths):
+    photo, resized, resized_copy, _ = paths
+    pipeline = DedupPipeline(file_hash, match_distance=2)
+    edges = []
+    pipeline.on_edge = lambda path, other, stage, score: edges.append((path, other, stage))
+    list(pipeline.run(paths))
+    assert (resized_copy, resized, "exact") in edges
+    assert (resized, photo, "phash") in edges
+
+
+def test_copy_falls_back_once_the_original_is_removed(paths):
+    photo, resized, resized_copy, _ = paths
+    pipeline = DedupPipeline(file_hash, match_distance=2)
+    pipeline.check(photo)
+    pipeline.check(resized)
+    assert pipeline.remove(photo)
+    assert pipeline.check(resized_copy) == (resized, "exact", 1.0)
+
+
+def test_state_round_trip_keeps_resolved_matches(paths):
+    photo, resized, resized_copy, _ = paths
+    pipeline = DedupPipeline(file_hash, match_distance=2)
+    pipeline.check(photo)
+    pipeline.check(resized)
+    restored = DedupPipeline(file_hash, match_distance=2)
+    restored.restore(pipeline.state())
+    assert restored.check(resized_copy) == (photo, "phash", 1)
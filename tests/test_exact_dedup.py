@@ -0,0 +1,67 @@
+import os
+from exact_dedup import ExactDuplicateFinder
+
+# ExactDuplicateFinder must report byte-identical files against the first copy
+# seen, never report files that merely share a size or are empty, and give the
+# same answers from check() as from iter_check().
+
+BLOCK = 64 * 1024
+
+
+def write(folder, name, data):
+    path = os.path.join(str(folder), name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def corpus(folder):
+    head = bytes(range(256)) * (4 * BLOCK // 256)
+    return [
+        write(folder, "a.jpg", head),
+        write(folder, "empty.jpg", b""),
+        write(folder, "b.jpg", head[:BLOCK + 1] + b"x" + head[BLOCK + 2:]),  # Differs outside the partial hash
+        write(folder, "a_copy.jpg", head),
+        write(folder, "empty_copy.jpg", b""),
+        write(folder, "small.jpg", b"small"),
+        write(folder, "a_copy2.jpg", head),
+    ]
+
+
+def expected(paths):
+    a, _, _, a_copy, _, _, a_copy2 = paths
+    return {a_copy: a, a_copy2: a}
+
+
+def test_check_finds_only_identical_copies(tmp_path):
+    paths = corpus(tmp_path)
+    finder = ExactDuplicateFinder()
+    found = {path: finder.check(path) for path in paths}
+    assert {path: original for path, original in found.items() if original} == expected(paths)
+
+
+def test_iter_check_matches_check(tmp_path):
+    paths = corpus(tmp_path)
+    found = dict(ExactDuplicateFinder().iter_check(paths, workers=3, max_in_flight=4))
+    assert list(found) == paths
+    assert {path: original for path, original in found.items() if original} == expected(paths)
+
+
+def test_empty_files_are_not_stored(tmp_path):
+    paths = corpus(tmp_path)
+    finder = ExactDuplicateFinder()
+    for path in paths:
+        finder.check(path)
+    assert os.path.join(str(tmp_path), "empty.jpg") not in finder
+    assert 0 not in finder.by_size
+
+
+def test_remove_forgets_the_original(tmp_path):
+    paths = corpus(tmp_path)
+    a, a_copy = paths[0], paths[3]
+    finder = ExactDuplicateFinder()
+    finder.check(a)
+    assert finder.remove(a)
+    assert not finder.remove(a)
+    assert finder.check(a_copy) is None
+    assert finder.check(a) == a_copy
@@ -0,0 +1,75 @@
+import os
+import time
+import numpy as np
+import pytest
+from feature_cache import FeatureCache
+
+# FeatureCache must return a value only while the file is unchanged, keep
+# 64-bit hashes and arrays intact, and prune only stale entries under the
+# roots that were scanned.
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with FeatureCache(str(tmp_path / "cache.sqlite")) as cache:
+        yield cache
+
+
+def write(path, data=b"data"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_values_round_trip(tmp_path, cache):
+    path = write(tmp_path / "a.jpg")
+    cache.put(path, "phash", 0xFFFFFFFFFFFFFFFF)
+    cache.put(path, "features", np.arange(6, dtype=np.float32).reshape(2, 3))
+    assert cache.get(path, "phash") == 0xFFFFFFFFFFFFFFFF
+    np.testing.assert_array_equal(cache.get(path, "features"), np.arange(6, dtype=np.float32).reshape(2, 3))
+    assert cache.get(path, "multihash") is None
+
+
+def test_changed_file_is_a_miss(tmp_path, cache):
+    path = write(tmp_path / "a.jpg")
+    cache.put(path, "phash", 1)
+    write(tmp_path / "a.jpg", b"changed")
+    assert cache.get(path, "phash") is None
+    assert cache.get_or_compute(path, "phash", lambda p: 2) == 2
+    assert cache.get(path, "phash") == 2
+
+
+def test_prune_only_under_scanned_roots(tmp_path, cache):
+    scanned = tmp_path / "photos"
+    kept = write(scanned / "kept.jpg")
+    deleted = write(scanned / "deleted.jpg")
+    sibling = write(tmp_path / "photos2" / "deleted.jpg")  # Shares the root as a string prefix
+    unmounted = write(tmp_path / "usb" / "a.jpg")
+    for path in (kept, deleted, sibling, unmounted):
+        cache.put(path, "phash", 1)
+    for path in (deleted, sibling, unmounted):
+        os.remove(path)
+    os.rmdir(tmp_path / "usb")
+
+    assert cache.prune_stale([str(scanned), str(tmp_path / "usb")]) == 1
+    rows = {path for path, in cache.connection.execute("SELECT path FROM entries")}
+    assert rows == {kept, sibling, unmounted}
+
+
+def test_prune_a_root_with_a_trailing_separator(tmp_path, cache):
+    path = write(tmp_path / "photos" / "a.jpg")
+    cache.put(path, "phash", 1)
+    os.remove(path)
+    assert cache.prune_stale([str(tmp_path / "photos") + os.sep]) == 1
+
+
+def test_evict_least_recently_used(tmp_path, cache):
+    paths = [write(tmp_path / f"{i}.jpg") for i in range(4)]
+    for path in paths:
+        cache.put(path, "features", np.zeros(100, dtype=np.float32))
+        time.sleep(0.01)  # Distinct last-used times
+    cache.get(paths[0], "features")  # Recently used, so it stays
+    per_entry = cache.total_bytes() // 4
+    assert cache.evict(2 * per_entry) == 2
+    assert cache.get(paths[0], "features") is not None
+    assert cache.get(paths[1], "features") is None and cache.get(paths[2], "features") is None
@@ -0,0 +1,101 @@
+import os
+import pytest
+from file_actions import ActionExecutor, ActionPlan, purge, read_journal, undo
+
+# ActionExecutor must journal every action it applies, refuse plans and links
+# that could lose the only copy of a file, and undo must put every
+# quarantined or linked file back as it was, while purge deletes the
+# quarantine and retires the journal.
+
+
+def write(folder, name, data):
+    path = os.path.join(str(folder), name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def files(tmp_path):
+    media = tmp_path / "media"
+    media.mkdir()
+    return {name: write(media, name, data) for name, data in [
+        ("keep.jpg", b"kept bytes"),
+        ("copy.jpg", b"kept bytes"),
+        ("copy2.jpg", b"kept bytes"),
+        ("resized.jpg", b"other bytes"),
+    ]}
+
+
+@pytest.fixture
+def executor(tmp_path):
+    return ActionExecutor(journal_path=str(tmp_path / "journal.jsonl"),
+                          quarantine_dir=str(tmp_path / "quarantine"), workers=4)
+
+
+def test_apply_journals_and_undo_restores(files, executor):
+    os.utime(files["copy.jpg"], ns=(1_000_000_000, 1_000_000_000))
+    plan = ActionPlan()
+    plan.add("quarantine", files["resized.jpg"], files["keep.jpg"])
+    plan.add("hardlink", files["copy.jpg"], files["keep.jpg"])
+    assert executor.run(plan) == (2, 0)
+    assert not os.path.exists(files["resized.jpg"])
+    assert os.path.samefile(files["copy.jpg"], files["keep.jpg"])
+
+    records = {record["action"]: record for record in read_journal(executor.journal_path)}
+    assert read(records["quarantine"]["target"]) == b"other bytes"
+    assert records["hardlink"]["freed"] == len(b"kept bytes")
+
+    assert undo(executor.journal_path, workers=2) == (2, 0)
+    assert read(files["resized.jpg"]) == b"other bytes"
+    assert not os.path.samefile(files["copy.jpg"], files["keep.jpg"])
+    assert os.stat(files["copy.jpg"]).st_mtime_ns == 1_000_000_000
+    assert not os.path.exists(executor.journal_path)
+    assert os.path.exists(executor.journal_path + ".undone")
+
+
+def test_undo_reports_deletions_and_keeps_the_journal(files, executor):
+    plan = ActionPlan()
+    plan.add("delete", files["copy.jpg"], files["keep.jpg"])
+    plan.add("quarantine", files["copy2.jpg"], files["keep.jpg"])
+    executor.run(plan)
+    assert executor.freed_bytes == len(b"kept bytes")
+    assert undo(executor.journal_path) == (1, 1)
+    assert read(files["copy2.jpg"]) == b"kept bytes"
+    assert os.path.exists(executor.journal_path)  # The failure can be looked at and retried
+
+
+def test_unsafe_plans_are_refused(files, executor):
+    plan = ActionPlan()
+    plan.add("delete", files["copy.jpg"], files["keep.jpg"])
+    plan.add("delete", files["keep.jpg"], files["copy.jpg"])
+    with pytest.raises(ValueError):
+        executor.run(plan)
+    assert all(os.path.exists(path) for path in files.values())
+    assert not os.path.exists(executor.journal_path)
+
+
+def test_actions_without_their_keeper_fail(files, executor):
+    os.remove(files["keep.jpg"])
+    plan = ActionPlan()
+    plan.add("delete", files["copy.jpg"], files["keep.jpg"])
+    plan.add("hardlink", files["resized.jpg"], files["copy2.jpg"])  # Not byte-identical
+    assert executor.run(plan) == (0, 2)
+    assert read(files["copy.jpg"]) == b"kept bytes"
+    assert read(files["resized.jpg"]) == b"other bytes"
+    assert read_journal(executor.journal_path) == []
+
+
+def test_purge_deletes_the_quarantine(files, executor):
+    plan = ActionPlan()
+    plan.add("quarantine", files["copy.jpg"], files["keep.jpg"])
+    executor.run(plan)
+    target = read_journal(executor.journal_path)[0]["target"]
+    assert purge(executor.journal_path) == len(b"kept bytes")
+    assert not os.path.exists(target)
+    assert os.path.exists(executor.journal_path + ".purged")
@@ -0,0 +1,76 @@
+import os
+import random
+import pytest
+
+pytest.importorskip("cv2")
+from PIL import Image
+from grouping import DuplicateGroups, UnionFind, choose_keeper
+
+# Matches must merge into the same groups whatever order they arrive in, and
+# each group must keep the same file under a policy however it was scanned.
+
+
+def test_union_find_merges_sets():
+    sets = UnionFind()
+    elements = [sets.add() for _ in range(6)]
+    sets.union(elements[0], elements[1])
+    sets.union(elements[2], elements[3])
+    sets.union(elements[1], elements[3])
+    assert len({sets.find(element) for element in elements[:4]}) == 1
+    assert sets.find(elements[4]) != sets.find(elements[5])
+    assert sets.size[sets.find(elements[0])] == 4
+
+
+def test_groups_do_not_depend_on_edge_order():
+    edges = [("b", "a", "exact", 1.0), ("c", "b", "phash", 2), ("e", "d", "cnn", 0.95), ("f", "c", "phash", 4)]
+    expected = None
+    for seed in range(5):
+        shuffled = list(edges)
+        random.Random(seed).shuffle(shuffled)
+        groups = DuplicateGroups()
+        groups.add_edges(shuffled)
+        found = sorted(sorted(group) for group in groups.groups())
+        assert expected is None or found == expected
+        expected = found
+    assert expected == [["a", "b", "c", "f"], ["d", "e"]]
+
+
+def test_update_merges_groups():
+    groups, other = DuplicateGroups(), DuplicateGroups()
+    groups.add_edge("b", "a", "exact", 1.0)
+    other.add_edge("c", "b", "phash", 3)
+    other.add_edge("e", "d", "phash", 1)
+    groups.update(other)
+    assert sorted(groups.group_of("c")) == ["a", "b", "c"]
+    assert len(groups) == 2
+    assert groups.group_of("unknown") == ["unknown"]
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = {}
+    for name, size, mtime in [("small.png", (40, 30), 3), ("large.png", (80, 60), 2), ("old.png", (40, 30), 1)]:
+        path = paths[name] = str(tmp_path / name)
+        Image.new("RGB", size, (200, 10, 10)).save(path)
+        os.utime(path, ns=(mtime * 10 ** 9, mtime * 10 ** 9))
+    return paths
+
+
+def test_keeper_policies(images):
+    paths = list(images.values())
+    assert choose_keeper(paths, "resolution") == images["large.png"]
+    assert choose_keeper(paths, "oldest") == images["old.png"]
+    assert choose_keeper(paths, "size") == images["large.png"]
+    with pytest.raises(ValueError):
+        choose_keeper(paths, "newest")
+
+
+def test_cluster_proposal(images):
+    groups = DuplicateGroups()
+    groups.add_edge(images["large.png"], images["small.png"], "phash", 2)
+    groups.add_edge(images["old.png"], images["small.png"], "exact", 1.0)
+    cluster, = groups.clusters("resolution")
+    keeper, rest = cluster.proposal()
+    assert keeper == images["large.png"]
+    assert sorted(rest) == sorted([images["small.png"], images["old.png"]])
+    assert dict((path, stage) for path, stage, _ in cluster.duplicates)[images["old.png"]] == "exact"
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from hamming_index import HammingIndex, hamming_distance
+
+# HammingIndex must return exactly the stored hashes within the distance a
+# linear scan finds, and keep doing so as keys are removed and re-added.
+
+COUNT = 2000
+MAX_DISTANCE = 6
+
+
+def flip(code, bits):
+    for bit in bits:
+        code ^= 1 << int(bit)
+    return code
+
+
+@pytest.fixture
+def codes():
+    rng = np.random.default_rng(0)
+    codes = [int(code) for code in rng.integers(0, 2 ** 63, size=COUNT, dtype=np.int64)]
+    # Near copies of the first hashes, so queries have neighbours at every distance
+    codes += [flip(codes[i], rng.choice(64, size=i % (MAX_DISTANCE + 3), replace=False)) for i in range(200)]
+    return codes
+
+
+def scan(stored, query, max_distance=MAX_DISTANCE):
+    matches = [(key, hamming_distance(code, query)) for key, code in stored.items()]
+    return sorted((match for match in matches if match[1] <= max_distance), key=lambda match: (match[1], match[0]))
+
+
+def filled(codes):
+    index = HammingIndex(max_distance=MAX_DISTANCE, initial_capacity=16)  # Also grows the arrays
+    for key, code in enumerate(codes):
+        index.add(key, code)
+    return index
+
+
+def test_query_matches_linear_scan(codes):
+    index = filled(codes)
+    stored = dict(enumerate(codes))
+    assert len(index) == len(codes)
+    for query in codes[:300]:
+        assert index.query(query) == scan(stored, query)
+    assert index.query(codes[0], k=1) == [(0, 0)]
+
+
+def test_remove(codes):
+    index = filled(codes)
+    stored = dict(enumerate(codes))
+    for key in range(0, 300, 3):
+        assert index.remove(key)
+        del stored[key]
+    assert not index.remove(0)
+    assert 0 not in index and 1 in index
+    assert len(index) == len(stored)
+    for query in codes[:300]:
+        assert index.query(query) == scan(stored, query)
+
+
+def test_readd_replaces_the_old_hash(codes):
+    index = filled(codes)
+    stored = dict(enumerate(codes))
+    for key in range(50):
+        stored[key] = codes[key + 1000]
+        index.add(key, stored[key])
+    assert len(index) == len(codes)
+    for key in range(50):
+        assert index.query(codes[key]) == scan(stored, codes[key])
+        assert (key, 0) in index.query(stored[key])
+    for key in range(50):
+        assert index.remove(key)
+        assert all(match[0] != key for match in index.query(codes[key]))
+        assert all(match[0] != key for match in index.query(codes[key + 1000]))
+
+
+def test_removed_slots_are_reused(codes):
+    index = filled(codes[:100])
+    capacity = len(index.codes)
+    for key in range(10):
+        index.remove(key)
+    for key in range(10):
+        index.add(f"new {key}", codes[key])
+    assert len(index.codes) == capacity and len(index.keys) == 100
+    assert index.query(codes[3], k=1) == [("new 3", 0)]
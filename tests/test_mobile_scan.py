@@ -0,0 +1,90 @@
+import os
+import threading
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("imagehash")
+from PIL import Image
+from feature_cache import FeatureCache
+from mobile_scan import MobileScan
+
+# MobileScan must find the resized copies among distinct photos with pHash and
+# with multi-hash matching, both when run on the calling thread and on its
+# worker thread, and must not hash the next file while on_duplicate has paused
+# the scan.
+
+PHOTOS = 6
+
+
+class AlwaysRun:
+    def check(self):
+        return "run", None
+
+
+@pytest.fixture
+def tree(tmp_path):
+    rng = np.random.default_rng(0)
+    root = tmp_path / "DCIM"
+    root.mkdir()
+    copies = set()
+    for i in range(PHOTOS):
+        # Smooth random images, so every photo has its own distinct hashes
+        small = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((256, 256), Image.BILINEAR)
+        image.save(root / f"{i}.png")
+        image.resize((200, 200)).save(root / f"{i}_copy.jpg", quality=90)
+        copies.add(str(root / f"{i}_copy.jpg"))
+    return str(root), copies
+
+
+def make_scan(tree, tmp_path, found, **options):
+    return MobileScan([tree[0]], cache=FeatureCache(str(tmp_path / "cache.sqlite")), power=AlwaysRun(),
+                      on_duplicate=lambda path, matches, stage: found.append((path, matches[0][0])), **options)
+
+
+# Function to return the photo a file was made from ("3" for 3.png and 3_copy.jpg)
+def photo(path):
+    return os.path.splitext(os.path.basename(path))[0].split("_")[0]
+
+
+@pytest.mark.parametrize("multi_hash", [False, True])
+def test_run_finds_copies(tree, tmp_path, multi_hash):
+    found = []
+    scan = make_scan(tree, tmp_path, found, multi_hash=multi_hash).run()
+    assert scan.completed and scan.finished
+    assert len(found) == PHOTOS
+    assert all(photo(path) == photo(original) for path, original in found)  # Either file of a pair may come first
+    assert scan.scanned == 2 * PHOTOS and scan.unique_files() == PHOTOS
+
+
+def test_worker_thread_waits_while_paused(tree, tmp_path):
+    paused_at, resumed_at = [], []
+    done = threading.Event()
+
+    def resume():
+        resumed_at.append(scan.scanned)
+        scan.resume()
+
+    def on_duplicate(path, matches, stage):
+        paused_at.append(scan.scanned)
+        scan.pause()
+        threading.Timer(0.05, resume).start()  # As the popup does once the user has answered
+
+    scan = MobileScan([tree[0]], cache=FeatureCache(str(tmp_path / "cache.sqlite")), power=AlwaysRun(),
+                      on_duplicate=on_duplicate, on_finished=lambda finished: done.set(), multi_hash=True)
+    scan.start(post=lambda func, *args, wait=False: func(*args))
+    assert done.wait(30)
+    assert scan.completed and len(paused_at) == PHOTOS
+    assert resumed_at == paused_at  # Nothing was hashed while the scan was paused
+
+
+def test_abort_stops_the_worker(tree, tmp_path):
+    done = threading.Event()
+    scan = MobileScan([tree[0]], cache=FeatureCache(str(tmp_path / "cache.sqlite")), power=AlwaysRun(),
+                      on_finished=lambda finished: done.set())
+    scan.pause()
+    scan.start(post=lambda func, *args, wait=False: func(*args))
+    scan.abort()
+    assert done.wait(30)
+    assert scan.aborted and not scan.completed and scan.scanned == 0
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+from multi_hash import FAMILIES, RECORD_DTYPE, MultiHashIndex, family_mask, hash_image, record_from_phash, vote
+
+# Records vote for a match by the weighted share of the families both of them
+# have that fall within their match distance. A pHash alone never decides a
+# match, and MultiHashIndex only returns stored records whose vote passes,
+# with max_distance overriding the pHash match distance.
+
+BASE = {"ahash": 0x0F0F0F0F0F0F0F0F, "dhash": 0x123456789ABCDEF0, "phash": 0xFEDCBA9876543210,
+        "whash": 0x00FF00FF00FF00FF, "colorhash": 0x2AAAAAAAAAA}
+
+
+def make_record(flips=None, families=FAMILIES):
+    flips = flips or {}
+    record = np.zeros((), dtype=RECORD_DTYPE)
+    for family in families:
+        record[family] = BASE[family] ^ ((1 << flips.get(family, 0)) - 1)  # Flip the lowest bits
+    record["families"] = family_mask(families)
+    return record
+
+
+def records(*items):
+    return np.stack(items)
+
+
+def test_identical_records_vote_unanimously():
+    assert vote(make_record(), records(make_record()))[0] == 1.0
+
+
+def test_vote_is_weighted_by_family():
+    # pHash (2.0) and dHash (1.5) disagree, the other 2.5 of the 6.0 weight agrees
+    far = make_record({"phash": 30, "dhash": 30})
+    assert vote(make_record(), records(far))[0] == pytest.approx(2.5 / 6.0)
+    # Only colorhash (0.5) disagrees
+    close = make_record({"colorhash": 20})
+    assert vote(make_record(), records(close))[0] == pytest.approx(5.5 / 6.0)
+
+
+def test_only_shared_families_vote():
+    partial = make_record({"ahash": 30}, families=("ahash", "phash", "dhash"))
+    assert vote(make_record(), records(partial))[0] == pytest.approx(3.5 / 4.5)
+
+
+def test_phash_only_records_never_vote():
+    frame = record_from_phash(BASE["phash"])
+    assert vote(make_record(), records(frame))[0] == 0.0
+    assert vote(frame, records(frame))[0] == 0.0
+    assert vote(frame, records(frame), min_families=1)[0] == 1.0
+
+
+def test_index_returns_passing_records_best_first():
+    index = MultiHashIndex()
+    index.add("same", make_record())
+    index.add("recompressed", make_record({"phash": 3, "ahash": 2, "colorhash": 3}))
+    index.add("different", make_record({"phash": 12, "dhash": 40, "ahash": 40}))
+    index.add("frame", record_from_phash(BASE["phash"]))
+    assert index.query(make_record()) == [("same", 0), ("recompressed", 3)]
+    assert index.query(make_record(), k=1) == [("same", 0)]
+    assert len(index) == 4
+
+
+def test_max_distance_sets_the_phash_vote():
+    stored = make_record({"phash": 8, "whash": 20, "colorhash": 20})  # pHash decides the vote
+    loose = MultiHashIndex()
+    strict = MultiHashIndex(max_distance=4)
+    for index in (loose, strict):
+        index.add("stored", stored)
+    assert loose.query(make_record()) == [("stored", 8)]
+    assert strict.query(make_record()) == []
+
+
+def test_resized_image_matches_and_another_does_not():
+    blocks = np.random.default_rng(1).integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize((320, 240), Image.BICUBIC)
+    index = MultiHashIndex()
+    index.add("image", hash_image(image))
+    assert [key for key, _ in index.query(hash_image(image.resize((160, 120))))] == ["image"]
+    assert index.query(hash_image(image.transpose(Image.FLIP_TOP_BOTTOM))) == []
@@ -0,0 +1,88 @@
+import time
+import threading
+import numpy as np
+import pytest
+from prefetch import Prefetcher
+
+# Prefetcher must hand every file over in order with its contents, and the
+# files read ahead (in flight or waiting to be decoded) must never hold more
+# than its byte budget, however many reads it may have in flight.
+
+MAX_BYTES = 1000
+
+
+# Counts the bytes read but not yet handed over, and the most it ever held
+class CountingPrefetcher(Prefetcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.held = 0
+        self.peak_held = 0
+        self.counter_lock = threading.Lock()
+
+    def _read(self, path, reserved):
+        time.sleep(0.002)  # Let reads pile up while the consumer is slow
+        data = super()._read(path, reserved)
+        if data is not None:
+            with self.counter_lock:
+                self.held += len(data)
+                self.peak_held = max(self.peak_held, self.held)
+        return data
+
+    def handed_over(self, data):
+        if data is not None:
+            with self.counter_lock:
+                self.held -= len(data)
+
+
+@pytest.fixture
+def files(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, size in enumerate(rng.integers(1, 400, size=60)):
+        path = tmp_path / f"{i}.jpg"
+        path.write_bytes(bytes(rng.integers(0, 256, size=int(size), dtype=np.uint8)))
+        paths.append(str(path))
+    (tmp_path / "clip.mp4").write_bytes(b"video")  # Decoded from its path, never read ahead
+    (tmp_path / "large.jpg").write_bytes(b"x" * 600)  # Above max_file_bytes
+    return paths + [str(tmp_path / "clip.mp4"), str(tmp_path / "large.jpg")]
+
+
+def consume(prefetcher, paths, need=None):
+    items = []
+    for item in prefetcher.iterate(paths, need):
+        time.sleep(0.001)
+        items.append((item.path, item.data))
+        prefetcher.handed_over(item.data)
+    return items
+
+
+@pytest.mark.parametrize("threads", [1, 4, 32])
+def test_reads_stay_within_the_byte_budget(files, threads):
+    prefetcher = CountingPrefetcher(threads=threads, max_files=64, max_bytes=MAX_BYTES, max_file_bytes=500)
+    items = consume(prefetcher, files)
+    assert [path for path, _ in items] == files
+    for path, data in items[:-2]:
+        with open(path, "rb") as f:
+            assert data == f.read()
+    assert items[-2][1] is None and items[-1][1] is None
+    assert prefetcher.peak_held <= MAX_BYTES
+    assert 0 < prefetcher.peak_buffered <= MAX_BYTES
+    assert prefetcher.buffered == 0
+
+
+def test_file_larger_than_the_budget_is_read_alone(files):
+    prefetcher = CountingPrefetcher(threads=8, max_bytes=300, max_file_bytes=1000)
+    items = consume(prefetcher, files)
+    assert items[-1][1] == b"x" * 600
+    assert prefetcher.peak_buffered == 600  # Only ever reserved on its own
+    assert prefetcher.buffered == 0
+
+
+def test_skipped_and_abandoned_files_release_the_budget(files):
+    prefetcher = CountingPrefetcher(threads=8, max_bytes=MAX_BYTES, max_file_bytes=500)
+    items = consume(prefetcher, files, need=lambda path: not path.endswith("0.jpg"))
+    assert all(data is None for path, data in items if path.endswith("0.jpg"))
+    iterator = prefetcher.iterate(files)
+    next(iterator)
+    iterator.close()
+    assert prefetcher.buffered == 0
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from similarity_index import ExactIndex, LSHIndex, make_index, measure_recall
+
+# The LSH index must find nearly all of the matches the exact index finds on
+# clustered data (groups of near-duplicate vectors), queried with noisy copies
+# of stored vectors by top-k and by similarity threshold.
+
+DIM = 128
+GROUPS = 600
+GROUP_SIZE = 5
+QUERIES = 200
+RECALL_FLOOR = 0.9
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((GROUPS, 1, DIM)).astype(np.float32)
+    base = (centers + 0.2 * rng.standard_normal((GROUPS, GROUP_SIZE, DIM))).reshape(-1, DIM).astype(np.float32)
+    picked = rng.choice(len(base), size=QUERIES, replace=False)
+    queries = base[picked] + 0.1 * rng.standard_normal((QUERIES, DIM)).astype(np.float32)
+    return base, queries, picked
+
+
+def filled(index, vectors):
+    for key, vector in enumerate(vectors):
+        index.add(key, vector)
+    return index
+
+
+@pytest.fixture(scope="module")
+def exact(dataset):
+    return filled(ExactIndex(dim=DIM), dataset[0])
+
+
+@pytest.mark.parametrize("n_tables,n_bits,probes", [(8, 16, 4), (16, 12, 8)])
+@pytest.mark.parametrize("k,threshold", [(1, None), (GROUP_SIZE, None), (None, 0.9), (3, 0.9)])
+def test_lsh_recall(dataset, exact, n_tables, n_bits, probes, k, threshold):
+    lsh = filled(LSHIndex(dim=DIM, n_tables=n_tables, n_bits=n_bits, probes=probes), dataset[0])
+    queries = dataset[1]
+    if threshold is not None:  # The test is only meaningful if the threshold keeps matches
+        assert sum(len(exact.query(query, threshold=threshold)) for query in queries) >= QUERIES * 0.9
+    assert measure_recall(exact, lsh, queries, k=k, threshold=threshold) >= RECALL_FLOOR
+
+
+def test_lsh_results_are_exact_similarities(dataset, exact):
+    lsh = filled(LSHIndex(dim=DIM), dataset[0])
+    expected = dict(exact.query(dataset[1][0], threshold=0.5))
+    for key, similarity in lsh.query(dataset[1][0], threshold=0.5):
+        assert similarity == pytest.approx(expected[key], abs=1e-5)
+
+
+def test_exact_index_finds_the_source_of_every_query(dataset, exact):
+    _, queries, picked = dataset
+    assert [exact.query(query, k=1)[0][0] for query in queries] == picked.tolist()
+
+
+def test_make_index_rejects_unknown_backends():
+    assert isinstance(make_index("lsh", dim=DIM), LSHIndex)
+    with pytest.raises(ValueError):
+        make_index("faiss")
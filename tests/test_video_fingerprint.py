@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("imagehash")
+import video_fingerprint
+from video_fingerprint import BLANK_FRAME, VideoSignatureIndex, iter_sampled_frames, video_signature
+
+# Sampled frames must be the frames at the sample timestamps whether they are
+# reached by grabbing or by seeking, and VideoSignatureIndex must keep every
+# frame of every stored video findable, across removes and re-adds.
+
+FPS = 10
+FRAMES = 120
+
+
+@pytest.fixture(scope="module")
+def numbered_video(tmp_path_factory):
+    # Every frame is flat gray at twice its frame number, so a sampled frame tells where it came from
+    path = str(tmp_path_factory.mktemp("video") / "numbered.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, (64, 48))
+    for number in range(FRAMES):
+        writer.write(np.full((48, 64, 3), 2 * number, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.mark.parametrize("grab_gap", [0, 1000])  # Always seek, always grab
+@pytest.mark.parametrize("interval", [0.5, 3.0])
+def test_sampled_frames_are_at_their_timestamps(numbered_video, monkeypatch, grab_gap, interval):
+    monkeypatch.setattr(video_fingerprint, "GRAB_GAP_FRAMES", grab_gap)
+    samples = list(iter_sampled_frames(numbered_video, interval))
+    assert len(samples) == int(FRAMES / FPS // interval)
+    for timestamp, frame in samples:
+        assert abs(frame.mean() / 2 - int(timestamp * FPS)) < 1.5
+
+
+def test_video_signature(numbered_video):
+    signature = video_signature(numbered_video)
+    assert signature.dtype == np.uint64 and len(signature) == FRAMES // FPS
+
+
+def signatures(count, length=12, seed=0):
+    rng = np.random.default_rng(seed)
+    found = rng.integers(0, 2 ** 63, size=(count, length), dtype=np.int64).astype(np.uint64)
+    found[:, 0] = BLANK_FRAME  # A fade-in
+    return found
+
+
+def test_index_finds_every_stored_frame():
+    index = VideoSignatureIndex()
+    stored = signatures(20)
+    for key, signature in enumerate(stored):
+        index.add(key, signature)
+    assert len(index) == 20 and 3 in index
+    # A trimmed copy only shares the last frames of the original
+    assert index.query(stored[3][6:], k=1) == [(3, 0.0)]
+    assert len(index.frames) == 20 * 11
+
+
+def test_index_remove_and_readd():
+    index = VideoSignatureIndex()
+    stored = signatures(5)
+    replacement = signatures(1, seed=1)[0]
+    for key, signature in enumerate(stored):
+        index.add(key, signature)
+    index.add(2, replacement)
+    assert index.query(stored[2]) == []
+    assert index.query(replacement, k=1) == [(2, 0.0)]
+    assert index.remove(2) and not index.remove(2)
+    assert 2 not in index and index.query(replacement) == []
+    assert len(index.frames) == 4 * 11
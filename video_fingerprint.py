@@ -0,0 +1,250 @@
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+import imagehash
+from PIL import Image
+from hamming_index import HammingIndex, hash_to_int, popcount
+
+# Video fingerprints: a temporal signature of per-frame pHashes sampled at a
+# fixed time interval. Frames are located by frame number. grab() still
+# decodes every frame it skips (only the colour conversion is saved), so it
+# is only used to step over a few frames; further samples are reached by
+# seeking, which decodes from the nearest keyframe instead of the whole
+# stream up to the sample.
+# Signatures are compared with a sliding alignment, so a trimmed or re-encoded
+# copy still lines up with the original.
+
+# Signatures sample one frame per interval. Long videos double the interval until they fit in
+# MAX_SAMPLES, so copies of similar length stay on the same sampling grid.
+SAMPLE_INTERVAL_SECONDS = 1.0
+MAX_SAMPLES = 600
+
+# Sample gaps (in frames) up to which the skipped frames are grabbed instead of seeking
+GRAB_GAP_FRAMES = 12
+
+# Frames darker or flatter than this (fade-ins, black frames) carry no signal
+BLANK_MEAN = 16
+BLANK_STD = 4
+
+# Marks a blank frame in a signature; such positions are ignored when comparing
+BLANK_FRAME = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+class FingerprintStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.videos = 0
+        self.video_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def record(self, video_seconds, wall_seconds):
+        with self.lock:
+            self.videos += 1
+            self.video_seconds += video_seconds
+            self.wall_seconds += wall_seconds
+
+    # Processing time per hour of video, the tracked throughput metric
+    def seconds_per_video_hour(self):
+        if self.video_seconds == 0:
+            return 0.0
+        return self.wall_seconds / self.video_seconds * 3600
+
+    def __str__(self):
+        return (f"{self.videos} videos, {self.video_seconds / 3600:.2f} video-hours in {self.wall_seconds:.1f}s "
+                f"({self.seconds_per_video_hour():.1f}s per video-hour)")
+
+
+stats = FingerprintStats()
+
+
+# Function to check whether a grayscale frame is blank (black, white or flat)
+def is_blank(gray):
+    return gray.mean() < BLANK_MEAN or gray.std() < BLANK_STD
+
+
+# Function to return the timestamps (seconds) to sample, either every interval or count evenly spaced ones
+def sample_timestamps(duration, interval=SAMPLE_INTERVAL_SECONDS, count=None, max_samples=MAX_SAMPLES):
+    if duration <= 0:
+        return [0.0]
+    if count is not None:
+        step = duration / max(1, count)
+        return [step * (i + 0.5) for i in range(max(1, count))]  # Centre of each slot avoids the first frame
+    if duration < interval:
+        return [duration / 2]
+    while duration / interval > max_samples:
+        interval *= 2
+    return [interval * (i + 0.5) for i in range(int(duration // interval))]
+
+
+# Function to return (fps, frame count) of an open capture, 0 where unknown
+def video_geometry(video):
+    return video.get(cv2.CAP_PROP_FPS) or 0, int(video.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+
+# Function to yield (timestamp, BGR frame) pairs sampled from an open capture
+def sampled_frames(video, interval=SAMPLE_INTERVAL_SECONDS, count=None, max_samples=MAX_SAMPLES):
+    fps, frame_count = video_geometry(video)
+    if fps <= 0 or frame_count <= 0:
+        # Unknown length: fall back to the first readable frame
+        ret, frame = video.read()
+        if ret:
+            yield 0.0, frame
+        return
+
+    position = 0  # Frame the next read() returns
+    for timestamp in sample_timestamps(frame_count / fps, interval, count, max_samples):
+        target = min(frame_count - 1, int(timestamp * fps))
+        if target < position or target - position > GRAB_GAP_FRAMES:
+            video.set(cv2.CAP_PROP_POS_FRAMES, target)
+            position = target
+        while position < target:
+            if not video.grab():
+                return
+            position += 1
+        ret, frame = video.read()
+        position += 1
+        if not ret:
+            return
+        yield timestamp, frame
+
+
+# Function to yield (timestamp, BGR frame) pairs sampled from a video
+def iter_sampled_frames(video_path, interval=SAMPLE_INTERVAL_SECONDS, count=None, max_samples=MAX_SAMPLES):
+    video = cv2.VideoCapture(video_path)
+    try:
+        if not video.isOpened():
+            logging.warning(f"Could not open video: {video_path}")
+            return
+        yield from sampled_frames(video, interval, count, max_samples)
+    finally:
+        video.release()
+
+
+# Function to compute the 64-bit pHash of a BGR frame, or BLANK_FRAME for blank frames
+def frame_hash(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)  # Cheap pre-shrink before pHash
+    if is_blank(small):
+        return BLANK_FRAME
+    return np.uint64(hash_to_int(imagehash.phash(Image.fromarray(small))))
+
+
+# Function to build the temporal signature (uint64 array of per-frame pHashes) of a video
+def video_signature(video_path, interval=SAMPLE_INTERVAL_SECONDS, max_samples=MAX_SAMPLES):
+    start = time.perf_counter()
+    video = cv2.VideoCapture(video_path)
+    try:
+        if not video.isOpened():
+            logging.warning(f"Could not open video: {video_path}")
+            return None
+        fps, frame_count = video_geometry(video)
+        hashes = [frame_hash(frame) for _, frame in sampled_frames(video, interval, None, max_samples)]
+    except Exception as e:
+        logging.error(f"Error processing video {video_path}: {e}")
+        return None
+    finally:
+        video.release()
+    if not hashes:
+        return None
+    stats.record(frame_count / fps if fps > 0 else 0.0, time.perf_counter() - start)
+    return np.array(hashes, dtype=np.uint64)
+
+
+# Function to return the pHash of the first non-blank sampled frame of a video
+def representative_hash(video_path, count=8):
+    fallback = None
+    for _, frame in iter_sampled_frames(video_path, count=count):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if fallback is None:
+            fallback = gray
+        if not is_blank(gray):
+            return imagehash.phash(Image.fromarray(gray))
+    if fallback is None:
+        return None
+    return imagehash.phash(Image.fromarray(fallback))
+
+
+# Function to align two signatures and return (mean Hamming distance, offset) of the best alignment.
+# offset is the position in signature1 where signature2 starts; min_overlap is the fraction of the
+# shorter signature that must overlap. Returns (None, None) if no alignment overlaps enough.
+def compare_signatures(signature1, signature2, min_overlap=0.5):
+    signature1 = np.asarray(signature1, dtype=np.uint64)
+    signature2 = np.asarray(signature2, dtype=np.uint64)
+    valid1 = signature1 != BLANK_FRAME
+    valid2 = signature2 != BLANK_FRAME
+    needed = max(1, int(np.ceil(min(valid1.sum(), valid2.sum()) * min_overlap)))
+    best = (None, None)
+    for offset in range(-len(signature2) + 1, len(signature1)):
+        start1, start2 = max(0, offset), max(0, -offset)
+        length = min(len(signature1) - start1, len(signature2) - start2)
+        if length < needed:
+            continue
+        part1 = signature1[start1:start1 + length]
+        part2 = signature2[start2:start2 + length]
+        both = valid1[start1:start1 + length] & valid2[start2:start2 + length]
+        overlap = int(both.sum())
+        if overlap < needed:
+            continue
+        distance = float(popcount(part1[both] ^ part2[both]).mean())
+        if best[0] is None or distance < best[0]:
+            best = (distance, offset)
+    return best
+
+
+# Index of video signatures. Candidate videos are found through a Hamming index
+# over individual frame hashes, stored under (key, frame number), then verified
+# with the sliding alignment.
+class VideoSignatureIndex:
+    def __init__(self, max_distance=10, frame_distance=8, min_overlap=0.5, probe_frames=16):
+        self.max_distance = max_distance
+        self.frame_distance = frame_distance
+        self.min_overlap = min_overlap
+        self.probe_frames = probe_frames
+        self.frames = HammingIndex(max_distance=frame_distance)
+        self.signatures = {}
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    # Stores a signature under a key, replacing the one a key that is already stored had
+    def add(self, key, signature):
+        self.remove(key)
+        signature = np.asarray(signature, dtype=np.uint64)
+        self.signatures[key] = signature
+        for number, frame in enumerate(signature):
+            if frame != BLANK_FRAME:
+                self.frames.add((key, number), int(frame))
+
+    # Removes a stored video and all of its frames; returns False if the key is not stored
+    def remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return False
+        for number, frame in enumerate(signature):
+            if frame != BLANK_FRAME:
+                self.frames.remove((key, number))
+        return True
+
+    # Returns (key, mean distance) pairs for matching videos, closest first
+    def query(self, signature, k=None):
+        signature = np.asarray(signature, dtype=np.uint64)
+        frames = signature[signature != BLANK_FRAME]
+        if len(frames) == 0:
+            return []
+        if len(frames) > self.probe_frames:
+            frames = frames[np.linspace(0, len(frames) - 1, self.probe_frames).astype(int)]
+        candidates = set()
+        for frame in frames:
+            candidates.update(key for (key, _), _ in self.frames.query(int(frame)))
+        matches = []
+        for key in candidates:
+            distance, _ = compare_signatures(self.signatures[key], signature, self.min_overlap)
+            if distance is not None and distance <= self.max_distance:
+                matches.append((key, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches[:k] if k is not None else matches
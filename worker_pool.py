@@ -0,0 +1,127 @@
+import os
+import time
+import signal
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from metrics import METRICS
+
+# Bounded parallel map for CPU-bound decoding and hashing.
+# Items are sent to the pool in chunks, at most max_in_flight chunks are
+# outstanding at any time (so a fast producer such as the directory walker
+# cannot queue up the whole tree), and results are delivered either in input
+# order or as soon as they are ready.
+
+
+# Function to return the default number of workers (one per core)
+def default_workers():
+    return os.cpu_count() or 1
+
+
+# Function to leave Ctrl-C to the parent process (a worker initializer). Ctrl-C reaches every process
+# in the foreground group, and workers killed by it would break the pool under a scan that is
+# stopping cleanly and saving its checkpoint.
+def ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Function to run func over a chunk of items inside a worker, logging failures as None results.
+# Returns the results and the seconds each item took.
+def run_chunk(func, chunk):
+    results, seconds = [], []
+    for item in chunk:
+        start = time.perf_counter()
+        try:
+            results.append(func(item))
+        except Exception as e:
+            logging.error(f"Error processing {item}: {e}")
+            results.append(None)
+        seconds.append(time.perf_counter() - start)
+    return results, seconds
+
+
+# Function to map func over items on a worker pool, yielding (item, result) pairs.
+# func must be a module-level function when use_processes is True. lookup(item)
+# may return a precomputed result, which is passed through without using the pool. With a stage
+# name, the time each item took on the pool goes to that latency histogram, and the number of
+# chunks in flight and of precomputed results to the <stage>_in_flight gauge and <stage>_cached counter.
+def parallel_map(func, items, workers=None, max_in_flight=None, ordered=True, use_processes=True, chunksize=4,
+                 lookup=None, executor=None, stage=None):
+    workers = workers or default_workers()
+    max_in_flight = max_in_flight or workers * 2
+    own_executor = executor is None
+    if own_executor:
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+    items = iter(items)
+    ready = deque()  # Unordered mode: lookup results waiting to be yielded
+    pending = deque() if ordered else {}
+    exhausted = False
+    chunk = []
+
+    def submit(chunk):
+        future = executor.submit(run_chunk, func, chunk)
+        if ordered:
+            pending.append((chunk, future))
+        else:
+            pending[future] = chunk
+
+    try:
+        while True:
+            # Top up the pool until max_in_flight chunks are outstanding
+            while not exhausted and len(pending) < max_in_flight and len(ready) < chunksize * max_in_flight:
+                item = next(items, StopIteration)
+                if item is StopIteration:
+                    exhausted = True
+                    if chunk:
+                        submit(chunk)
+                        chunk = []
+                    break
+                result = lookup(item) if lookup is not None else None
+                if result is None:
+                    chunk.append(item)
+                    if len(chunk) == chunksize:
+                        submit(chunk)
+                        chunk = []
+                elif ordered:
+                    # Queue the precomputed result behind everything submitted before it
+                    if chunk:
+                        submit(chunk)
+                        chunk = []
+                    pending.append(([item], [result]))
+                else:
+                    ready.append((item, result))
+                if result is not None and stage is not None:
+                    METRICS.count(f"{stage}_cached")
+
+            if stage is not None:
+                METRICS.set_gauge(f"{stage}_in_flight", len(pending))
+            while ready:
+                yield ready.popleft()
+            if not pending:
+                if exhausted:
+                    break
+                continue
+
+            if ordered:
+                chunk_items, results = pending.popleft()
+                if not isinstance(results, list):
+                    results, seconds = results.result()
+                else:
+                    seconds = []
+            else:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                future = done.pop()
+                chunk_items = pending.pop(future)
+                results, seconds = future.result()
+            if stage is not None:
+                for item_seconds in seconds:
+                    METRICS.observe(stage, item_seconds)
+            for item, result in zip(chunk_items, results):
+                yield item, result
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)